@@ -29,7 +29,6 @@ from pycopia import logging
 from sqlalchemy import and_
 
 from pycopia import dictlib
-from pycopia import aid
 from pycopia import scheduler
 
 from pycopia.db import models
@@ -70,19 +69,11 @@ class RootContainer(config.Container):
             return self.__dict__["_cache"].__getitem__(key)
         except KeyError:
             pass
+        # Container looks up other names in the config tree, or its snapshot.
         try:
             return super(RootContainer, self).__getattribute__(key)
-        except AttributeError:
-            node = self.__dict__["node"]
-            session = self.__dict__["session"]
-            try:
-                item = config.get_item(session, node, key)
-                if item.value is aid.NULL:
-                    return config.Container(session, item)
-                else:
-                    return item.value
-            except config.NoResultFound as err:
-                raise AttributeError("RootContainer: No attribute or key '%s' found: %s" % (key, err))
+        except AttributeError as err:
+            raise AttributeError("RootContainer: No attribute or key '%s' found: %s" % (key, err))
 
     def __setattr__(self, key, obj):
         if key in self.__class__.__dict__: # to force property access
@@ -133,12 +124,6 @@ class RootContainer(config.Container):
     def copy(self):
         return self.__class__(self.session, self.node, self._cache.copy())
 
-    def commit(self):
-        self.session.commit()
-
-    def rollback(self):
-        self.session.rollback()
-
     def close(self):
         if self.session is not None:
             self.session.close()
@@ -397,10 +382,7 @@ class EnvironmentRuntime(object):
         self._environment = environmentrow
         self._eqcache = {}
         self.logfile = logfile
-        d = {}
-        for prop in environmentrow.attributes:
-            d[prop.type.name] = prop.value
-        self._attributes = d
+        self._attributes = environmentrow.get_all_attributes(session)
 
     def __getitem__(self, name):
         return self._attributes[name]
@@ -447,11 +429,16 @@ class EnvironmentRuntime(object):
         eqlist = self._environment.get_all_equipment_with_role(self._session, rolename)
         first = self._eqcache.get(rolename)
         if first:
-            rlist = [first]
-            rlist.extend([EquipmentRuntime(eq, rolename, self.logfile, self._session) for eq in eqlist if eq.name != first.name])
+            eqlist = [eq for eq in eqlist if eq.name != first.name]
+        attributes = models.Equipment.get_attributes_for(self._session, eqlist)
+        modelattributes = models.EquipmentModel.get_attributes_for(self._session,
+                set(eq.model for eq in eqlist))
+        rlist = [EquipmentRuntime(eq, rolename, self.logfile, self._session,
+                attributes[eq], modelattributes[eq.model]) for eq in eqlist]
+        if first:
+            rlist.insert(0, first)
             return rlist
         else:
-            rlist = [EquipmentRuntime(eq, rolename, self.logfile, self._session) for eq in eqlist]
             if rlist:
                 self._eqcache[rolename] = rlist[0]
                 return rlist
@@ -503,12 +490,13 @@ class EnvironmentRuntime(object):
 
 
 class EquipmentModelRuntime(object):
-    def __init__(self, equipmentmodel):
+    def __init__(self, equipmentmodel, session, attributes=None):
         d = {}
         d["name"] = equipmentmodel.name
         d["manufacturer"] = equipmentmodel.manufacturer.name
-        for prop in equipmentmodel.attributes:
-            d[prop.type.name] = prop.value
+        if attributes is None:
+            attributes = equipmentmodel.get_all_attributes(session)
+        d.update(attributes)
         self._attributes = d
 
     def __str__(self):
@@ -528,7 +516,8 @@ class EquipmentModelRuntime(object):
 
 class EquipmentRuntime(object):
 
-    def __init__(self, equipmentrow, rolename, logfile, session):
+    def __init__(self, equipmentrow, rolename, logfile, session,
+            attributes=None, modelattributes=None):
         self.logfile = logfile
         self.name = equipmentrow.name
         self._equipment = equipmentrow
@@ -544,13 +533,15 @@ class EquipmentRuntime(object):
             d["default_role"] = equipmentrow.software[0].category.name
         else:
             d["default_role"] = None
-        for prop in equipmentrow.attributes: # These may override the attributes above.
-            d[prop.type.name] = prop.value
+        if attributes is None:
+            attributes = equipmentrow.get_all_attributes(session)
+        d.update(attributes) # These may override the attributes above.
         if equipmentrow.account: # Account info takes precedence
             d["login"] = equipmentrow.account.login
             d["password"] = equipmentrow.account.password
         self._attributes = d
-        self._equipmentmodel = EquipmentModelRuntime(equipmentrow.model)
+        self._equipmentmodel = EquipmentModelRuntime(equipmentrow.model, session,
+                modelattributes)
 
     def get_url(self, scheme=None, port=None, path=None, with_account=False):
         attribs = self._attributes
@@ -628,7 +619,7 @@ class EquipmentRuntime(object):
             self._init_controller = None
 
     def get_software(self):
-        return SoftwareRuntime(self._equipment.software[0])
+        return SoftwareRuntime(self._equipment.software[0], self._session)
 
     software = property(get_software)
 
@@ -646,13 +637,12 @@ class EquipmentRuntime(object):
 
 class SoftwareRuntime(object):
 
-    def __init__(self, software):
+    def __init__(self, software, session):
         self.name = software.name
         d = {}
         d["category"] = software.category.name
         d["manufacturer"] = software.manufacturer.name
-        for prop in software.attributes: # These may override the attributes above.
-            d[prop.type.name] = prop.value
+        d.update(software.get_all_attributes(session)) # These may override the attributes above.
         self._attributes = d
 
     def __getitem__(self, name):
@@ -34,10 +34,13 @@ __author__ = 'keith@kdart.com (Keith Dart)'
 
 import sys
 import os
+import errno
+import select
+import signal
+import cPickle as pickle
 
 from pycopia import scheduler
 from pycopia import timelib
-from pycopia import debugger
 from pycopia import UserFile
 from pycopia import dictlib
 from pycopia import module
@@ -45,6 +48,9 @@ from pycopia import methods
 from pycopia.QA import constants
 from pycopia.db.config import ConfigError
 
+# The debugger is only wanted when a test fails in debug mode.
+debugger = module.LazyModule("pycopia.debugger")
+
 
 # exception classes that may be raised by test methods.
 class TestError(AssertionError):
@@ -147,6 +153,11 @@ class Test(object):
 
     OPTIONS = TestOptions({})
     PREREQUISITES = []
+    # Equipment roles in the environment that the test uses. A suite running
+    # tests in parallel never runs two tests using the same equipment at once.
+    # Every test uses the DUT unless it says otherwise, so set this to the
+    # roles actually used (or empty) for tests to run alongside each other.
+    ROLES = ("DUT",)
 
     def __init__(self, config):
         cl = self.__class__
@@ -957,6 +968,58 @@ def timestamp(t):
     return timelib.strftime("%a, %d %b %Y %H:%M:%S %Z", timelib.localtime(t))
 
 
+class ReportRecorder(object):
+    """Stands in for the report object in a worker process of a parallel
+    suite.
+
+    Records the report method calls, so they can be replayed to the real
+    report later.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        def _record(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return _record
+
+
+def _picklable(obj):
+    try:
+        pickle.dumps(obj, 2)
+    except Exception:
+        return repr(obj)
+    return obj
+
+
+def _dump_worker_result(result, abort, calls):
+    try:
+        return pickle.dumps((result, abort, calls), 2)
+    except Exception:
+        calls = [(name, tuple(map(_picklable, args)),
+                dict((k, _picklable(v)) for k, v in kwargs.items()))
+                for name, args, kwargs in calls]
+        return pickle.dumps((result, abort, calls), 2)
+
+
+# Database connections inherited by worker processes. Kept here so they are
+# never closed (and so never disturb the server session of the parent).
+_inherited_pools = []
+
+def _detach_database(config):
+    session = getattr(config, "session", None)
+    if session is not None:
+        engine = session.get_bind()
+        _inherited_pools.append(engine.pool)
+        engine.pool = engine.pool.recreate()
+
+
+# Run state of entries in a parallel suite.
+_PENDING, _RUNNING, _DONE, _SKIPPED = range(4)
+
+
 class TestSuite(object):
     """A Test holder and runner.
 
@@ -968,11 +1031,25 @@ class TestSuite(object):
     overridden), add tests with the `add_test()` method, and then call the
     instance. The 'initialize()' method will be run with the arguments given
     when called.
+
+    If the "workers" configuration value is more than one, tests are run in
+    that many worker processes at the same time instead. See
+    `_run_tests_parallel()`. Only tests that use different equipment run at
+    the same time, and by default every test uses the DUT (see Test.ROLES),
+    so tests must declare their roles to gain anything.
+
+    A test run in a worker process only returns its result. Changes it
+    makes to the configuration, to its test instance, or to other state of
+    the process are lost when the worker exits. Report methods called in a
+    worker return None, since the calls are only recorded there. Tests that
+    depend on such state, or that pass it on to later tests, must be run
+    without workers.
     """
     def __init__(self, cf, nested=0, name=None):
         self.config = cf
         self.report = cf.report
         self._debug = cf.flags.DEBUG
+        self.workers = int(cf.get("workers", 0) or 0)
         self._tests = []
         self._testset = set()
         self._multitestset = set()
@@ -1259,17 +1336,23 @@ class TestSuite(object):
         for prereq in currententry.prerequisites:
             for entry in self._tests[:upto]:
                 if entry.match_prerequisite(prereq):
-                    if entry.result.is_passed():
+                    if entry.result is not None and entry.result.is_passed():
                         continue
                     else:
-                        self.report.add_heading(currententry.inst.test_name, 2)
-                        self.report.diagnostic("Prerequisite: %s" % (prereq,), 2)
-                        self.report.incomplete("Prerequisite did not pass.", 2)
-                        currententry.result = TestResult(constants.INCOMPLETE)
+                        self._prerequisite_failed(currententry, prereq)
                         return False
         return True # No prerequisite or prereq passed.
 
+    def _prerequisite_failed(self, currententry, prereq):
+        self.report.add_heading(currententry.inst.test_name, 2)
+        self.report.diagnostic("Prerequisite: %s" % (prereq,), 2)
+        self.report.incomplete("Prerequisite did not pass.", 2)
+        currententry.result = TestResult(constants.INCOMPLETE)
+
     def _run_tests(self):
+        # The debugger needs the terminal, so debug runs are never parallel.
+        if self.workers > 1 and not self._debug:
+            return self._run_tests_parallel()
         for i, entry in enumerate(self._tests):
             if self._debug < 2 and not self.check_prerequisites(entry, i):
                 continue
@@ -1300,6 +1383,282 @@ class TestSuite(object):
             if rv == constants.ABORT:
                 break
 
+    def _run_tests_parallel(self):
+        """Run tests in worker processes, as many as the workers value at once.
+
+        An entry is started when the earlier entries matching its
+        prerequisites are finished (and passed), and no running test uses the
+        same equipment. Sub-suites run in this process, with nothing else
+        running. Each worker records the report messages of its test, and
+        they are sent to the report here in suite order, so the report is the
+        same as from a sequential run.
+
+        When interrupted, the running tests are stopped, and the suite asks
+        whether to abort as a sequential run does. Tests already finished are
+        reported either way.
+        """
+        tests = self._tests
+        count = len(tests)
+        requires = self._get_requirements()
+        locks = [self._get_locks(entry) for entry in tests]
+        state = [_PENDING] * count
+        recorded = [None] * count
+        failedprereq = {}
+        workers = {} # read fd -> (index, pid, chunks)
+        inuse = set()
+        aborted = None # (index, message)
+        replayed = 0
+        first = 0
+        userabort = False
+        while True:
+            try:
+                while True:
+                    # Report finished entries, in order.
+                    while replayed < count and state[replayed] in (_DONE, _SKIPPED):
+                        self._replay_entry(tests[replayed], recorded[replayed],
+                                failedprereq.get(replayed))
+                        recorded[replayed] = None
+                        if aborted is not None and aborted[0] == replayed:
+                            self.info("Suite aborted by test %s (%s)." % (
+                                    tests[replayed].test_name, aborted[1]))
+                        replayed += 1
+                    if aborted is not None and not workers:
+                        # Report what did finish. The rest is not run.
+                        for i in range(replayed, count):
+                            if state[i] in (_DONE, _SKIPPED):
+                                self._replay_entry(tests[i], recorded[i], failedprereq.get(i))
+                            if aborted[0] == i:
+                                self.info("Suite aborted by test %s (%s)." % (
+                                        tests[i].test_name, aborted[1]))
+                        break
+                    if replayed == count:
+                        break
+                    # Start what can be started.
+                    while first < count and state[first] != _PENDING:
+                        first += 1
+                    for i in range(first, count):
+                        if aborted is not None or len(workers) >= self.workers:
+                            break
+                        if state[i] != _PENDING:
+                            continue
+                        if any(state[j] < _DONE for j in requires[i]):
+                            continue
+                        prereq = self._get_failed_prerequisite(tests[i], requires[i])
+                        if prereq is not None:
+                            state[i] = _SKIPPED
+                            failedprereq[i] = prereq
+                            continue
+                        if locks[i] is None: # sub-suite
+                            if replayed == i and not workers:
+                                state[i] = _RUNNING
+                                try:
+                                    self._run_entry_here(tests[i])
+                                except TestSuiteAbort as err:
+                                    tests[i].result = TestResult(constants.INCOMPLETE)
+                                    aborted = (i, err)
+                                state[i] = _DONE
+                            break # nothing after a sub-suite starts before it is done.
+                        if locks[i] & inuse:
+                            continue
+                        fd, pid = self._start_worker(tests[i])
+                        workers[fd] = (i, pid, [])
+                        inuse.update(locks[i])
+                        state[i] = _RUNNING
+                    if not workers:
+                        continue
+                    # Wait for workers.
+                    try:
+                        readable, w, x = select.select(list(workers), [], [])
+                    except select.error as err:
+                        if err[0] == errno.EINTR:
+                            continue
+                        raise
+                    for fd in readable:
+                        i, pid, chunks = workers[fd]
+                        data = os.read(fd, 65536)
+                        if data:
+                            chunks.append(data)
+                            continue
+                        del workers[fd]
+                        os.close(fd)
+                        status = self._wait_worker(pid)
+                        abort = self._set_worker_result(tests[i], chunks, status)
+                        recorded[i] = abort[1]
+                        if abort[0] is not None and aborted is None:
+                            aborted = (i, abort[0])
+                        inuse.difference_update(locks[i])
+                        state[i] = _DONE
+            except KeyboardInterrupt:
+                # The running tests are stopped, as a sequential run stops
+                # the test it is in.
+                for i in self._stop_workers(workers):
+                    recorded[i] = [("add_heading", (tests[i].test_name, 2), {}),
+                            ("incomplete", ("%s: aborted by user." % (tests[i].test_name,), 2), {})]
+                    inuse.difference_update(locks[i])
+                    state[i] = _DONE
+                if self._nested or self.config.UI.yes_no("Test interrupted. Abort suite?"):
+                    # Go round again, to report what did finish.
+                    userabort = True
+                    if aborted is None:
+                        aborted = (None, None)
+                continue
+            break
+        if userabort:
+            if self._nested:
+                raise TestSuiteAbort("Sub-suite aborted by user.")
+            self.info("Test suite aborted by user.")
+
+    def _get_requirements(self):
+        """Return, for each entry, the set of indexes of earlier entries that
+        match its prerequisites."""
+        byname = {}
+        requires = []
+        for i, entry in enumerate(self._tests):
+            req = set()
+            for prereq in entry.prerequisites:
+                for j in byname.get(prereq.implementation, ()):
+                    if self._tests[j].match_prerequisite(prereq):
+                        req.add(j)
+            requires.append(req)
+            byname.setdefault(entry.test_name, []).append(i)
+        return requires
+
+    def _get_failed_prerequisite(self, entry, requires):
+        for j in sorted(requires):
+            other = self._tests[j]
+            if other.result is None or not other.result.is_passed():
+                for prereq in entry.prerequisites:
+                    if other.match_prerequisite(prereq):
+                        return prereq
+        return None
+
+    def _get_locks(self, entry):
+        """Return the set of equipment names the entry's test uses, or None
+        for a sub-suite."""
+        if isinstance(entry, SuiteEntry):
+            return None
+        try:
+            names = self._equipmentnames
+        except AttributeError:
+            names = self._equipmentnames = {}
+        locks = set()
+        for role in entry.inst.ROLES:
+            name = names.get(role)
+            if name is None:
+                try:
+                    env = self.config.environment
+                    eq = env.DUT if role == "DUT" else env.get_role(role)
+                    name = eq.name
+                except Exception: # no environment or role, lock on role name.
+                    name = role
+                names[role] = name
+            locks.add(name)
+        return frozenset(locks)
+
+    def _start_worker(self, entry):
+        if self.config.flags.VERBOSE:
+            self.config.logfile.note("%s: %r" % (timelib.localtimestamp(), entry))
+        # Don't share buffered output, or a database connection, with the child.
+        self._flush_output()
+        session = getattr(self.config, "session", None)
+        if session is not None:
+            session.commit()
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(rfd)
+                self._run_worker(entry, wfd)
+            finally:
+                os._exit(0)
+        os.close(wfd)
+        return rfd, pid
+
+    def _run_worker(self, entry, fd):
+        _detach_database(self.config)
+        recorder = ReportRecorder()
+        self.report = self.config.report = entry.inst._report = recorder
+        abort = None
+        try:
+            entry.run()
+        except TestSuiteAbort as err:
+            entry.result = TestResult(constants.INCOMPLETE)
+            abort = err
+        except KeyboardInterrupt:
+            abort = "Interrupted"
+        result = entry.result
+        data = _dump_worker_result(None if result is None else int(result),
+                None if abort is None else str(abort), recorder.calls)
+        while data:
+            data = data[os.write(fd, data):]
+        os.close(fd)
+        self._flush_output()
+
+    def _flush_output(self):
+        for fo in (sys.stdout, sys.stderr, getattr(self.config, "logfile", None)):
+            if fo is not None:
+                try:
+                    fo.flush()
+                except Exception:
+                    pass
+
+    def _wait_worker(self, pid):
+        while True:
+            try:
+                return os.waitpid(pid, 0)[1]
+            except OSError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                return None # Reaped elsewhere.
+
+    def _set_worker_result(self, entry, chunks, status):
+        """Set the entry result from what the worker sent. Returns the abort
+        message (None if not aborted), and the recorded report calls."""
+        try:
+            result, abort, calls = pickle.loads(b"".join(chunks))
+        except Exception:
+            entry.result = TestResult(constants.INCOMPLETE)
+            return None, [("add_heading", (entry.test_name, 2), {}),
+                    ("incomplete", ("Worker process exited without a result "
+                            "(status %s)." % (status,), 2), {})]
+        if result is None:
+            entry.result = None
+        else:
+            entry.result = TestResult(constants.TESTRESULTS.find(result))
+        return abort, calls
+
+    def _replay_entry(self, entry, calls, failedprereq):
+        if failedprereq is not None:
+            self._prerequisite_failed(entry, failedprereq)
+            return
+        if calls:
+            for name, args, kwargs in calls:
+                getattr(self.report, name)(*args, **kwargs)
+        if entry.result is None and not isinstance(entry, SuiteEntry):
+            self.report.diagnostic(
+                    "warning: test returned None, assuming INCOMPLETE. "
+                    "Please fix the %s.execute() method." % (entry.test_name))
+
+    def _run_entry_here(self, entry):
+        if self.config.flags.VERBOSE:
+            self.config.logfile.note("%s: %r" % (timelib.localtimestamp(), entry))
+        entry.run()
+
+    def _stop_workers(self, workers):
+        """Stop the workers, and return the indexes of their entries."""
+        stopped = []
+        for fd, (i, pid, chunks) in workers.items():
+            os.close(fd)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+            self._wait_worker(pid)
+            self._tests[i].result = TestResult(constants.INCOMPLETE)
+            stopped.append(i)
+        workers.clear()
+        return sorted(stopped)
+
     def _finalize(self):
         try:
             self.finalize()
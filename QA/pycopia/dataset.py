@@ -6,14 +6,23 @@
 """
 Module for managing time-series data.
 
+Data sets may be read from text (.txt, .csv, .dat) files, or from columnar
+binary (.cds) files. A columnar file has a JSON header with the labels,
+units, and metadata, followed by each column of 64 bit floats in turn. They
+are memory mapped when read, so even very large captures load at once, and
+`iter_timeslices()` pages in only the rows of each slice. Use
+`convert_to_columnar()` to make one from a text data file.
 """
 
 import os
 import re
+import json
+import struct
 import itertools
 
 import numpy
 
+from pycopia import aid
 from pycopia import timespec
 from pycopia import timelib
 from pycopia import datafile
@@ -26,6 +35,16 @@ PQ = physical_quantities.PhysicalQuantity
 # break up column name and measurement unit.
 HEADER_RE = re.compile(r'(\w+)\W*\((\w+)\)')
 
+# Columnar binary file.
+COLUMNAR_EXT = ".cds"
+COLUMNAR_MAGIC = b"\x93PYCDS\x01\n"
+COLUMNAR_DTYPE = "<f8"
+_HEADER_LENGTH = struct.Struct("<I")
+_DATA_ALIGN = 64
+
+# IEEE-488 special values, and their numpy equivalents.
+SPECIAL_VALUES = ((9.91E+37, numpy.nan), (9.9E+37, numpy.inf), (-9.9E+37, -numpy.inf))
+
 
 class DataSet(object):
     """Holds measurement data, label, and unit information.
@@ -52,10 +71,15 @@ class DataSet(object):
             self.timeseries = False
             self._mean = None
 
-    def fromfile(self, filename):
-        headers, measurements = read_array(filename)
-        self.fromarray(measurements, headers)
-        self.metadata.update(datafile.decode_filename(filename))
+    def fromfile(self, filename, mmap=True):
+        if filename.endswith(COLUMNAR_EXT):
+            headers, measurements, metadata = read_columnar(filename, mmap)
+            self.fromarray(measurements, headers)
+            self.metadata.update(metadata)
+        else:
+            headers, measurements = read_array(filename)
+            self.fromarray(measurements, headers)
+            self.metadata.update(datafile.decode_filename(filename))
 
     def fromarray(self, measurements, headers):
         self.measurements = measurements
@@ -168,6 +192,10 @@ class DataSet(object):
             self.write_fileobject(fo)
         return fname
 
+    def write_columnar(self, filename):
+        """Write to a columnar binary file, with the metadata in its header."""
+        write_columnar(filename, self.measurements, self.get_headers(), self.metadata)
+
     def write_fileobject(self, fo):
         for heading in self.get_headers():
             fo.write(repr(heading))
@@ -235,17 +263,13 @@ class DataSet(object):
 
         Yields a new DataSet, starttime (s float), endtime (s float)
         """
-        timemarks = iter(timespec.TimeMarksGenerator(timespan))
-        start = timemarks.next()
-        for end in timemarks:
-            subset = timeslice_array(self.measurements, start, end)
+        for subset, start, end in iter_timeslice_arrays(self.measurements, timespan):
             ds = DataSet()
             ds.measurements = subset
             ds.units = self.units
             ds.labels = self.labels
             ds.metadata = self.metadata
             yield ds, start, end
-            start = end
 
     # properties
     unit = property(get_unit)
@@ -272,33 +296,30 @@ def read_array(filename):
     unused_, filetype = os.path.splitext(filename)
     fo = open(filename, "rU")
     try:
+        header = _read_text_header(fo, filetype)
         if filetype == ".txt":
-            header = map(eval, fo.readline().split("\t"))
             a = numpy.fromfile(fo, dtype="f8", sep="\n\t")
         elif filetype == ".csv":
-            header = map(str.strip, fo.readline().split(","))
             a = numpy.fromiter(_ReadCSV(fo), numpy.float64)
-        elif filetype == ".dat": # gnuplot style data
-            line1 = fo.readline()[2:].split("\t")
-            try:
-                header = map(eval, line1)
-            except (ValueError, SyntaxError): # assume no header line
-                header = line1
-                fo.seek(0)
+        else: # gnuplot style data
             a = numpy.fromfile(fo, dtype="f8", sep="\n")
-        else:
-            raise ValueError(
-                "read_array: Invalid file type. need .txt, .csv, or .dat (got %r)." % 
-                filetype)
     finally:
         fo.close()
     # Data may have SCPI NAN or INF values in it. Convert to numpy
     # equivalents.
-    a = numpy.fromiter(itertools.imap(check_value, a), numpy.float64)
+    fix_special_values(a)
     a.shape = (-1, len(header))
     return header, a
 
 
+def fix_special_values(a):
+    """Replace the special values (see `check_value`) in array a, in place.
+    Returns a."""
+    for special, value in SPECIAL_VALUES:
+        a[a == special] = value
+    return a
+
+
 def check_value(number):
     """Check for NaN and INF special values.
 
@@ -334,6 +355,29 @@ def normalize_time(measurements, start=None, offset=None):
     return measurements.transpose()
 
 
+def iter_timeslice_arrays(measurements, timespan):
+    """Iterate over sections of time of a measurements array.
+
+    Each slice is searched for from the end of the one before, and is a view
+    of the measurements array. Stops at the end of the data.
+
+    Yields slice, starttime, endtime.
+    """
+    times = measurements[:, 0]
+    if not len(times):
+        return
+    beginning = times[0]
+    timemarks = iter(timespec.TimeMarksGenerator(timespan))
+    start = timemarks.next()
+    starti = int(times.searchsorted(beginning + start))
+    for end in timemarks:
+        if starti >= len(times):
+            break
+        endi = starti + int(times[starti:].searchsorted(beginning + end))
+        yield measurements[starti:endi], start, end
+        start, starti = end, endi
+
+
 def timeslice_array(measurements, start, end):
   """Return slice of array from start to end time, in seconds. 
 
@@ -352,6 +396,181 @@ def timeslice_array(measurements, start, end):
 
 
 
+### columnar binary files
+
+def _encode_metadata(metadata):
+    md = {}
+    for name, value in metadata.items():
+        if name == "directory":
+            continue
+        elif name == "timestamp":
+            md[name] = float(value)
+        elif isinstance(value, aid.Enum):
+            md[name] = {"state": str(value)}
+        elif value is None or isinstance(value, (basestring, int, long, float)):
+            md[name] = value
+        else:
+            md[name] = str(value)
+    return md
+
+
+def _decode_metadata(md):
+    states = dict((str(state), state) for state in (datafile.ON, datafile.OFF,
+            datafile.UNKNOWN))
+    metadata = datafile.DataFileData()
+    for name, value in md.items():
+        name = str(name)
+        if name == "timestamp":
+            value = timelib.localtime_mutable(value)
+            value.set_format("%a, %d %b %Y %H:%M:%S %Z")
+        elif isinstance(value, dict):
+            value = states.get(value["state"], datafile.UNKNOWN)
+        elif isinstance(value, unicode):
+            value = str(value)
+        metadata[name] = value
+    return metadata
+
+
+def _write_columnar_header(fo, headers, metadata, rows, columns):
+    header = json.dumps({
+            "headers": list(headers),
+            "metadata": _encode_metadata(metadata or {}),
+            "rows": rows,
+            "columns": columns,
+            "dtype": COLUMNAR_DTYPE,
+            })
+    start = len(COLUMNAR_MAGIC) + _HEADER_LENGTH.size
+    header += " " * (-(start + len(header)) % _DATA_ALIGN)
+    fo.write(COLUMNAR_MAGIC)
+    fo.write(_HEADER_LENGTH.pack(len(header)))
+    fo.write(header)
+    return start + len(header)
+
+
+def read_columnar_header(fo):
+    """Read the header of a columnar file.
+
+    Returns the header dictionary, and the offset of the data.
+    """
+    if fo.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar data file: %r" % (getattr(fo, "name", fo),))
+    length, = _HEADER_LENGTH.unpack(fo.read(_HEADER_LENGTH.size))
+    header = json.loads(fo.read(length))
+    header["headers"] = map(str, header["headers"])
+    return header, len(COLUMNAR_MAGIC) + _HEADER_LENGTH.size + length
+
+
+def write_columnar(filename, measurements, headers, metadata=None):
+    """Write a measurements array (rows of samples) to a columnar file."""
+    measurements = numpy.asarray(measurements, dtype=COLUMNAR_DTYPE)
+    rows, columns = measurements.shape
+    with open(filename, "wb") as fo:
+        _write_columnar_header(fo, headers, metadata, rows, columns)
+        # Transposed C order is the columns, one after the other.
+        fo.write(numpy.ascontiguousarray(measurements.transpose()).tostring())
+
+
+def read_columnar(filename, mmap=True):
+    """Read a columnar file.
+
+    With mmap true, the measurements are a copy-on-write view of the memory
+    mapped file, and nothing is copied or read until used. Changes are kept
+    in memory, the file is not changed.
+
+    Returns headers, measurements (rows of samples), metadata.
+    """
+    with open(filename, "rb") as fo:
+        header, offset = read_columnar_header(fo)
+        shape = (header["columns"], header["rows"])
+        if mmap:
+            if header["rows"] == 0:
+                columns = numpy.empty(shape, dtype=header["dtype"])
+            else:
+                columns = numpy.memmap(fo, dtype=header["dtype"], mode="c",
+                        offset=offset, shape=shape)
+        else:
+            fo.seek(offset)
+            columns = numpy.fromfile(fo, dtype=header["dtype"],
+                    count=shape[0] * shape[1]).reshape(shape)
+    return header["headers"], columns.transpose(), _decode_metadata(header["metadata"])
+
+
+def iter_timeslices(filename, timespan):
+    """Iterate over sections of time of a columnar data file, without reading
+    all of it.
+
+    Args:
+        filename (string): a columnar (.cds) file name.
+        timespan (string): a time span specification, such as "0s,5m,..." to
+        get 5 minute chunks at a time.
+
+    Yields a new DataSet, starttime (s float), endtime (s float). The
+    DataSets are views of the memory mapped file.
+    """
+    headers, measurements, metadata = read_columnar(filename)
+    for subset, start, end in iter_timeslice_arrays(measurements, timespan):
+        ds = DataSet(array=subset, headers=headers)
+        ds.metadata = metadata
+        yield ds, start, end
+
+
+def _read_text_header(fo, filetype):
+    if filetype == ".txt":
+        return map(eval, fo.readline().split("\t"))
+    elif filetype == ".csv":
+        return map(str.strip, fo.readline().split(","))
+    elif filetype == ".dat":
+        line1 = fo.readline()[2:].split("\t")
+        try:
+            return map(eval, line1)
+        except (ValueError, SyntaxError): # assume no header line
+            fo.seek(0)
+            return line1
+    else:
+        raise ValueError(
+            "Invalid file type. need .txt, .csv, or .dat (got %r)." % filetype)
+
+
+def convert_to_columnar(filename, outname=None, chunkrows=65536):
+    """Convert a text data file (.txt, .csv, or .dat) to a columnar file.
+
+    The text is converted chunkrows lines at a time, so the file does not
+    have to fit in memory. The metadata encoded in the file name is kept in
+    the header.
+
+    Returns the name of the columnar file.
+    """
+    base, filetype = os.path.splitext(filename)
+    outname = outname or base + COLUMNAR_EXT
+    metadata = datafile.decode_filename(filename)
+    with open(filename, "rU") as fo:
+        headers = _read_text_header(fo, filetype)
+        datastart = fo.tell()
+        rows = sum(1 for line in fo if line.strip())
+        fo.seek(datastart)
+        columns = len(headers)
+        with open(outname, "wb") as out:
+            offset = _write_columnar_header(out, headers, metadata, rows, columns)
+            out.truncate(offset + rows * columns * numpy.dtype(COLUMNAR_DTYPE).itemsize)
+        if rows == 0:
+            return outname
+        dest = numpy.memmap(outname, dtype=COLUMNAR_DTYPE, mode="r+", offset=offset,
+                shape=(columns, rows))
+        row = 0
+        lines = itertools.ifilter(str.strip, fo)
+        while row < rows:
+            chunk = "".join(itertools.islice(lines, chunkrows))
+            if filetype == ".csv":
+                chunk = chunk.replace(",", " ")
+            a = fix_special_values(numpy.fromstring(chunk, dtype="f8", sep=" "))
+            a.shape = (-1, columns)
+            dest[:, row:row + len(a)] = a.transpose()
+            row += len(a)
+        dest.flush()
+        del dest
+    return outname
+
+
 def _test(argv):
     from pycopia import autodebug
     data = numpy.array([
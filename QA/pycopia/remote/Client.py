@@ -18,11 +18,15 @@
 The Client for Remote controllers.
 
 """
-__all__ = ["get_remote", "remote_copy", "get_controller"]
+__all__ = ["get_remote", "remote_copy", "get_controller", "pull", "push", "Batch",
+        "BatchError"]
 
 import sys, os
+import socket
 
 from pycopia.remote import pyro
+from pycopia.remote.transfer import pull, push, TransferError
+from pycopia.remote.batch import Batch, BatchError
 
 
 # some platform specific stuff. Should be minimal
@@ -46,13 +50,22 @@ def get_remote(hostname, servicename=None):
 
 
 def remote_copy(agent, remfile, dst):
-    """Copies a file from the remote agent to the local file system."""
+    """Copies a file from the remote agent to the local file system.
+
+    Uses a bulk transfer, and returns its TransferResult, if the agent
+    supports it. Otherwise, or if the transfer fails (the port may be
+    blocked), the file is read through the agent.
+    """
+    try:
+        return pull(agent, remfile, dst, resume=False)
+    except (AttributeError, socket.error, TransferError):
+        pass
     h = agent.fopen(remfile, "rb")
     if os.path.isdir(dst):
         dst = os.path.join(dst, os.path.basename(remfile))
     dest = open(dst, "wb")
     while 1:
-        data = agent.fread(h, 1024)
+        data = agent.fread(h, 65536)
         if not data:
             break
         dest.write(data)
@@ -30,6 +30,8 @@ from pycopia import UserFile
 from pycopia import passwd
 from pycopia import logging
 from pycopia.remote import pyro
+from pycopia.remote import transfer
+from pycopia.remote import batch
 
 
 
@@ -46,6 +48,7 @@ class PosixAgent(object):
         self._files = {}
         self._status = {} # holds async process pids
         self._dirstack = []
+        self._transfers = {} # bulk transfers, by token
 
     def platform(self):
         return sys.platform
@@ -446,6 +449,11 @@ class PosixAgent(object):
         return True
     ping = alive
 
+    def run_batch(self, calls):
+        """Run calls recorded by a pycopia.remote.batch.Batch, in order.
+        Returns the results, and the first error or None."""
+        return batch.run_calls(self, calls)
+
     # used to force external shell script to reload us
     def suicide(self):
         global _EXIT
@@ -468,6 +476,48 @@ class PosixAgent(object):
         """Returns the client hosts name."""
         return os.uname()[1]
 
+    # Bulk transfers stream files over a separate socket. Use the pull and
+    # push functions in pycopia.remote.transfer, on the client side.
+    def send_files(self, path, checksum=True):
+        """Start sending a file, or directory tree, to the client.
+        Returns the port and token to connect with, and the manifest."""
+        manifest = transfer.make_manifest(path)
+        def handler(sock, rfile, fields):
+            offsets = [int(field) for field in fields]
+            return transfer.send_files(sock, rfile, path, manifest, offsets, checksum)
+        server = self._start_transfer(handler)
+        return {"port": server.port, "token": server.token, "manifest": manifest}
+
+    def receive_files(self, path, manifest, srcpath="", resume=True, checksum=True):
+        """Start receiving files given by the manifest into path.
+        Returns the port and token to connect with, the destination, and
+        the offsets to resume the files from."""
+        manifest = [tuple(entry) for entry in manifest]
+        path = transfer.get_destination(path, manifest, srcpath)
+        offsets = transfer.get_offsets(path, manifest, resume)
+        def handler(sock, rfile, fields):
+            return transfer.receive_files(sock, rfile, path, manifest, offsets, checksum)
+        server = self._start_transfer(handler)
+        return {"port": server.port, "token": server.token, "destination": path,
+                "offsets": offsets}
+
+    def _start_transfer(self, handler):
+        server = transfer.TransferServer(handler, callback=self._end_transfer)
+        self._transfers[server.token] = server
+        server.start()
+        return server
+
+    def _end_transfer(self, server):
+        self._transfers.pop(server.token, None)
+
+    def transfer_status(self, token):
+        """Return the state of a bulk transfer in progress, or None if there
+        is none. The client is told the outcome at the end of a transfer."""
+        server = self._transfers.get(token)
+        if server is None:
+            return None
+        return server.status()
+
     def md5sums(self, path):
         """Reads the md5sums.txt file in path and returns the number of files
         checked good, then number bad (failures), and a list of the failures."""
@@ -716,12 +716,34 @@ class RemoteCLI(CLI.BaseCommands):
     Copies a file from the remote agent to the local file system."""
         src = argv[1]
         dest = argv[2]
-        Client.remote_copy(self._obj, src, dest)
+        rv = Client.remote_copy(self._obj, src, dest)
+        if rv is not None:
+            self._print(rv)
 
 
 class PosixRemoteCLI(RemoteCLI):
     """PosixServer specific method interface."""
 
+    def pull(self, argv):
+        """pull [-n] <remotepath> <localpath>
+    Copies a file or directory from the remote agent, resuming a partial
+    copy, over a bulk transfer stream. The -n flag starts over."""
+        resume = not (len(argv) > 1 and argv[1] == "-n")
+        if not resume:
+            del argv[1]
+        rv = Client.pull(self._obj, argv[1], argv[2], resume=resume)
+        self._print(rv)
+
+    def push(self, argv):
+        """push [-n] <localpath> <remotepath>
+    Copies a file or directory to the remote agent, resuming a partial
+    copy, over a bulk transfer stream. The -n flag starts over."""
+        resume = not (len(argv) > 1 and argv[1] == "-n")
+        if not resume:
+            del argv[1]
+        rv = Client.push(self._obj, argv[1], argv[2], resume=resume)
+        self._print(rv)
+
     def export(self, argv):
         """export <"add"|"del"> <pathname>
     Adds or deletes the named export to/from the server."""
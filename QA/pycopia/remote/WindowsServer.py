@@ -68,6 +68,7 @@ from pycopia.anypath import cygwin2nt, nt2cygwin
 from pycopia import shparser
  # returnable objects
 from pycopia.remote.WindowsObjects import ExitStatus
+from pycopia.remote import batch
 
 # Windows stuff
 import msvcrt
@@ -692,6 +693,11 @@ class Win32Agent(Pyro.core.SynchronizedObjBase):
     def alive(self):
         return True
 
+    def run_batch(self, calls):
+        """Run calls recorded by a pycopia.remote.batch.Batch, in order.
+        Returns the results, and the first error or None."""
+        return batch.run_calls(self, calls)
+
     def suicide(self):
         "Kill myself. The server manager will ressurect me. How nice."
         global _EXIT
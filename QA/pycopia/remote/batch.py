@@ -0,0 +1,218 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Run a sequence of remote agent calls in one round trip.
+
+A Batch records calls made on it, as if it were the agent, and sends them
+all with one call to the agent's run_batch method. Each recorded call
+returns a BatchResult that may be passed as an argument to later calls in
+the same batch, where the agent substitutes the actual result. Index it to
+refer to part of a result.
+
+    batch = Batch(agent)
+    h = batch.fopen("/tmp/somefile", "w")
+    batch.fwrite(h, "some data")
+    batch.fclose(h)
+    size = batch.stat("/tmp/somefile")[6]
+    batch()
+    print(size.value)
+
+The agent runs the calls in order and stops at the first one that raises an
+exception. Then calling the batch raises BatchError, after setting the
+results of the calls that did run.
+
+This module is also used by the Windows agent, so it only needs Python 2.6.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+
+# Marks a reference to an earlier result in the arguments sent to the agent.
+# The value is a list of the call index, followed by any keys to index the
+# result with. A plain dict survives all the Pyro serializers.
+REFKEY = "_batchref"
+
+
+class BatchError(Exception):
+    """Raised when a call in a batch failed. The index, method name, and
+    the remote exception name and message are attributes."""
+
+    def __init__(self, index, method, exception, message):
+        Exception.__init__(self, index, method, exception, message)
+        self.index = index
+        self.method = method
+        self.exception = exception
+        self.message = message
+
+    def __str__(self):
+        return "call %d (%s) raised %s: %s" % (self.index, self.method,
+                self.exception, self.message)
+
+
+class _NotRun(object):
+    def __repr__(self):
+        return "<not run>"
+
+_NOTRUN = _NotRun()
+
+
+class BatchResult(object):
+    """Stands for the result of a call recorded in a Batch."""
+
+    def __init__(self, index, method, parent=None, key=None):
+        self._index = index
+        self._method = method
+        self._parent = parent
+        self._key = key
+        self._value = _NOTRUN
+
+    def __getitem__(self, key):
+        return BatchResult(self._index, self._method, self, key)
+
+    def __repr__(self):
+        return "<BatchResult %d (%s): %r>" % (self._index, self._method, self._get())
+
+    def _get(self):
+        if self._parent is None:
+            return self._value
+        value = self._parent._get()
+        if value is _NOTRUN:
+            return value
+        return value[self._key]
+
+    @property
+    def value(self):
+        """The result, once the batch has run."""
+        value = self._get()
+        if value is _NOTRUN:
+            raise ValueError("Call %d (%s) has not run." % (self._index, self._method))
+        return value
+
+    def _marker(self):
+        keys = []
+        ref = self
+        while ref._parent is not None:
+            keys.insert(0, ref._key)
+            ref = ref._parent
+        return {REFKEY: [self._index] + keys}
+
+
+class Batch(object):
+    """Records calls to an agent, to be run in one round trip when the
+    batch is called.
+
+    Calling the batch returns the list of results, and clears it for
+    reuse. It may also be used as a context manager, running the calls
+    when the block ends without an exception.
+    """
+
+    def __init__(self, agent):
+        self._agent = agent
+        self._calls = []
+        self._refs = []
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        def _record(*args, **kwargs):
+            return self._add(name, args, kwargs)
+        _record.__name__ = str(name)
+        return _record
+
+    def __len__(self):
+        return len(self._calls)
+
+    def _add(self, name, args, kwargs):
+        ref = BatchResult(len(self._calls), name)
+        self._calls.append((name, _encode(list(args)), _encode(kwargs)))
+        self._refs.append(ref)
+        return ref
+
+    def __call__(self):
+        calls, refs = self._calls, self._refs
+        self._calls, self._refs = [], []
+        if not calls:
+            return []
+        results, error = self._agent.run_batch(calls)
+        for ref, result in zip(refs, results):
+            ref._value = result
+        if error is not None:
+            index, exception, message = error
+            raise BatchError(index, refs[index]._method, exception, message)
+        return list(results)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, extype, exvalue, traceback):
+        if extype is None:
+            self()
+        else:
+            self._calls, self._refs = [], []
+
+
+def _encode(obj):
+    if isinstance(obj, BatchResult):
+        return obj._marker()
+    if isinstance(obj, list):
+        return [_encode(item) for item in obj]
+    if isinstance(obj, tuple):
+        return tuple([_encode(item) for item in obj])
+    if isinstance(obj, dict):
+        return dict([(key, _encode(value)) for key, value in obj.items()])
+    return obj
+
+
+def _resolve(obj, results):
+    if isinstance(obj, dict):
+        if len(obj) == 1 and REFKEY in obj:
+            keys = list(obj[REFKEY])
+            index = keys.pop(0)
+            if not 0 <= index < len(results):
+                raise ValueError("Reference to call %d, not run yet." % (index,))
+            value = results[index]
+            for key in keys:
+                value = value[key]
+            return value
+        return dict([(key, _resolve(item, results)) for key, item in obj.items()])
+    if isinstance(obj, list):
+        return [_resolve(item, results) for item in obj]
+    if isinstance(obj, tuple):
+        return tuple([_resolve(item, results) for item in obj])
+    return obj
+
+
+def run_calls(agent, calls):
+    """Run a batch of calls on agent, on the agent side.
+
+    Returns the list of results, and None, or the results of the calls that
+    ran before one failed, and an (index, exception name, message) tuple.
+    """
+    results = []
+    for index, (name, args, kwargs) in enumerate(calls):
+        try:
+            if name.startswith("_") or name == "run_batch":
+                raise AttributeError("%r may not be called in a batch." % (name,))
+            method = getattr(agent, name)
+            args = _resolve(args, results)
+            kwargs = dict([(str(key), value) for key, value in _resolve(kwargs, results).items()])
+            results.append(method(*args, **kwargs))
+        except Exception as err:
+            return results, (index, err.__class__.__name__, str(err))
+    return results, None
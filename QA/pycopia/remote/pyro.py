@@ -37,8 +37,6 @@ from pycopia import asyncio
 import logging
 import logging.config
 
-logging.config.fileConfig("/etc/pycopia/logging.cfg")
-
 # This is the only place where Pyro4 should ever be imported.
 import Pyro4
 import Pyro4.socketutil
@@ -56,8 +54,18 @@ def set_p4_config():
     pcf = Pyro4.config
     for name in pcf.__slots__:
         setattr(pcf, name, p4conf.get(name, getattr(pcf, name)))
-set_p4_config()
-del set_p4_config
+
+# The logging and Pyro configuration files are read when Pyro is first used,
+# not when this module is imported.
+_configured = False
+
+def _configure():
+    global _configured
+    if not _configured:
+        # Leave the Pyro4 loggers, created on import, enabled.
+        logging.config.fileConfig("/etc/pycopia/logging.cfg", disable_existing_loggers=False)
+        set_p4_config()
+        _configured = True
 
 
 class PyroAsyncAdapter(asyncio.PollerInterface):
@@ -117,6 +125,7 @@ class PyroAsyncAdapter(asyncio.PollerInterface):
 
 def register_server(serverobject, host=None, port=0, unixsocket=None, nathost=None, natport=None):
     """Regiseter the server with Pycopia asyncio event handler."""
+    _configure()
     host = host or Pyro4.config.HOST or Pyro4.socketutil.getIpAddress(socket.getfqdn())
     pyrodaemon = Pyro4.Daemon(host=host, port=port,
             unixsocket=unixsocket, nathost=nathost, natport=natport)
@@ -131,6 +140,7 @@ def register_server(serverobject, host=None, port=0, unixsocket=None, nathost=No
 def get_remote(hostname, servicename=None):
     """Find and return a client (proxy) give the fully qualified host name and optional servicename.
     """
+    _configure()
     if servicename:
         patt = "{}:{}".format(servicename, hostname)
     else:
@@ -152,9 +162,11 @@ def loop(timeout=-1, callback=asyncio.NULL):
 
 
 def get_proxy(uri):
+    _configure()
     return Pyro4.Proxy(uri)
 
 
 def locate_nameserver():
+    _configure()
     return Pyro4.locateNS()
 
@@ -0,0 +1,482 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Bulk file transfer between a remote agent and its client.
+
+Reading a file through the agent file handles costs a Pyro round trip for
+every block. Here the Pyro call only sets up a transfer: the agent listens on
+a new port for the one transfer and returns the port, an access token, and
+either the manifest of the files it will send (pull), or the offsets it
+already has of the files it will receive (push). The client connects, sends
+the token, and the files are streamed over that socket with large buffers.
+
+A path may be a file or a directory, which is transferred whole. Partly
+transferred files are resumed from where they stopped, and the SHA-1 digest
+of each whole file is checked at the receiver.
+
+After a line holding the token (and, for a pull, the receivers offsets),
+each file in the manifest is sent as:
+
+    8 byte length, in network order, of the data that follows.
+    The file data, from the resume offset.
+    20 byte SHA-1 digest of the whole file (zeros if not checked).
+
+Then the receiver answers with a line of "OK", or "FAILED <count>".
+
+An error at either end is sent to the other, so that the client reports
+what went wrong at the agent. A sender sends an all ones length, then a
+line with the error, in place of the next file. A receiver answers with a
+line of "ERROR <message>", and reads the rest of what is sent. An error
+while sending the data of a file can not be told to the receiver, which
+finds the connection closed.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import os
+import stat
+import struct
+import socket
+import hashlib
+import binascii
+import threading
+from timeit import default_timer
+
+
+BUFSIZE = 1024 * 1024
+SOCKBUFSIZE = 4 * 1024 * 1024 # The kernel may limit this.
+TIMEOUT = 60.0
+DIGESTSIZE = 20
+NODIGEST = b"\0" * DIGESTSIZE
+ERRORMARK = 0xFFFFFFFFFFFFFFFF # sent as a length
+
+# Python 2 has no sendfile, but use it where the interpreter provides it.
+_sendfile = getattr(os, "sendfile", None)
+
+
+class TransferError(Exception):
+    pass
+
+
+class _StreamError(TransferError):
+    """Failed while sending file data, too late to tell the receiver."""
+
+
+def make_manifest(path):
+    """Return the manifest of the file, or directory tree, at path.
+
+    The manifest is a list of (relpath, size, mode, isdir) tuples. A file
+    has a single entry with an empty relpath. Directories come before their
+    contents. Anything that is not a regular file or directory is left out.
+    """
+    st = os.stat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        return [("", st.st_size, stat.S_IMODE(st.st_mode), False)]
+    manifest = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        reldir = os.path.relpath(dirpath, path)
+        if reldir == os.curdir:
+            reldir = ""
+        else:
+            manifest.append((reldir, 0, stat.S_IMODE(os.stat(dirpath).st_mode), True))
+        for name in sorted(filenames):
+            try:
+                st = os.stat(os.path.join(dirpath, name))
+            except OSError: # gone, or a dangling link
+                continue
+            if stat.S_ISREG(st.st_mode):
+                manifest.append((os.path.join(reldir, name), st.st_size,
+                        stat.S_IMODE(st.st_mode), False))
+    return manifest
+
+
+def get_offsets(root, manifest, resume=True):
+    """Return the offsets at which to resume receiving the files in manifest
+    into root. That is the size of any file already there, if not larger
+    than the one being sent."""
+    offsets = []
+    for relpath, size, mode, isdir in manifest:
+        offset = 0
+        if resume and not isdir:
+            try:
+                offset = os.path.getsize(_join(root, relpath))
+            except OSError:
+                pass
+            if offset > size:
+                offset = 0
+        offsets.append(offset)
+    return offsets
+
+
+def get_destination(path, manifest, srcpath):
+    """A single file sent to an existing directory goes into it."""
+    if len(manifest) == 1 and manifest[0][0] == "" and os.path.isdir(path):
+        return os.path.join(path, os.path.basename(srcpath.rstrip("/")))
+    return path
+
+
+def send_files(sock, rfile, root, manifest, offsets, checksum=True, bufsize=BUFSIZE):
+    """Send the files in manifest, found in root, over sock. Return the
+    number of bytes sent, and the number of files the receiver found
+    corrupt."""
+    nbytes = 0
+    try:
+        if len(offsets) != len(manifest):
+            raise TransferError("Got {} offsets for {} files.".format(len(offsets), len(manifest)))
+        for (relpath, size, mode, isdir), offset in zip(manifest, offsets):
+            if isdir:
+                continue
+            nbytes += _send_file(sock, _join(root, relpath), size, offset, checksum, bufsize)
+    except (socket.error, _StreamError):
+        raise
+    except (TransferError, EnvironmentError) as err:
+        _send_quietly(sock, struct.pack("!Q", ERRORMARK) + _error_line(err))
+        raise
+    return nbytes, _read_status(rfile)
+
+
+def receive_files(sock, rfile, root, manifest, offsets, checksum=True, bufsize=BUFSIZE):
+    """Receive the files in manifest into root. Return the number of bytes
+    received, and the relative paths of the files found corrupt."""
+    nbytes = 0
+    failed = []
+    try:
+        for (relpath, size, mode, isdir), offset in zip(manifest, offsets):
+            path = _join(root, relpath)
+            if isdir:
+                if not os.path.isdir(path):
+                    os.makedirs(path, mode | stat.S_IRWXU)
+                continue
+            dirname = os.path.dirname(path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            count, digest = _receive_file(rfile, path, offset, checksum, bufsize)
+            nbytes += count
+            remotedigest = _read_exactly(rfile, DIGESTSIZE)
+            if checksum and digest != remotedigest:
+                failed.append(relpath)
+            os.chmod(path, mode)
+    except socket.error:
+        raise
+    except EnvironmentError as err:
+        # Let the sender finish, so that it reads the error.
+        if _send_quietly(sock, b"ERROR " + _error_line(err)):
+            _drain(rfile, bufsize)
+        raise
+    if failed:
+        sock.sendall("FAILED {}\n".format(len(failed)).encode("ascii"))
+    else:
+        sock.sendall(b"OK\n")
+    return nbytes, failed
+
+
+def _join(root, relpath):
+    return os.path.join(root, relpath) if relpath else root
+
+
+def _error_line(err):
+    message = " ".join("{}: {}".format(err.__class__.__name__, err).split())
+    if not isinstance(message, bytes):
+        message = message.encode("utf-8")
+    return message + b"\n"
+
+
+def _send_quietly(sock, data):
+    """Send data if the connection still works. Return True if sent."""
+    try:
+        sock.sendall(data)
+    except socket.error:
+        return False
+    return True
+
+
+def _drain(rfile, bufsize):
+    try:
+        while rfile.read(bufsize):
+            pass
+    except socket.error:
+        pass
+
+
+def _set_buffers(sock):
+    for option in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, SOCKBUFSIZE)
+        except socket.error:
+            pass
+
+
+def _send_file(sock, path, size, offset, checksum, bufsize):
+    digest = hashlib.sha1() if checksum else None
+    try:
+        fo = open(path, "rb")
+    except IOError: # The receiver will find it corrupt.
+        sock.sendall(struct.pack("!Q", 0) + NODIGEST)
+        return 0
+    try:
+        size = min(size, os.fstat(fo.fileno()).st_size)
+        offset = min(offset, size)
+        if digest is not None:
+            _hash_file(fo, digest, offset, bufsize)
+        fo.seek(offset)
+        count = size - offset
+        sock.sendall(struct.pack("!Q", count))
+        try:
+            if digest is None and _sendfile is not None:
+                _sendfile_all(sock, fo, offset, count)
+            else:
+                remaining = count
+                while remaining:
+                    data = fo.read(min(bufsize, remaining))
+                    if not data:
+                        raise TransferError("{} was truncated while being sent.".format(path))
+                    if digest is not None:
+                        digest.update(data)
+                    sock.sendall(data)
+                    remaining -= len(data)
+        except socket.error:
+            raise
+        except (TransferError, EnvironmentError) as err:
+            raise _StreamError(str(err))
+    finally:
+        fo.close()
+    sock.sendall(digest.digest() if digest is not None else NODIGEST)
+    return count
+
+
+def _sendfile_all(sock, fo, offset, count):
+    sockfd = sock.fileno()
+    filefd = fo.fileno()
+    while count:
+        sent = _sendfile(sockfd, filefd, offset, count)
+        if not sent:
+            raise TransferError("{} was truncated while being sent.".format(fo.name))
+        offset += sent
+        count -= sent
+
+
+def _receive_file(rfile, path, offset, checksum, bufsize):
+    digest = hashlib.sha1() if checksum else None
+    count = struct.unpack("!Q", _read_exactly(rfile, 8))[0]
+    if count == ERRORMARK:
+        raise TransferError("Sender failed: {}".format(
+                rfile.readline().decode("utf-8", "replace").strip()))
+    fo = open(path, "r+b" if offset else "wb")
+    try:
+        if offset:
+            if digest is not None:
+                _hash_file(fo, digest, offset, bufsize)
+            fo.seek(offset)
+            fo.truncate()
+        remaining = count
+        while remaining:
+            data = rfile.read(min(bufsize, remaining))
+            if not data:
+                raise TransferError("Connection closed while receiving {}.".format(path))
+            if digest is not None:
+                digest.update(data)
+            fo.write(data)
+            remaining -= len(data)
+    finally:
+        fo.close()
+    return count, (digest.digest() if digest is not None else NODIGEST)
+
+
+def _hash_file(fo, digest, length, bufsize):
+    fo.seek(0)
+    while length:
+        data = fo.read(min(bufsize, length))
+        if not data:
+            break
+        digest.update(data)
+        length -= len(data)
+
+
+def _read_exactly(rfile, amt):
+    data = rfile.read(amt)
+    if len(data) != amt:
+        raise TransferError("Connection closed during transfer.")
+    return data
+
+
+def _read_status(rfile):
+    line = rfile.readline().strip()
+    if line == b"OK":
+        return 0
+    parts = line.split()
+    if len(parts) == 2 and parts[0] == b"FAILED":
+        return int(parts[1])
+    if parts and parts[0] == b"ERROR":
+        raise TransferError("Receiver failed: {}".format(
+                line[len(b"ERROR"):].decode("utf-8", "replace").strip()))
+    raise TransferError("Bad status from receiver: {!r}".format(line))
+
+
+class TransferServer(threading.Thread):
+    """Serve one transfer, on the agent side.
+
+    Listens on a new port for a single connection that must present the
+    token. Then handler is called with the socket, a file reading it, and
+    the other fields of the first line. Its return value, or the error,
+    is kept in the result and error attributes. When it is done, callback,
+    if given, is called with the server.
+    """
+
+    def __init__(self, handler, timeout=TIMEOUT, callback=None):
+        super(TransferServer, self).__init__(name="transfer")
+        self.daemon = True
+        self._handler = handler
+        self._timeout = timeout
+        self._callback = callback
+        self.token = binascii.hexlify(os.urandom(16)).decode("ascii")
+        self.result = None
+        self.error = None
+        self.finished = False
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        _set_buffers(self._listener) # inherited by the accepted socket.
+        self._listener.bind(("", 0))
+        self._listener.listen(1)
+        self.port = self._listener.getsockname()[1]
+
+    def run(self):
+        try:
+            self._listener.settimeout(self._timeout)
+            try:
+                sock, addr = self._listener.accept()
+            finally:
+                self._listener.close()
+            sock.settimeout(self._timeout)
+            rfile = sock.makefile("rb", BUFSIZE)
+            try:
+                fields = rfile.readline().split()
+                if not fields or fields[0].decode("ascii") != self.token:
+                    raise TransferError("Bad token from {}.".format(addr[0]))
+                self.result = self._handler(sock, rfile, fields[1:])
+            finally:
+                rfile.close() # else the socket stays open.
+                sock.close()
+        except Exception as err:
+            self.error = "{}: {}".format(err.__class__.__name__, err)
+        finally:
+            self.finished = True
+            if self._callback is not None:
+                self._callback(self)
+
+    def status(self):
+        return {"finished": self.finished, "result": self.result, "error": self.error}
+
+
+class TransferResult(object):
+    """The outcome of a pull or push, as seen by the client."""
+
+    def __init__(self, direction, source, destination, files, nbytes, total, elapsed, failed):
+        self.direction = direction
+        self.source = source
+        self.destination = destination
+        self.files = files
+        self.bytes = nbytes # transferred, not counting resumed parts.
+        self.total = total # size of all the files.
+        self.elapsed = elapsed
+        self.failed = failed # relative paths, or a count for a push.
+
+    @property
+    def rate(self):
+        """Throughput in bytes per second."""
+        return self.bytes / self.elapsed if self.elapsed > 0.0 else 0.0
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def __str__(self):
+        s = "{} {} -> {}: {} files, {} of {} bytes in {:.2f} s ({:.2f} MB/s)".format(
+                self.direction, self.source, self.destination, self.files, self.bytes,
+                self.total, self.elapsed, self.rate / 1048576.0)
+        if self.failed:
+            nfailed = self.failed if isinstance(self.failed, int) else len(self.failed)
+            s += ", {} failed checksum".format(nfailed)
+        return s
+
+
+def _connect(host, port, token, fields=()):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    _set_buffers(sock) # must be done before connecting to get a large window.
+    sock.settimeout(TIMEOUT)
+    sock.connect((host, port))
+    line = " ".join([token] + [str(field) for field in fields]) + "\n"
+    sock.sendall(line.encode("ascii"))
+    return sock
+
+
+def _agent_host(agent, host):
+    if host:
+        return host
+    try:
+        return agent._pyroUri.host
+    except AttributeError:
+        raise TransferError("Agent host not known, supply it.")
+
+
+def pull(agent, remotepath, localpath, resume=True, checksum=True, host=None):
+    """Copy a file, or directory tree, from the remote agent to localpath.
+
+    Returns a TransferResult.
+    """
+    start = default_timer()
+    info = agent.send_files(remotepath, checksum)
+    manifest = [tuple(entry) for entry in info["manifest"]]
+    localpath = get_destination(localpath, manifest, remotepath)
+    offsets = get_offsets(localpath, manifest, resume)
+    sock = _connect(_agent_host(agent, host), info["port"], info["token"], offsets)
+    rfile = sock.makefile("rb", BUFSIZE)
+    try:
+        nbytes, failed = receive_files(sock, rfile, localpath, manifest, offsets, checksum)
+    finally:
+        rfile.close()
+        sock.close()
+    return TransferResult("pull", remotepath, localpath, _count_files(manifest), nbytes,
+            _total_size(manifest), default_timer() - start, failed)
+
+
+def push(agent, localpath, remotepath, resume=True, checksum=True, host=None):
+    """Copy a file, or directory tree, at localpath to the remote agent.
+
+    Returns a TransferResult.
+    """
+    start = default_timer()
+    manifest = make_manifest(localpath)
+    info = agent.receive_files(remotepath, manifest, localpath, resume, checksum)
+    sock = _connect(_agent_host(agent, host), info["port"], info["token"])
+    rfile = sock.makefile("rb", BUFSIZE)
+    try:
+        nbytes, nfailed = send_files(sock, rfile, localpath, manifest, info["offsets"], checksum)
+    finally:
+        rfile.close()
+        sock.close()
+    return TransferResult("push", localpath, info["destination"], _count_files(manifest),
+            nbytes, _total_size(manifest), default_timer() - start, nfailed)
+
+
+def _count_files(manifest):
+    return sum(1 for entry in manifest if not entry[3])
+
+
+def _total_size(manifest):
+    return sum(entry[1] for entry in manifest if not entry[3])
@@ -12,21 +12,30 @@ The table schema is hierarchical, and some records will hold different set
 of data from another. The entire set is obtained by custom query in the
 model object.
 
+Results are written in bulk when the report is finalized. Give the report a
+true argument to have finished test results written by a background thread,
+while the tests run:
+
+    ("pycopia.reports.database.DatabaseReport", True)
+
 """
 
 
 import sys
 import os
 import re
+import threading
+import Queue
 
 from datetime import datetime
 from pycopia import passwd
 from pycopia import reports
 
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy import and_
+from sqlalchemy import and_, text, bindparam
 
 from pycopia.db import models
+from pycopia.db import tables
 from pycopia.db import types
 
 
@@ -64,6 +73,7 @@ class ResultHolder(object):
         self._children = []
         self._data = _COLUMNS.copy()
         self._datapoints = [] # mutable type
+        self.id = None # assigned by the ResultWriter
 
     def __str__(self):
         d = self._data
@@ -94,19 +104,12 @@ class ResultHolder(object):
     def get(self, cname):
         return self._data[cname]
 
-    def commit(self, dbsession, parentrecord=None):
-        self._data["parent"] = parentrecord
-        if self._data["objecttype"] == TEST:
-            self.resolve_testcase(dbsession)
-        if self._data["objecttype"] == SUITE:
-            self.resolve_testsuite(dbsession)
-        self.resolve_build(dbsession)
-        tr = models.create(models.TestResult, **self._data)
-        dbsession.add(tr)
-        if self._data["objecttype"] == TEST:
-            self.resolve_data(dbsession, tr)
+    def walk(self):
+        """Yield this and all the results below it, parents first."""
+        yield self
         for child in self._children:
-            child.commit(dbsession, tr)
+            for result in child.walk():
+                yield result
 
     def emit(self, fo, level=0):
         fo.write("    "*level)
@@ -115,73 +118,6 @@ class ResultHolder(object):
         for child in self._children:
             child.emit(fo, level+1)
 
-    def resolve_testcase(self, dbsession):
-        ti = self._data.get("testimplementation")
-        if ti:
-            try:
-                tc = dbsession.query(
-                        models.TestCase).filter(models.TestCase.testimplementation==ti).one()
-            except NoResultFound:
-                pass
-            else:
-                self._data["testcase"] = tc
-
-    def resolve_testsuite(self, dbsession):
-        ti = self._data.get("testimplementation")
-        if ti:
-            try:
-                ts = dbsession.query(models.TestSuite).filter(models.TestSuite.suiteimplementation==ti).one()
-            except NoResultFound:
-                pass
-            else:
-                self._data["testsuite"] = ts
-
-    def resolve_build(self, dbsession):
-        buildstring = self._data.get("build")
-        if buildstring is None:
-            return
-        mo = PROJECT_RE.search(buildstring)
-        if mo:
-            try:
-                pname, major, minor, sub, build = mo.groups()
-                major = int(major); minor = int(minor); sub = int(sub); build = int(build)
-            except ValueError:
-                self._data["build"] = None
-                return
-            try:
-                proj = dbsession.query(models.Project).filter(models.Project.name==pname).one()
-            except NoResultFound:
-                self._data["build"] = None
-                return
-            try:
-                projectversion = dbsession.query(models.ProjectVersion).filter(and_(
-                        models.ProjectVersion.project==proj,
-                        models.ProjectVersion.valid==True,
-                        models.ProjectVersion.major==major,
-                        models.ProjectVersion.minor==minor,
-                        models.ProjectVersion.subminor==sub,
-                        models.ProjectVersion.build==build)
-                        ).one()
-            except NoResultFound:
-                projectversion = models.create(
-                        models.ProjectVersion, project=proj, valid=True,
-                        major=major, minor=minor, subminor=sub, build=build)
-                dbsession.add(projectversion)
-                dbsession.commit()
-            self._data["build"] = projectversion
-        else:
-            self._data["build"] = None
-
-    def resolve_data(self, dbsession, testrecord):
-        dp = self._datapoints
-        if dp:
-            tdl = [models.create(models.TestResultData, data=hldr.data, note=hldr.note, testresult=testrecord)
-                    for hldr in dp]
-            for tr in tdl:
-                dbsession.add(tr)
-            testrecord.data = tdl
-        self._datapoints = None
-
 
 class DataHolder(object):
     def __init__(self, data, note):
@@ -189,6 +125,226 @@ class DataHolder(object):
         self.note = note
 
 
+# Columns copied as-is from a ResultHolder to a test_results row.
+_PLAIN_COLUMNS = ("testimplementation", "testversion", "objecttype",
+        "starttime", "endtime", "arguments", "result", "diagnostic",
+        "resultslocation", "reportfilename", "note", "valid")
+
+_ALLOCATE_IDS = text("SELECT nextval('public.test_results_id_seq') "
+        "FROM generate_series(1, :count)")
+
+_UPDATE_RESULT = tables.test_results.update().where(
+        tables.test_results.c.id == bindparam("_id"))
+
+
+class ResultWriter(object):
+    """Writes ResultHolder trees to the test results tables.
+
+    Test case, test suite and build lookups are cached for the run, and row
+    ids are taken from the table sequence in advance. So the result rows,
+    and their data rows, are inserted with one executemany per batch.
+
+    Finished test results are given to `add()`, and are written by
+    `finish()`, together with all the other results in the tree.
+    """
+
+    def __init__(self, dbsession, environment_id=None, tester_id=None):
+        self._session = dbsession
+        self._environment_id = environment_id
+        self._tester_id = tester_id
+        self._pending = []
+        self._partial = [] # containers written before they were complete.
+        self._testcases = {}
+        self._testsuites = {}
+        self._builds = {}
+
+    def add(self, result):
+        self._pending.append(result)
+
+    def finish(self, root):
+        """Write everything not yet written, and update the containers
+        written early with their final values."""
+        rest = self._pending
+        self._pending = []
+        rest.extend(result for result in root.walk() if result.id is None)
+        self.write(rest, complete=True)
+        if self._partial:
+            self._resolve(self._partial)
+            rows = []
+            for result in self._partial:
+                row = self._get_row(result)
+                row["_id"] = row.pop("id")
+                rows.append(row)
+            self._session.execute(_UPDATE_RESULT, rows)
+            self._partial = []
+        self._session.commit()
+
+    def write(self, results, complete=False):
+        """Insert the results, and any of their containers not yet written.
+        """
+        rows = []
+        seen = set()
+        for result in results:
+            if result.id is not None or id(result) in seen:
+                continue
+            parents = []
+            parent = result.parent
+            while parent is not None and parent.id is None and id(parent) not in seen:
+                parents.append(parent)
+                seen.add(id(parent))
+                parent = parent.parent
+            parents.reverse()
+            rows.extend(parents)
+            if not complete:
+                self._partial.extend(parents)
+            rows.append(result)
+            seen.add(id(result))
+        if not rows:
+            return
+        for result, (rid,) in zip(rows, self._session.execute(_ALLOCATE_IDS,
+                    {"count": len(rows)})):
+            result.id = rid
+        self._resolve(rows)
+        data = []
+        for result in rows:
+            if result._data["objecttype"] == TEST:
+                if result._datapoints:
+                    data.extend({"test_results_id": result.id, "data": hldr.data,
+                            "note": hldr.note} for hldr in result._datapoints)
+                result._datapoints = None
+        self._session.execute(tables.test_results.insert(),
+                [self._get_row(result) for result in rows])
+        if data:
+            self._session.execute(tables.test_results_data.insert(), data)
+        self._session.commit()
+
+    def _get_row(self, result):
+        d = result._data
+        row = dict((name, d[name]) for name in _PLAIN_COLUMNS)
+        impl = d["testimplementation"]
+        row["id"] = result.id
+        row["parent_id"] = result.parent.id if result.parent is not None else None
+        row["testcase_id"] = self._testcases.get(impl) if d["objecttype"] == TEST else None
+        row["testsuite_id"] = self._testsuites.get(impl) if d["objecttype"] == SUITE else None
+        row["build_id"] = self._builds.get(d["build"])
+        row["environment_id"] = self._environment_id
+        row["tester_id"] = self._tester_id
+        return row
+
+    def _resolve(self, results):
+        """Look up the test cases, suites and builds not yet cached."""
+        testcases = set()
+        testsuites = set()
+        for result in results:
+            d = result._data
+            impl = d["testimplementation"]
+            if impl:
+                if d["objecttype"] == TEST and impl not in self._testcases:
+                    testcases.add(impl)
+                elif d["objecttype"] == SUITE and impl not in self._testsuites:
+                    testsuites.add(impl)
+            build = d["build"]
+            if build is not None and build not in self._builds:
+                self._builds[build] = self._get_build_id(build)
+        if testcases:
+            self._testcases.update(dict.fromkeys(testcases))
+            self._testcases.update((impl, tcid) for tcid, impl in self._session.query(
+                    models.TestCase.id, models.TestCase.testimplementation).filter(
+                    models.TestCase.testimplementation.in_(testcases)))
+        if testsuites:
+            self._testsuites.update(dict.fromkeys(testsuites))
+            self._testsuites.update((impl, tsid) for tsid, impl in self._session.query(
+                    models.TestSuite.id, models.TestSuite.suiteimplementation).filter(
+                    models.TestSuite.suiteimplementation.in_(testsuites)))
+
+    def _get_build_id(self, buildstring):
+        mo = PROJECT_RE.search(buildstring)
+        if not mo:
+            return None
+        try:
+            pname, major, minor, sub, build = mo.groups()
+            major = int(major); minor = int(minor); sub = int(sub); build = int(build)
+        except ValueError:
+            return None
+        dbsession = self._session
+        try:
+            proj = dbsession.query(models.Project).filter(models.Project.name==pname).one()
+        except NoResultFound:
+            return None
+        try:
+            projectversion = dbsession.query(models.ProjectVersion).filter(and_(
+                    models.ProjectVersion.project==proj,
+                    models.ProjectVersion.valid==True,
+                    models.ProjectVersion.major==major,
+                    models.ProjectVersion.minor==minor,
+                    models.ProjectVersion.subminor==sub,
+                    models.ProjectVersion.build==build)
+                    ).one()
+        except NoResultFound:
+            projectversion = models.create(
+                    models.ProjectVersion, project=proj, valid=True,
+                    major=major, minor=minor, subminor=sub, build=build)
+            dbsession.add(projectversion)
+            dbsession.flush()
+        return projectversion.id
+
+
+class BackgroundResultWriter(ResultWriter):
+    """A ResultWriter that writes finished test results from a thread, in
+    batches, while the tests continue. Uses its own database session.
+    """
+
+    def __init__(self, environment_id=None, tester_id=None, batchsize=100):
+        super(BackgroundResultWriter, self).__init__(models.get_session(),
+                environment_id, tester_id)
+        self._batchsize = batchsize
+        self._queue = Queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="ResultWriter")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, result):
+        self._queue.put(result)
+
+    def _run(self):
+        while True:
+            result = self._queue.get()
+            if result is None:
+                return
+            batch = [result]
+            while len(batch) < self._batchsize:
+                try:
+                    result = self._queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if result is None:
+                    self._write(batch)
+                    return
+                batch.append(result)
+            self._write(batch)
+
+    def _write(self, batch):
+        if self._error is not None:
+            return
+        try:
+            self.write(batch)
+        except Exception:
+            self._error = sys.exc_info()
+            self._session.rollback()
+
+    def finish(self, root):
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            if self._error is not None:
+                extype, exvalue, tb = self._error
+                raise extype, exvalue, tb
+            super(BackgroundResultWriter, self).finish(root)
+        finally:
+            self._session.close()
+
+
 def get_user(conf):
     sess = conf.session
     pwent = passwd.getpwuid(os.getuid())
@@ -216,6 +372,11 @@ class DatabaseReport(reports.NullReport):
 
     MIMETYPE = property(lambda self: self._MIMETYPE)
 
+    def __init__(self, background=False):
+        # With background true, finished test results are written by a
+        # thread while the tests run, instead of all by finalize.
+        self._background = background
+
     def initialize(self, cf):
         # here is where information from the global configuration that is
         # needed in the database record is kept until the records are written
@@ -235,7 +396,12 @@ class DatabaseReport(reports.NullReport):
             user = get_user(cf)
         self._user = user
         self._rootresult.set("tester", self._user)
-
+        if self._debug:
+            self._writer = None
+        elif self._background:
+            self._writer = BackgroundResultWriter(self._environment.id, self._user.id)
+        else:
+            self._writer = ResultWriter(self._dbsession, self._environment.id, self._user.id)
 
     def finalize(self):
         self._currentresult = None
@@ -245,8 +411,9 @@ class DatabaseReport(reports.NullReport):
             sys.stderr.write("\nReport structure:\n")
             root.emit(sys.stdout)
         else:
-            root.commit(self._dbsession)
-            self._dbsession.commit()
+            writer = self._writer
+            self._writer = None
+            writer.finish(root)
         root.destroy()
 
     def new_result(self, otype):
@@ -271,7 +438,10 @@ class DatabaseReport(reports.NullReport):
     def pop_result(self):
         if self._debug:
             sys.stderr.write("     *** pop_result\n")
-        self._currentresult = self._currentresult.parent
+        current = self._currentresult
+        if self._writer is not None and current.get("objecttype") == TEST:
+            self._writer.add(current) # finished
+        self._currentresult = current.parent
 
     def logfile(self, filename):
         pass # XXX store log file name?
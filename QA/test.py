@@ -7,7 +7,10 @@
 
 """
 
+import os
+import signal
 import unittest
+import time
 
 from pycopia import QA
 from pycopia.QA import core
@@ -28,6 +31,104 @@ from pycopia import smartbits
 
 from pycopia.remote import Client
 from pycopia.remote import RemoteCLI
+from pycopia.remote import PosixServer
+from pycopia import dictlib
+
+
+class _SuiteConfig(object):
+    """Just enough configuration to run a suite."""
+    def __init__(self, workers=0, abort=True):
+        self.flags = dictlib.AttrDict(DEBUG=0, VERBOSE=0)
+        self.report = core.ReportRecorder()
+        self.workers = workers
+        self.UI = self
+        self.questions = []
+        self._abort = abort
+
+    def yes_no(self, question):
+        self.questions.append(question)
+        return self._abort
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def register_testcase(self, name):
+        pass
+
+    def register_testsuite(self, name):
+        pass
+
+
+class _FakeSession(object):
+    """Records what a ResultWriter executes, and hands out row ids."""
+    def __init__(self, failure=None):
+        self.executed = [] # (statement kind, table name, parameters)
+        self.commits = 0
+        self.rollbacks = 0
+        self._failure = failure
+        self._lastid = 0
+
+    def execute(self, statement, params=None):
+        from pycopia.reports import database
+        if statement is database._ALLOCATE_IDS:
+            first = self._lastid + 1
+            self._lastid += params["count"]
+            return [(rid,) for rid in range(first, self._lastid + 1)]
+        if self._failure is not None:
+            raise self._failure
+        self.executed.append((statement.__visit_name__, statement.table.name, params))
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+
+class ParallelSlow(core.Test):
+    ROLES = ("one",)
+    def execute(self):
+        time.sleep(0.5)
+        return self.passed("slow")
+
+class ParallelFast(core.Test):
+    ROLES = ("two",)
+    def execute(self):
+        return self.passed("fast")
+
+class ParallelFail(core.Test):
+    ROLES = ("two",)
+    def execute(self):
+        return self.failed("fail")
+
+class ParallelNeedsFail(core.Test):
+    ROLES = ("three",)
+    PREREQUISITES = ["ParallelFail"]
+    def execute(self):
+        return self.passed("not run")
+
+class ParallelNeedsSlow(core.Test):
+    ROLES = ("two",)
+    PREREQUISITES = ["ParallelSlow"]
+    def execute(self):
+        return self.passed("after slow")
+
+
+class ParallelInterrupt(core.Test):
+    ROLES = ("four",)
+    def execute(self):
+        time.sleep(0.2) # others finish, or are running.
+        os.kill(os.getppid(), signal.SIGINT)
+        time.sleep(5)
+        return self.passed("not interrupted")
+
+class ParallelLater(core.Test):
+    ROLES = ("four",)
+    def execute(self):
+        return self.passed("later")
 
 
 class QATests(unittest.TestCase):
@@ -88,5 +189,298 @@ class QATests(unittest.TestCase):
         assert metadata.voltage == newmeta.voltage
         assert newmeta.state == datafile.ON
 
+    def test_columnar(self):
+        """Test columnar data files."""
+        import numpy, shutil, tempfile
+        tmpdir = tempfile.mkdtemp()
+        try:
+            data = numpy.array([[100.0 + t, t * 0.5, 1.0] for t in range(20)])
+            headers = ["time (s)", "bias (V)", "nodeI (A)"]
+            ds = dataset.DataSet(array=data, headers=headers)
+            ds.metadata["voltage"] = 2.5
+            fname = os.path.join(tmpdir, "columnar.cds")
+            ds.write_columnar(fname)
+            for mmap in (True, False):
+                names, measurements, metadata = dataset.read_columnar(fname, mmap)
+                self.assertEqual(names, headers)
+                self.assertTrue(numpy.array_equal(measurements, data))
+                self.assertEqual(metadata["voltage"], 2.5)
+            ds = dataset.DataSet(fname) # memory mapped.
+            ds.normalize_time()
+            self.assertEqual(ds.measurements[0][0], 0.0)
+            self.assertEqual(ds.measurements[19][0], 19.0)
+            names, measurements, metadata = dataset.read_columnar(fname)
+            self.assertEqual(measurements[0][0], 100.0) # file not changed.
+            slices = [(len(sub.measurements), start, end) for sub, start, end in
+                    dataset.iter_timeslices(fname, "0s,5s,...")]
+            self.assertEqual(slices, [(5, 0.0, 5.0), (5, 5.0, 10.0), (5, 10.0, 15.0),
+                    (5, 15.0, 20.0)])
+            self.assertEqual(slices[1:2], [(len(sub.measurements), start, end)
+                    for sub, start, end in ds.get_timeslices("5s,10s")])
+            textname = os.path.join(tmpdir, "converted.csv")
+            with open(textname, "w") as fo:
+                fo.write(", ".join(headers) + "\n")
+                for t in range(10):
+                    fo.write("%s, %s, %s\n" % (t, t * 0.5, 9.91E+37 if t == 3 else 1.0))
+            cname = dataset.convert_to_columnar(textname, chunkrows=3)
+            self.assertEqual(cname, os.path.join(tmpdir, "converted.cds"))
+            names, measurements, metadata = dataset.read_columnar(cname)
+            self.assertEqual(names, headers)
+            self.assertEqual(measurements.shape, (10, 3))
+            self.assertEqual(list(measurements[:, 1]), [t * 0.5 for t in range(10)])
+            self.assertTrue(numpy.isnan(measurements[3][2]))
+            self.assertEqual(metadata["name"], "converted")
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_parallel_suite(self):
+        """Test running a suite in worker processes."""
+        testclasses = [ParallelSlow, ParallelFast, ParallelFail,
+                ParallelNeedsFail, ParallelNeedsSlow]
+        reports = []
+        for workers in (0, 4):
+            cf = _SuiteConfig(workers)
+            suite = core.TestSuite(cf, name="ParallelSuite")
+            suite.add_tests(testclasses)
+            start = time.time()
+            suite()
+            elapsed = time.time() - start
+            reports.append([call[:2] for call in cf.report.calls
+                    if call[0] in ("add_heading", "passed", "failed", "incomplete")])
+            self.assertEqual([int(entry.result) for entry in suite],
+                    [1, 1, 0, -1, 1])
+        self.assertEqual(reports[0], reports[1])
+        self.assertTrue(elapsed < 0.9) # fast and fail ran while slow ran.
+
+    def test_parallel_suite_interrupted(self):
+        """Test interrupting a suite running in worker processes."""
+        testclasses = [ParallelInterrupt, ParallelFast, ParallelFail, ParallelSlow,
+                ParallelLater]
+        for abort in (True, False):
+            cf = _SuiteConfig(4, abort)
+            suite = core.TestSuite(cf, name="ParallelSuite")
+            suite.add_tests(testclasses)
+            suite()
+            self.assertEqual(cf.questions, ["Test interrupted. Abort suite?"])
+            calls = [call[:2] for call in cf.report.calls
+                    if call[0] in ("add_heading", "passed", "failed", "incomplete")]
+            names = [entry.test_name for entry in suite]
+            # The tests that finished are reported, in order.
+            self.assertEqual(calls[1:9], [
+                    ("add_heading", (names[0], 2)),
+                    ("incomplete", ("%s: aborted by user." % (names[0],), 2)),
+                    ("add_heading", (names[1], 2)),
+                    ("passed", ("fast", 2)),
+                    ("add_heading", (names[2], 2)),
+                    ("failed", ("fail", 2)),
+                    ("add_heading", (names[3], 2)),
+                    ("incomplete", ("%s: aborted by user." % (names[3],), 2))])
+            results = [None if entry.result is None else int(entry.result) for entry in suite]
+            self.assertEqual(results[:4], [-1, 1, 0, -1])
+            infos = [call[1][0] for call in cf.report.calls if call[0] == "info"]
+            if abort:
+                self.assertFalse(("add_heading", (names[4], 2)) in calls) # not run.
+                self.assertTrue("Test suite aborted by user." in infos)
+            else:
+                self.assertEqual(calls[9:11], [("add_heading", (names[4], 2)),
+                        ("passed", ("later", 2))])
+                self.assertEqual(results[4], 1)
+
+    def test_bulk_transfer(self):
+        """Test pulling and pushing a directory over a bulk transfer."""
+        import filecmp, shutil, tempfile
+        tmpdir = tempfile.mkdtemp()
+        try:
+            src = os.path.join(tmpdir, "src")
+            os.makedirs(os.path.join(src, "sub", "empty"))
+            with open(os.path.join(src, "big.bin"), "wb") as fo:
+                fo.write(os.urandom(3 * 1024 * 1024 + 17))
+            with open(os.path.join(src, "sub", "small.txt"), "wb") as fo:
+                fo.write(b"small")
+            agent = PosixServer.PosixAgent() # called locally here.
+            dst = os.path.join(tmpdir, "pulled")
+            result = Client.pull(agent, src, dst, host="127.0.0.1")
+            self.assertTrue(result.ok)
+            self.assertEqual((result.files, result.bytes), (2, 3 * 1024 * 1024 + 22))
+            self.assertTrue(result.rate > 0.0)
+            self.assertTrue(os.path.isdir(os.path.join(dst, "sub", "empty")))
+            self.assertTrue(filecmp.cmp(os.path.join(src, "big.bin"), os.path.join(dst, "big.bin"), False))
+            # Resume a partial file.
+            with open(os.path.join(dst, "big.bin"), "r+b") as fo:
+                fo.truncate(1024 * 1024)
+            result = Client.pull(agent, os.path.join(src, "big.bin"), dst, host="127.0.0.1")
+            self.assertTrue(result.ok)
+            self.assertEqual(result.bytes, 2 * 1024 * 1024 + 17)
+            self.assertTrue(filecmp.cmp(os.path.join(src, "big.bin"), os.path.join(dst, "big.bin"), False))
+            # A corrupt partial file fails the checksum.
+            with open(os.path.join(dst, "big.bin"), "r+b") as fo:
+                fo.write(b"junk")
+                fo.truncate(1024)
+            result = Client.pull(agent, os.path.join(src, "big.bin"), dst, host="127.0.0.1")
+            self.assertEqual(result.failed, [""])
+            result = Client.push(agent, src, os.path.join(tmpdir, "pushed"), host="127.0.0.1")
+            self.assertTrue(result.ok)
+            self.assertEqual(result.destination, os.path.join(tmpdir, "pushed"))
+            self.assertTrue(filecmp.cmp(os.path.join(src, "sub", "small.txt"),
+                    os.path.join(tmpdir, "pushed", "sub", "small.txt"), False))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_bulk_transfer_errors(self):
+        """Test that transfer errors reach the client."""
+        import shutil, socket, tempfile
+        from pycopia.remote import transfer
+        tmpdir = tempfile.mkdtemp()
+        try:
+            src = os.path.join(tmpdir, "src.txt")
+            with open(src, "wb") as fo:
+                fo.write(b"some data")
+            agent = PosixServer.PosixAgent() # called locally here.
+            # The agent can not make a directory under a file.
+            try:
+                Client.push(agent, tmpdir, os.path.join(src, "sub"), host="127.0.0.1")
+            except transfer.TransferError as err:
+                self.assertTrue(str(err).startswith("Receiver failed: OSError"), str(err))
+            else:
+                self.fail("push into a file did not fail.")
+            for i in range(50): # dropped when its thread ends.
+                if not agent._transfers:
+                    break
+                time.sleep(0.02)
+            self.assertEqual(agent._transfers, {})
+            manifest = transfer.make_manifest(src)
+            sender, receiver = socket.socketpair()
+            try:
+                self.assertRaises(transfer.TransferError, transfer.send_files,
+                        sender, sender.makefile("rb"), src, manifest, [])
+                try:
+                    transfer.receive_files(receiver, receiver.makefile("rb"),
+                            os.path.join(tmpdir, "dst.txt"), manifest, [0])
+                except transfer.TransferError as err:
+                    self.assertEqual(str(err),
+                            "Sender failed: TransferError: Got 0 offsets for 1 files.")
+                else:
+                    self.fail("receive_files did not fail.")
+            finally:
+                sender.close()
+                receiver.close()
+            # Falls back to reading through the agent, here since the agent
+            # host is not known.
+            dst = os.path.join(tmpdir, "copied.txt")
+            self.assertTrue(Client.remote_copy(agent, src, dst) is None)
+            with open(dst, "rb") as fo:
+                self.assertEqual(fo.read(), b"some data")
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def _result_tree(self, database):
+        root = database.ResultHolder()
+        root.set("objecttype", database.RUNNER)
+        suite = root.get_result()
+        suite.set("objecttype", database.SUITE)
+        root.append(suite)
+        tests = []
+        for i in range(2):
+            test = suite.get_result()
+            test.set("objecttype", database.TEST)
+            test.set("result", database.PASSED)
+            suite.append(test)
+            tests.append(test)
+        tests[0]._datapoints.append(database.DataHolder({"volts": 5}, "supply"))
+        return root, suite, tests
+
+    def test_result_writer(self):
+        """Test writing results with ids taken in advance, parents first."""
+        from pycopia.reports import database
+        root, suite, tests = self._result_tree(database)
+        session = _FakeSession()
+        writer = database.ResultWriter(session, environment_id=5, tester_id=7)
+        # A test finished early is written with its containers, parents first.
+        writer.write([tests[0]])
+        self.assertEqual((root.id, suite.id, tests[0].id), (1, 2, 3))
+        kind, table, rows = session.executed[0]
+        self.assertEqual((kind, table), ("insert", "test_results"))
+        self.assertEqual([(row["id"], row["parent_id"]) for row in rows],
+                [(1, None), (2, 1), (3, 2)])
+        self.assertEqual(rows[2]["environment_id"], 5)
+        self.assertEqual(rows[2]["tester_id"], 7)
+        self.assertEqual(rows[1]["result"], database.NA) # not finished yet
+        self.assertEqual(session.executed[1], ("insert", "test_results_data",
+                [{"test_results_id": 3, "data": {"volts": 5}, "note": "supply"}]))
+        # The rest is written at finish, and the early containers updated.
+        suite.set("result", database.PASSED)
+        root.set("result", database.PASSED)
+        writer.finish(root)
+        self.assertEqual(tests[1].id, 4)
+        kind, table, rows = session.executed[2]
+        self.assertEqual((kind, table), ("insert", "test_results"))
+        self.assertEqual([(row["id"], row["parent_id"]) for row in rows], [(4, 2)])
+        kind, table, rows = session.executed[3]
+        self.assertEqual((kind, table), ("update", "test_results"))
+        self.assertEqual([(row["_id"], row["result"]) for row in rows],
+                [(1, database.PASSED), (2, database.PASSED)])
+        self.assertFalse([row for row in rows if "id" in row])
+        self.assertEqual(len(session.executed), 4)
+        self.assertEqual(session.commits, 3)
+
+    def test_background_result_writer_error(self):
+        """Test that an error in the writer thread is raised at finish, with
+        its traceback."""
+        import sys, traceback
+        from pycopia.reports import database
+        root, suite, tests = self._result_tree(database)
+        session = _FakeSession(failure=ValueError("database gone"))
+        get_session = database.models.get_session
+        database.models.get_session = lambda: session
+        try:
+            writer = database.BackgroundResultWriter()
+        finally:
+            database.models.get_session = get_session
+        writer.add(tests[0])
+        try:
+            writer.finish(root)
+        except ValueError:
+            frames = traceback.extract_tb(sys.exc_info()[2])
+            self.assertEqual(frames[-1][2], "execute") # where it was raised.
+        else:
+            self.fail("finish did not raise the writer error.")
+        self.assertEqual(session.rollbacks, 1)
+
+    def test_batch(self):
+        """Test running several agent calls as one batch."""
+        import tempfile
+        agent = PosixServer.PosixAgent() # called locally here.
+        fd, name = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            batch = Client.Batch(agent)
+            h = batch.fopen(name, "w")
+            batch.fwrite(h, "some data")
+            batch.fclose(h)
+            exists = batch.exists(name)
+            size = batch.stat(name)[6]
+            results = batch()
+            self.assertEqual(len(results), 5)
+            self.assertEqual(results[0], h.value)
+            self.assertTrue(exists.value)
+            self.assertEqual(size.value, 9)
+            self.assertEqual(len(batch), 0)
+            with Client.Batch(agent) as batch:
+                batch.chmod(name, 0o600)
+                h = batch.fopen(name, "r")
+                data = batch.fread(h, amt=4)
+                batch.fclose(h)
+            self.assertEqual(data.value, "some")
+            self.assertEqual(agent.flist(), [])
+            batch = Client.Batch(agent)
+            batch.unlink(name)
+            batch.unlink(name) # fails, so stops here.
+            exists = batch.exists(name)
+            self.assertRaises(Client.BatchError, batch)
+            self.assertRaises(ValueError, getattr, exists, "value")
+        finally:
+            if os.path.exists(name):
+                os.unlink(name)
+
 if __name__ == '__main__':
     unittest.main()
@@ -29,7 +29,7 @@ from functools import reduce
 from pycopia import ipv4
 from pycopia.aid import unsigned, unsigned64, IF, Enum
 
-from pycopia.SMI import OIDMAP
+from pycopia.SMI import OIDTREE
 
 class Range(object):
     def __init__(self, minValue=-2147483647, maxValue=2147483647):
@@ -421,12 +421,7 @@ class ObjectIdentifier(OID, SimpleSyntax):
 
     def get_object(self):
         """Returns the object class this OID refers to, or None if it is not imported."""
-        oidmap = OIDMAP
-        for i in range(len(self)+1, 4, -1):
-            obj = oidmap.get(str(self[:i]), None)
-            if obj:
-                return obj
-        return None
+        return OIDTREE.longest_prefix(self, 5)
 
 OBJECT_IDENTIFIER = ObjectIdentifier
 
@@ -437,7 +432,7 @@ class IpAddress(ipv4.IPv4, ApplicationSyntax):
     _ber_tag = '\x40'
     ranges = Ranges(Range(4, 4))
     def _ber_(self):
-        result = pack("!l", self._address)
+        result = pack("!L", self._address)
         return self._ber_tag + "\x04" + result
     def _oid_(self):
         return ObjectIdentifier( [(self._address >> 24) & 0x000000ff,
@@ -513,7 +508,7 @@ class _VarBindException(object):
     def __long__(self):
         return long(ord(self._ber_tag))
     def _ber_(self):
-        return self._ber_tag # XXX
+        return self._ber_tag + "\x00" # NULL contents
 
 class noSuchObject(_VarBindException):
     _ber_tag = '\x80'
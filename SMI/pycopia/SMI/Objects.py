@@ -449,6 +449,9 @@ The SNMPTable class is a convenience class to make it easier to use MIB tables.
     def fetch(self, session):
         session.get_table(self.rowobj, self._add_vb)
 
+    def add_varbind(self, vb):
+        self._add_vb(vb)
+
 
 class PlainTable(RawTable):
     def _add_vb(self, vb):
@@ -468,6 +471,9 @@ class ObjectTable(dict):
     def fetch(self, session):
         session.get_table(self.rowclass, self._insert_varbind)
 
+    def add_varbind(self, vb):
+        self._insert_varbind(vb)
+
     def _insert_varbind(self, vb):
         rowindex = vb.name[self.prefixlen+1:]
         indexstr = str(rowindex)
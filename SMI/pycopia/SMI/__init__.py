@@ -32,14 +32,130 @@ from __future__ import division
 import sys
 
 
+class OIDTree(object):
+    """Prefix tree of OIDs, keyed by the integer sub-identifiers.
+
+    Each node is a two item list of the object at that OID (or None), and a
+    dictionary of child nodes (or None). Mappings of OID strings to objects
+    (such as the OIDMAP of a MIB module) are added with add_map, and merged
+    into the tree the next time it is used.
+    """
+    def __init__(self):
+        self._root = [None, {}]
+        self._pending = []
+        self._size = 0
+
+    def add_map(self, oidmap):
+        self._pending.append(oidmap)
+
+    def _merge(self):
+        pending = self._pending
+        self._pending = []
+        for oidmap in pending:
+            for soid, obj in oidmap.items():
+                self.insert([int(s) for s in soid.split(".")], obj)
+
+    def insert(self, oid, obj):
+        node = self._root
+        for subid in oid:
+            children = node[1]
+            if children is None:
+                children = node[1] = {}
+            nextnode = children.get(subid)
+            if nextnode is None:
+                nextnode = children[subid] = [None, None]
+            node = nextnode
+        if node[0] is None:
+            self._size += 1
+        node[0] = obj
+
+    def _find(self, oid):
+        if self._pending:
+            self._merge()
+        node = self._root
+        for subid in oid:
+            children = node[1]
+            if children is None:
+                return None
+            node = children.get(subid)
+            if node is None:
+                return None
+        return node
+
+    def __len__(self):
+        if self._pending:
+            self._merge()
+        return self._size
+
+    def __contains__(self, oid):
+        node = self._find(oid)
+        return node is not None and node[0] is not None
+
+    def get(self, oid, default=None):
+        node = self._find(oid)
+        if node is None or node[0] is None:
+            return default
+        return node[0]
+
+    def __getitem__(self, oid):
+        node = self._find(oid)
+        if node is None or node[0] is None:
+            raise KeyError(oid)
+        return node[0]
+
+    def longest_prefix(self, oid, minlength=1):
+        """Return the object with the longest OID that is a prefix of the
+        given OID, and is at least minlength long. Returns None if there is
+        none."""
+        if self._pending:
+            self._merge()
+        found = None
+        children = self._root[1]
+        depth = 0
+        for subid in oid:
+            node = children.get(subid)
+            if node is None:
+                break
+            depth += 1
+            if node[0] is not None and depth >= minlength:
+                found = node[0]
+            children = node[1]
+            if children is None:
+                break
+        return found
+
+    def items(self, prefix=()):
+        """Iterate over (oid, object) pairs, in OID order, of the given prefix
+        and everything below it."""
+        node = self._find(prefix)
+        if node is None:
+            return
+        stack = [(list(prefix), node)]
+        while stack:
+            oid, node = stack.pop()
+            if node[0] is not None:
+                yield oid, node[0]
+            children = node[1]
+            if children:
+                for subid in sorted(children, reverse=True):
+                    stack.append((oid + [subid], children[subid]))
+
+    def __iter__(self):
+        for oid, obj in self.items():
+            yield oid
+
+
 # "global" OIDMAP contains reverse OID for all imported MIBS.
 OIDMAP = {}
+# And the same in a tree, for longest prefix matching and ordered browsing.
+OIDTREE = OIDTree()
 
 def update_oidmap(basemodname):
     modname = "%s_OID" % basemodname
     __import__(modname)
     oidmod = sys.modules[modname]
     OIDMAP.update(oidmod.OIDMAP)
+    OIDTREE.add_map(oidmod.OIDMAP)
     # clean up extra references
     delattr(oidmod, "OIDMAP")
     del sys.modules[modname]
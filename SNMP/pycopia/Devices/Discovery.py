@@ -26,6 +26,7 @@ from __future__ import division
 from pycopia import ipv4
 from pycopia.SNMP import SNMP
 from pycopia.SNMP import Manager
+from pycopia.SNMP import Walker
 
 from pycopia.SMI.Basetypes import OctetString
 
@@ -220,12 +221,22 @@ class DiscoverManager(Manager.Manager):
         return self.getall('cdpInterfaceEntry') # XXX
     cdpinterfaces = property(_get_CDP_interfaces)
 
+    def _get_ifdescr(self):
+        descr = {}
+        def _add(vb):
+            descr[vb.oid[-1]] = vb.value
+        Walker.walk(self.session, [IF_MIB.ifDescr.OID], _add)
+        return descr
+
     def _get_CDP(self):
         t =  self.getall('cdpCache')
+        descr = self._get_ifdescr()
         cdpt = CDPTable(self.hostname)
         for entry in t:
             ifindex = entry.indexoid[0]
-            iface = self.get("If", ifindex).ifDescr
+            iface = descr.get(ifindex)
+            if iface is None:
+                iface = self.get("If", ifindex).ifDescr
             cdpt.add_entry(iface, entry)
         return cdpt
     cdpcache = property(_get_CDP)
@@ -27,9 +27,10 @@ from struct import pack, unpack
 
 from pycopia.aid import str2hex
 from pycopia.SMI import Basetypes
-from pycopia.SMI import OIDMAP
+from pycopia.SMI import OIDTREE
 
 from pycopia.SNMP import BER_tags
+from pycopia.SNMP import BERUnknownTag, BERBadArgument, BERBadEncoding
 
 # BER decoders
 
@@ -189,12 +190,7 @@ def decode_unsigned32(length, message):
 # PDU decoders
 
 def _find_object(oid):
-    oidmap = OIDMAP
-    for i in range(len(oid), 6, -1):
-        obj = oidmap.get(str(oid[:i]), None)
-        if obj:
-            return obj
-    return None
+    return OIDTREE.longest_prefix(oid, 7)
 
 def _decode_a_varbindlist(vbl_tuple):
     vbl = Basetypes.VarBindList()
@@ -277,3 +273,188 @@ DECODE_METHODS[chr(BER_tags.NOSUCHOBJECT)] = decode_nosuchobject
 DECODE_METHODS[chr(BER_tags.NOSUCHINSTANCE)] = decode_nosuchinstance
 DECODE_METHODS[chr(BER_tags.ENDOFMIBVIEW)] = decode_endofmibview
 
+
+# Buffer decoder. Walks one buffer by offsets, instead of making a new string
+# for each nested TLV. The buffer is a bytearray (such as one filled by
+# socket.recv_into), or a string, which is copied into a bytearray once.
+# Values are the same Basetypes objects that the TLV decoders above make.
+
+def _buffer(message):
+    if isinstance(message, bytearray):
+        return message
+    return bytearray(message)
+
+def _get_length(buf, i, end):
+    """Return the length, and offset of the contents, of the TLV whose
+    length octets start at offset i."""
+    n = buf[i]
+    i += 1
+    if n & 0x80:
+        nbytes = n & 0x7F
+        n = 0
+        for j in range(i, i + nbytes):
+            n = (n << 8) | buf[j]
+        i += nbytes
+    if i + n > end:
+        raise BERBadEncoding("length %d at offset %d runs past end of message" % (n, i))
+    return n, i
+
+def _buf_unsigned(buf, i, end):
+    val = 0
+    while i < end:
+        val = (val << 8) | buf[i]
+        i += 1
+    return val
+
+def _buf_integer(buf, i, end):
+    if buf[i] & 0x80:
+        val = -1
+    else:
+        val = 0
+    while i < end:
+        val = (val << 8) | buf[i]
+        i += 1
+    return val
+
+def _buf_oid(buf, i, end):
+    subid = buf[i]
+    oid = [subid // 40, subid % 40]
+    sub = buf[i+1:end]
+    if not sub or max(sub) < 128: # all single octet sub-identifiers
+        oid.extend(sub)
+        return Basetypes.OBJECT_IDENTIFIER(oid)
+    append = oid.append
+    i += 1
+    while i < end:
+        octet = buf[i]
+        i += 1
+        if octet < 128:
+            append(octet)
+        else:
+            subid = octet & 0x7F
+            while octet >= 128:
+                if i >= end:
+                    raise BERBadEncoding("object identifier runs past end of value")
+                octet = buf[i]
+                i += 1
+                subid = (subid << 7) | (octet & 0x7F)
+            append(subid)
+    return Basetypes.OBJECT_IDENTIFIER(oid)
+
+def _buf_sequence(buf, i, end):
+    sequence = []
+    while i < end:
+        value, i = _buf_decode(buf, i, end)
+        sequence.append(value)
+    return sequence
+
+_BUF_DECODERS = {
+    0x01: lambda buf, i, end: Basetypes.Boolean(buf[i]),
+    0x02: lambda buf, i, end: Basetypes.Integer32(_buf_integer(buf, i, end)),
+    0x04: lambda buf, i, end: Basetypes.OctetString(str(buf[i:end])),
+    0x05: lambda buf, i, end: None,
+    0x06: _buf_oid,
+    0x30: _buf_sequence,
+    0x40: lambda buf, i, end: Basetypes.IpAddress(_buf_unsigned(buf, i, end)),
+    0x41: lambda buf, i, end: Basetypes.Counter32(_buf_unsigned(buf, i, end)),
+    0x42: lambda buf, i, end: Basetypes.Unsigned32(_buf_unsigned(buf, i, end)),
+    0x43: lambda buf, i, end: Basetypes.TimeTicks(_buf_unsigned(buf, i, end)),
+    0x44: lambda buf, i, end: Basetypes.Opaque(str(buf[i:end])),
+    0x46: lambda buf, i, end: Basetypes.Counter64(_buf_unsigned(buf, i, end)),
+    0x80: lambda buf, i, end: Basetypes.noSuchObject(),
+    0x81: lambda buf, i, end: Basetypes.noSuchInstance(),
+    0x82: lambda buf, i, end: Basetypes.endOfMibView(),
+}
+
+_BUF_PDUS = {
+    0xA0: Basetypes.GetRequestPDU,
+    0xA1: Basetypes.GetNextRequestPDU,
+    0xA2: Basetypes.ResponsePDU,
+    0xA3: Basetypes.SetRequestPDU,
+    0xA5: Basetypes.GetBulkRequestPDU,
+    0xA6: Basetypes.InformRequestPDU,
+    0xA7: Basetypes.SNMPv2TrapPDU,
+}
+
+def _buf_decode(buf, i, end):
+    """Decode the TLV at offset i. Return the value, and the offset after
+    it."""
+    if i + 2 > end:
+        raise BERBadArgument("message too small at offset %d" % (i,))
+    tag = buf[i]
+    length, i = _get_length(buf, i + 1, end)
+    vend = i + length
+    pduclass = _BUF_PDUS.get(tag)
+    if pduclass is not None:
+        return _buf_pdu(pduclass, buf, i, vend), vend
+    if tag == 0xA4:
+        raw = _buf_sequence(buf, i, vend)
+        return Basetypes.SNMPv1TrapPDU(raw[0], raw[1], raw[2], raw[3], raw[4],
+                _decode_a_varbindlist(raw[5])), vend
+    try:
+        decoder = _BUF_DECODERS[tag]
+    except KeyError:
+        raise BERUnknownTag("tag 0x%02x at offset %d is unknown" % (tag, i))
+    return decoder(buf, i, vend), vend
+
+def _buf_pdu(pduclass, buf, i, end):
+    request_id, i = _buf_decode(buf, i, end)
+    error_status, i = _buf_decode(buf, i, end)
+    error_index, i = _buf_decode(buf, i, end)
+    if buf[i] != 0x30:
+        raise BERBadEncoding("expected varbind list at offset %d" % (i,))
+    length, i = _get_length(buf, i + 1, end)
+    return pduclass(request_id, error_status, error_index,
+            _buf_varbindlist(buf, i, i + length))
+
+def _buf_varbindlist(buf, i, end):
+    """Decode a VarBindList straight from the buffer, without making the
+    intermediate lists."""
+    vbl = Basetypes.VarBindList()
+    append = vbl.append
+    VarBind = Basetypes.VarBind
+    find_object = OIDTREE.longest_prefix
+    decoders = _BUF_DECODERS
+    while i < end:
+        if buf[i] != 0x30:
+            raise BERBadEncoding("expected varbind at offset %d" % (i,))
+        length, i = _get_length(buf, i + 1, end)
+        vbend = i + length
+        if buf[i] != 0x06:
+            raise BERBadEncoding("expected object identifier at offset %d" % (i,))
+        length, i = _get_length(buf, i + 1, vbend)
+        oid = _buf_oid(buf, i, i + length)
+        i += length
+        tag = buf[i]
+        length, i = _get_length(buf, i + 1, vbend)
+        try:
+            value = decoders[tag](buf, i, i + length)
+        except KeyError:
+            raise BERUnknownTag("tag 0x%02x at offset %d is unknown" % (tag, i))
+        i = vbend
+        obj = find_object(oid, 7)
+        if obj is not None:
+            if value is not None:
+                if (isinstance(value, Basetypes.noSuchInstance) or
+                            isinstance(value, Basetypes.noSuchObject)):
+                    append(VarBind(oid, value))
+                    continue
+                if obj.syntaxobject:
+                    value = obj.syntaxobject(value)
+                if obj.enumerations:
+                    value.enumerations = obj.enumerations
+            append(VarBind(oid, value, obj))
+        else:
+            append(VarBind(oid, value))
+    return vbl
+
+def decode(message, start=0, end=None):
+    """Decode the BER encoded value at offset start of the message, a string
+    or bytearray. Decodes up to end, if given, instead of the end of the
+    message. For an SNMP message, returns [version, community, pdu], the
+    same as get_tlv(message).decode()."""
+    buf = _buffer(message)
+    if end is None:
+        end = len(buf)
+    return _buf_decode(buf, start, end)[0]
+
@@ -0,0 +1,349 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Asynchronous SNMP engine. Talks to many agents at once.
+
+A session object sends one request at a time, and waits for the answer.
+The engine instead sends requests for any number of agents from one (or a
+few) unconnected UDP sockets, and matches the responses to requests by agent
+address and request ID. Retries and timeouts are handled per request, with
+an exponential backoff, and the number of requests in flight to any one
+agent is limited by a window. It runs from the asyncio event loop.
+
+Example usage:
+
+    engine = Engine.get_engine()
+    sessions = [SNMP.get_session(host, "public") for host in hosts]
+    results = engine.get_many(sessions, [sysName.OID+[0], sysUpTime.OID+[0]])
+
+Each result is the response VarBindList, or an exception instance. Managers
+from Manager.get_manager may also be given as agents.
+
+The request methods (get, getnext, getbulk, set) return an asyncio Future,
+and also take an optional callback that is called as:
+
+    callback(sessiondata, varbinds, error)
+
+where one of varbinds or error is None.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+
+import sys
+import collections
+from errno import EAGAIN, EWOULDBLOCK, EINTR
+
+from pycopia import socket
+from pycopia import asyncio
+from pycopia.SMI.Basetypes import (ObjectIdentifier, VarBind, GetRequestPDU,
+        GetNextRequestPDU, SetRequestPDU)
+from pycopia.SNMP import SNMPNoResponse, SNMPBadCommunity, SNMPBadParameters
+from pycopia.SNMP import SNMP
+from pycopia.SNMP import BER_decode
+
+DEFAULT_WINDOW = 4 # most requests in flight to one agent
+RECVBUF_SIZE = 1048576
+
+
+class _Request(object):
+    __slots__ = ("sessiondata", "address", "request_id", "message", "future",
+            "callback", "attempts", "timer")
+
+    def __init__(self, sessiondata, address, request_id, message, future, callback):
+        self.sessiondata = sessiondata
+        self.address = address
+        self.request_id = request_id
+        self.message = message
+        self.future = future
+        self.callback = callback
+        self.attempts = 0
+        self.timer = None
+
+
+class _AgentState(object):
+    """Requests in flight to, and waiting for, one agent."""
+    __slots__ = ("inflight", "waiting")
+
+    def __init__(self):
+        self.inflight = 0
+        self.waiting = collections.deque()
+
+
+class _EngineSocket(asyncio.PollerInterface):
+    def __init__(self, engine):
+        self._engine = engine
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECVBUF_SIZE)
+        self.sock.setblocking(0)
+        self._buf = bytearray(65536)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def readable(self):
+        return True
+
+    def read_handler(self):
+        recvfrom_into = self.sock.recvfrom_into
+        buf = self._buf
+        while 1:
+            try:
+                nbytes, address = recvfrom_into(buf)
+            except socket.error as err:
+                if err.errno == EINTR:
+                    continue
+                if err.errno in (EAGAIN, EWOULDBLOCK):
+                    return
+                raise
+            self._engine._receive(buf, nbytes, address)
+
+    def exception_handler(self, ex, val, tb):
+        print("SNMP engine socket: %s (%s)" % (ex, val), file=sys.stderr)
+
+
+class EngineStats(object):
+    def __init__(self):
+        self.sent = 0
+        self.retransmitted = 0
+        self.received = 0
+        self.timeouts = 0
+        self.unmatched = 0
+
+    def __str__(self):
+        return "sent: %d, retransmitted: %d, received: %d, timeouts: %d, unmatched: %d" % (
+                self.sent, self.retransmitted, self.received, self.timeouts, self.unmatched)
+
+
+class SNMPEngine(object):
+    """Send SNMP requests to many agents concurrently.
+
+    Parameters:
+        nsockets: number of UDP sockets to spread the agents over.
+        window:   most requests in flight to one agent. Others wait their
+                  turn.
+        backoff:  each retry waits this much longer than the previous try.
+        loop:     asyncio EventLoop to run from (default is the module one).
+    """
+    def __init__(self, nsockets=1, window=DEFAULT_WINDOW, backoff=2.0, loop=None):
+        self.window = window
+        self.backoff = backoff
+        self._loop = loop or asyncio.get_event_loop()
+        self._sockets = []
+        for i in range(nsockets):
+            esock = _EngineSocket(self)
+            self._loop.poller.register(esock)
+            self._sockets.append(esock)
+        self._outstanding = {} # (address, request_id) -> _Request
+        self._agents = {} # address -> _AgentState
+        self._addresses = {} # agent name -> resolved address
+        self.message_size = 0 # size of the response being handled
+        self.stats = EngineStats()
+
+    def __len__(self):
+        return len(self._outstanding)
+
+    def close(self):
+        for req in list(self._outstanding.values()):
+            self._finish(req, None, SNMPNoResponse("Engine closed."))
+        for esock in self._sockets:
+            self._loop.poller.unregister(esock)
+            esock.close()
+        self._sockets = []
+
+    def _resolve(self, sessiondata):
+        key = (sessiondata.agent, sessiondata.port)
+        try:
+            return self._addresses[key]
+        except KeyError:
+            addr = self._addresses[key] = (socket.gethostbyname(sessiondata.agent),
+                    sessiondata.port)
+            return addr
+
+    def _socket_for(self, address):
+        return self._sockets[hash(address) % len(self._sockets)]
+
+    # request methods, like those of CommunityBasedSession.
+    def get(self, sessiondata, oids, callback=None):
+        pdu = GetRequestPDU()
+        for oid in oids:
+            pdu.add_varbind(VarBind(ObjectIdentifier(oid)))
+        return self.request(sessiondata, pdu, callback)
+
+    def getnext(self, sessiondata, oids, callback=None):
+        pdu = GetNextRequestPDU()
+        for oid in oids:
+            pdu.add_varbind(VarBind(ObjectIdentifier(oid)))
+        return self.request(sessiondata, pdu, callback)
+
+    def getbulk(self, sessiondata, bulkpdu, callback=None):
+        return self.request(sessiondata, bulkpdu, callback)
+
+    def set(self, sessiondata, varbindlist, callback=None):
+        pdu = SetRequestPDU()
+        for vb in varbindlist:
+            pdu.add_varbind(vb)
+        return self.request(sessiondata, pdu, callback, write=True)
+
+    def request(self, sessiondata, pdu, callback=None, write=False):
+        """Queue a request PDU for the agent. Returns a Future for the
+        response VarBindList."""
+        sessiondata = _get_sessiondata(sessiondata)
+        comm = sessiondata.get_community(SNMP.RW if write else SNMP.RO)
+        if not comm and not write:
+            comm = sessiondata.get_community(SNMP.RW)
+        if not comm:
+            raise SNMPBadCommunity("No community!")
+        message = SNMP.ber(SNMP.CommunityBasedMessage(comm, pdu, sessiondata.version))
+        if not message:
+            raise SNMPBadParameters("No message")
+        address = self._resolve(sessiondata)
+        future = asyncio.Future(self._loop)
+        req = _Request(sessiondata, address, int(pdu.request_id), message, future, callback)
+        agent = self._agents.get(address)
+        if agent is None:
+            agent = self._agents[address] = _AgentState()
+        if agent.inflight < self.window:
+            agent.inflight += 1
+            self._outstanding[(address, req.request_id)] = req
+            self._transmit(req)
+        else:
+            agent.waiting.append(req)
+        return future
+
+    def _transmit(self, req):
+        sd = req.sessiondata
+        try:
+            self._socket_for(req.address).sock.sendto(req.message, req.address)
+        except socket.error as err:
+            if err.errno not in (EAGAIN, EWOULDBLOCK, EINTR): # otherwise, retry later.
+                self._finish(req, None, err)
+                return
+        if req.attempts:
+            self.stats.retransmitted += 1
+        else:
+            self.stats.sent += 1
+        timeout = sd.timeout * (self.backoff ** req.attempts)
+        req.attempts += 1
+        req.timer = self._loop.call_later(timeout, self._timeout, req)
+
+    def _timeout(self, req):
+        req.timer = None
+        if req.attempts < req.sessiondata.retries:
+            self._transmit(req)
+        else:
+            self.stats.timeouts += 1
+            self._finish(req, None,
+                    SNMPNoResponse("No response from %s after %d tries." % (req.address[0], req.attempts)))
+
+    def _receive(self, buf, nbytes, address):
+        try:
+            version, community, pdu = BER_decode.decode(buf, 0, nbytes)
+        except Exception as err:
+            print("warning: bad SNMP message from %s: %s" % (address[0], err), file=sys.stderr)
+            return
+        req = self._outstanding.get((address, int(pdu.request_id)))
+        if req is None:
+            self.stats.unmatched += 1
+            return
+        self.stats.received += 1
+        self.message_size = nbytes
+        if pdu.error_status:
+            self._finish(req, None, SNMP.EXCEPTION_MAP[pdu.error_status](pdu.error_index))
+        else:
+            self._finish(req, pdu.varbinds, None)
+
+    def _finish(self, req, varbinds, error):
+        if req.timer is not None:
+            req.timer.stop()
+            req.timer = None
+        if self._outstanding.pop((req.address, req.request_id), None) is not None:
+            agent = self._agents[req.address]
+            agent.inflight -= 1
+            self._start_waiting(agent)
+        if req.callback is not None:
+            try:
+                req.callback(req.sessiondata, varbinds, error)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                ex, val, tb = sys.exc_info()
+                print("SNMP engine callback error: %s (%s)" % (ex, val), file=sys.stderr)
+        if req.future.done(): # cancelled by the user
+            return
+        if error is None:
+            req.future.set_result(varbinds)
+        else:
+            req.future.set_exception(error)
+
+    def _start_waiting(self, agent):
+        while agent.waiting and agent.inflight < self.window:
+            req = agent.waiting.popleft()
+            if req.future.done():
+                continue
+            agent.inflight += 1
+            self._outstanding[(req.address, req.request_id)] = req
+            self._transmit(req)
+
+    # blocking interfaces
+    def run(self, future, timeout=None):
+        """Run the event loop until the future is done, and return its
+        result."""
+        return self._loop.run_until_complete(future, timeout)
+
+    def get_many(self, agents, oids, timeout=None):
+        """Get the same OIDs from many agents at once.
+
+        The agents may be sessionData objects, sessions, or Managers.
+        Returns a list, in the order of the agents, of the VarBindList from
+        each one, or the exception that request raised.
+        """
+        futures = [self.get(agent, oids) for agent in agents]
+        return self.run(self._loop.gather(*futures, return_exceptions=True), timeout)
+
+
+def _get_sessiondata(agent):
+    if isinstance(agent, SNMP.sessionData):
+        return agent
+    session = getattr(agent, "session", agent) # Managers have a session
+    return session.sessiondata
+
+
+# engines are singleton instances. Use this factory function to get it.
+def get_engine():
+    global engine
+    try:
+        return engine
+    except NameError:
+        engine = SNMPEngine()
+        return engine
+
+def del_engine():
+    global engine
+    engine.close()
+    del engine
+
+def get_many(agents, oids, timeout=None):
+    return get_engine().get_many(agents, oids, timeout)
+
@@ -29,6 +29,7 @@ import warnings
 from pycopia.SMI import Objects
 from pycopia.SMI import Basetypes
 from pycopia.SNMP import SNMP
+from pycopia.SNMP import Walker
 
 
 def default_name_mangler(name):
@@ -170,16 +171,18 @@ device = Manager( snmp_session )
         return_vbl = self.session.get_varbindlist(vbl)
         return tuple([vb.value for vb in return_vbl])
 
-    def getall(self, mangledname, indexoid=None):
-        """getall(tablename, [indexoid=False])
+    def getall(self, mangledname, indexoid=None, start=None, maxrows=None):
+        """getall(tablename, [indexoid=False], [start=None], [maxrows=None])
         Gets all of the rows of a table (given by name). If an (optional) oid
         fragment is given as a second argument, this is used to restrict the
         objects retrieved to that index value. If the row has multiple indexes,
         you must supply a value in the order that the index is listed in the
-        MIB.
+        MIB. The start and maxrows arguments fetch only part of the table,
+        starting after the row index start.
         """
-        t = Objects.ObjectTable(self.rows[mangledname])
-        t.fetch(self.session)
+        rowclass = self.rows[mangledname]
+        t = Objects.ObjectTable(rowclass)
+        Walker.walk_table(self.session, rowclass, t.add_varbind, start, maxrows)
         if indexoid: # return requested subset
             rt = Objects.ObjectTable(self.rows[mangledname])
             OIDtype = Objects.Basetypes.OID
@@ -189,10 +192,10 @@ device = Manager( snmp_session )
             return rt
         return t
 
-    def get_table(self, mangledname):
+    def get_table(self, mangledname, start=None, maxrows=None):
         rowclass = self.rows[mangledname]
         t = Objects.PlainTable(rowclass, str(rowclass))
-        t.fetch(self.session)
+        Walker.walk_table(self.session, rowclass, t.add_varbind, start, maxrows)
         return t
 
     def get_iterator(self, name, indexoid=None, count=0):
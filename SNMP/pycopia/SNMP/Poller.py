@@ -17,15 +17,415 @@
 """
 Poller is used to regularly poll SNMP devices.
 
+A Poller runs a set of PollJobs. Each job names a device (a sessionData,
+session, or Manager), a list of instance OIDs to GET, a list of table
+column OIDs that share an index, and an interval in seconds. The columns are
+walked together with GETBULK, so one request returns whole rows. The first
+poll of each job is started at a random point in its interval, so that a
+fleet of devices with the same interval is spread out over time instead of
+all being polled at once.
+
+Counter32 and Counter64 values also get a rate, in counts per second,
+computed with the SMI.Objects.RunningRate, which handles counter wrap.
+
+The results of each poll are given to a sink object as a list of Sample
+objects. Subclass PollSink to send them somewhere else.
+
+Example usage:
+
+    poller = Poller.Poller(Poller.FileSink(sys.stdout))
+    for host in hosts:
+        sd = SNMP.sessionData(host)
+        sd.add_community("public")
+        poller.add(sd, columns=[IF_MIB.ifInOctets.OID, IF_MIB.ifOutOctets.OID],
+                interval=60)
+    poller.run()
+
+All requests are sent through the SNMP Engine, which runs from the asyncio
+event loop.
 """
 
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+
+import sys
+import random
+
+from pycopia import asyncio
+from pycopia.timelib import now
+from pycopia.SMI.Basetypes import (ObjectIdentifier, Counter32,
+        Counter64, GetBulkRequestPDU, GetNextRequestPDU, endOfMibView,
+        noSuchObject, noSuchInstance)
+from pycopia.SMI.Objects import RunningRate
+from pycopia.SNMP import Engine
+
+MAX_VARBINDS = 32 # instance OIDs per GET request
+MAX_REPETITIONS = 20 # rows per GETBULK request
+
+
+class Sample(object):
+    """One polled value. The rate is None for non-counters, and for the
+    first poll of a counter."""
+    __slots__ = ("device", "oid", "value", "timestamp", "rate")
+
+    def __init__(self, device, oid, value, timestamp, rate=None):
+        self.device = device
+        self.oid = oid
+        self.value = value
+        self.timestamp = timestamp
+        self.rate = rate
+
+    def __repr__(self):
+        return "%s(%r, %r, %r, %r, %r)" % (self.__class__.__name__, self.device,
+                self.oid, self.value, self.timestamp, self.rate)
+
+    def __str__(self):
+        if self.rate is None:
+            return "%.3f %s %s %s" % (self.timestamp, self.device, self.oid, self.value)
+        return "%.3f %s %s %s %.3f" % (self.timestamp, self.device, self.oid, self.value, self.rate)
+
+
+class PollSink(object):
+    """Base class for objects that receive poll results. Override the write
+    method, and optionally the error method."""
+    def write(self, job, samples):
+        raise NotImplementedError
+
+    def error(self, job, exc):
+        print("Poll error: %s: %s" % (job, exc), file=sys.stderr)
+
+    def close(self):
+        pass
+
+
+class ListSink(PollSink):
+    """Collects all samples, and errors, in lists."""
+    def __init__(self):
+        self.samples = []
+        self.errors = []
+
+    def write(self, job, samples):
+        self.samples.extend(samples)
+
+    def error(self, job, exc):
+        self.errors.append((job, exc))
+
+
+class FileSink(PollSink):
+    """Writes samples as lines of text to a file-like object."""
+    def __init__(self, fo):
+        self._fo = fo
+
+    def write(self, job, samples):
+        write = self._fo.write
+        for sample in samples:
+            write(str(sample))
+            write("\n")
+
+    def close(self):
+        self._fo.flush()
+
+
+class CallbackSink(PollSink):
+    """Calls a function with each job and its list of samples."""
+    def __init__(self, callback, errback=None):
+        self._callback = callback
+        self._errback = errback
+
+    def write(self, job, samples):
+        self._callback(job, samples)
+
+    def error(self, job, exc):
+        if self._errback is None:
+            super(CallbackSink, self).error(job, exc)
+        else:
+            self._errback(job, exc)
+
 
+class PollJob(object):
+    """Poll the OIDs and table columns of one device every interval seconds.
+    """
+    def __init__(self, device, oids=(), interval=60.0, columns=()):
+        self.sessiondata = Engine._get_sessiondata(device)
+        self.oids = [ObjectIdentifier(oid) for oid in oids]
+        self.columns = [ObjectIdentifier(oid) for oid in columns]
+        self.interval = float(interval)
+        self.due = None
+        self.busy = False
+        self._timer = None
+
+    def __str__(self):
+        return "PollJob(%s, %d oids, %d columns, %s)" % (self.sessiondata.agent,
+                len(self.oids), len(self.columns), self.interval)
+
+    device = property(lambda self: self.sessiondata.agent)
+
+
+class PollerStats(object):
+    def __init__(self):
+        self.polls = 0
+        self.samples = 0
+        self.errors = 0
+        self.overruns = 0
+
+    def __str__(self):
+        return "polls: %d, samples: %d, errors: %d, overruns: %d" % (
+                self.polls, self.samples, self.errors, self.overruns)
+
+
+class _Poll(object):
+    """The requests of one poll of a job. Finishes when all the requests
+    are done."""
+    def __init__(self, poller, job):
+        self.poller = poller
+        self.job = job
+        self.varbinds = []
+        self.error = None
+        self.pending = 0
+        self.future = asyncio.Future(poller._loop)
+
+    def start(self):
+        job = self.job
+        engine = self.poller.engine
+        oids = job.oids
+        n = self.poller.maxvarbinds
+        self.pending = 1 # until all requests are sent
+        for i in range(0, len(oids), n):
+            self.pending += 1
+            engine.get(job.sessiondata, oids[i:i+n], self._got)
+        if job.columns:
+            self.pending += 1
+            self._walk(job.columns, job.columns)
+        self._finished_one()
+
+    def _got(self, sessiondata, varbinds, error):
+        if error is not None:
+            self.error = error
+        else:
+            self.varbinds.extend(varbinds)
+        self._finished_one()
+
+    def _finished_one(self):
+        self.pending -= 1
+        if not self.pending:
+            self._done()
+
+    def _walk(self, columns, current):
+        job = self.job
+        if job.sessiondata.version == 0: # SNMPv1 has no GETBULK
+            pdu = GetNextRequestPDU()
+            for oid in current:
+                pdu.add_oid(ObjectIdentifier(oid))
+        else:
+            pdu = GetBulkRequestPDU()
+            pdu.set_max_repetitions(self.poller.max_repetitions)
+            for oid in current:
+                pdu.add_repeater(oid)
+        self.poller.engine.request(job.sessiondata, pdu,
+                lambda sd, varbinds, error: self._walked(columns, varbinds, error))
+
+    def _walked(self, columns, varbinds, error):
+        if error is not None:
+            self.error = error
+            self._finished_one()
+            return
+        ncols = len(columns)
+        last = [None] * ncols
+        active = [True] * ncols
+        for i, vb in enumerate(varbinds):
+            col = i % ncols
+            if not active[col]:
+                continue
+            oid = vb.oid
+            column = columns[col]
+            if isinstance(vb.value, endOfMibView) or oid[:len(column)] != column:
+                active[col] = False
+                continue
+            self.varbinds.append(vb)
+            last[col] = oid
+        nextcols = []
+        current = []
+        for col in range(ncols):
+            if active[col] and last[col] is not None:
+                nextcols.append(columns[col])
+                current.append(last[col])
+        if nextcols:
+            self._walk(nextcols, current)
+        else:
+            self._finished_one()
+
+    def _done(self):
+        self.poller._poll_done(self)
+
+
+class Poller(object):
+    """Runs PollJobs, and sends the results to a sink.
+
+    Parameters:
+        sink:            a PollSink instance (default is a ListSink).
+        engine:          SNMP Engine to use (default is the shared one).
+        jitter:          fraction of the interval that the first poll of a
+                         job is randomly delayed by.
+        maxvarbinds:     most instance OIDs in one GET request.
+        max_repetitions: rows per GETBULK request.
+        N:               number of samples in the running rate averages.
+    """
+    def __init__(self, sink=None, engine=None, jitter=1.0, maxvarbinds=MAX_VARBINDS,
+            max_repetitions=MAX_REPETITIONS, N=5):
+        self.sink = sink or ListSink()
+        self.engine = engine or Engine.get_engine()
+        self.jitter = float(jitter)
+        self.maxvarbinds = maxvarbinds
+        self.max_repetitions = max_repetitions
+        self._N = N
+        self._loop = self.engine._loop
+        self._jobs = []
+        self._rates = {} # (agent, port, oid) -> RunningRate
+        self._running = False
+        self.stats = PollerStats()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __iter__(self):
+        return iter(self._jobs)
+
+    def add(self, device, oids=(), interval=60.0, columns=()):
+        """Add a new job, and return it."""
+        job = PollJob(device, oids, interval, columns)
+        self.add_job(job)
+        return job
+
+    def add_job(self, job):
+        self._jobs.append(job)
+        if self._running:
+            self._start_job(job)
+
+    def remove_job(self, job):
+        self._jobs.remove(job)
+        if job._timer is not None:
+            job._timer.stop()
+            job._timer = None
+        prefix = (job.sessiondata.agent, job.sessiondata.port)
+        for key in [k for k in self._rates if k[:2] == prefix]:
+            del self._rates[key]
+
+    def start(self):
+        """Schedule all the jobs."""
+        if not self._running:
+            self._running = True
+            for job in self._jobs:
+                self._start_job(job)
+
+    def stop(self):
+        """Stop scheduling jobs. Polls in progress will still finish."""
+        self._running = False
+        for job in self._jobs:
+            if job._timer is not None:
+                job._timer.stop()
+                job._timer = None
+
+    def run(self, duration=None):
+        """Start, and run the event loop for duration seconds, or until
+        stopped."""
+        self.start()
+        loop = self._loop
+        if duration is None:
+            while self._running:
+                loop.run_once()
+        else:
+            endtime = now() + duration
+            while self._running:
+                remaining = endtime - now()
+                if remaining <= 0.0:
+                    break
+                loop.run_once(remaining)
+            self.stop()
+
+    def close(self):
+        self.stop()
+        self.sink.close()
+
+    def poll(self, job):
+        """Poll the job now. Returns a Future that is done when the samples
+        have been written to the sink."""
+        job.busy = True
+        self.stats.polls += 1
+        p = _Poll(self, job)
+        p.start()
+        return p.future
+
+    def _start_job(self, job):
+        delay = random.uniform(0.0, job.interval * self.jitter)
+        job.due = now() + delay
+        job._timer = self._loop.call_later(delay, self._run_job, job)
+
+    def _run_job(self, job):
+        job._timer = None
+        if not self._running:
+            return
+        if job.busy:
+            self.stats.overruns += 1
+        else:
+            self.poll(job)
+        # Keep to the original schedule, skipping missed intervals.
+        t = now()
+        job.due += job.interval
+        if job.due <= t:
+            missed = int((t - job.due) // job.interval) + 1
+            self.stats.overruns += missed
+            job.due += missed * job.interval
+        job._timer = self._loop.call_later(job.due - t, self._run_job, job)
+
+    def _poll_done(self, p):
+        job = p.job
+        job.busy = False
+        timestamp = now()
+        if p.error is not None:
+            self.stats.errors += 1
+            self.sink.error(job, p.error)
+        samples = self._make_samples(job, p.varbinds, timestamp)
+        if samples:
+            self.stats.samples += len(samples)
+            self.sink.write(job, samples)
+        p.future.set_result(samples)
+
+    def _make_samples(self, job, varbinds, timestamp):
+        sd = job.sessiondata
+        agent = sd.agent
+        rates = self._rates
+        samples = []
+        for vb in varbinds:
+            value = vb.value
+            rate = None
+            if isinstance(value, (Counter32, Counter64)):
+                key = (agent, sd.port, tuple(vb.oid))
+                rr = rates.get(key)
+                if rr is None:
+                    rr = rates[key] = RunningRate(type(value), self._N)
+                rr.update(value, timestamp)
+                rate = rr.rate
+            elif isinstance(value, (noSuchObject, noSuchInstance)):
+                continue
+            samples.append(Sample(agent, vb.oid, value, timestamp, rate))
+        return samples
 
 
 def _test(argv):
-    pass # XXX
+    from pycopia.SNMP import SNMP
+    from pycopia.mibs import SNMPv2_MIB
+    poller = Poller(FileSink(sys.stdout))
+    for host in argv[1:]:
+        sd = SNMP.sessionData(host)
+        sd.add_community("public")
+        poller.add(sd, [SNMPv2_MIB.sysUpTime.OID+[0]], interval=10.0)
+    try:
+        poller.run()
+    except KeyboardInterrupt:
+        poller.close()
 
 if __name__ == "__main__":
     import sys
     _test(sys.argv)
-
@@ -395,8 +395,7 @@ class Session(object):
 # community based session handler. (SNMPv2c)
 class CommunityBasedSession(Session):
     def _decode_message(self, message):
-        tlv = BER_decode.get_tlv(message)
-        version, community, pdu = tlv.decode()
+        version, community, pdu = BER_decode.decode(message)
         return CommunityBasedMessage(community, pdu, version)
 
     def _get_request_message(self):
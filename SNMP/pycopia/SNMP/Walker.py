@@ -0,0 +1,305 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Adaptive table walker.
+
+Walks SNMP table columns with GETBULK. Several columns are put in each
+request, so that one response holds whole rows, and the columns are split
+into a few chains of requests that are in flight at the same time. The
+max-repetitions of each request is computed from the size of the previous
+responses, so that a response fills, but does not exceed, a target message
+size. A tooBig error halves the request size for that agent. What is learned
+about an agent is kept for later walks.
+
+A walk can start after a given row index, and be limited to a number of
+rows, so that a large table may be fetched in parts.
+
+Example usage:
+
+    Walker.walk_table(session, IF_MIB.ifEntry, table.append)
+
+The callback is called with each VarBind, in the same way as the insert
+callback of Session.get_table.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+
+import collections
+
+from pycopia import asyncio
+from pycopia.SMI.Basetypes import (ObjectIdentifier, GetBulkRequestPDU,
+        GetNextRequestPDU, endOfMibView)
+from pycopia.SMI.SMICONSTANTS import SMI_ACCESS_NOT_ACCESSIBLE, SMI_ACCESS_NOTIFY
+from pycopia.SNMP import SNMPtooBig, SNMPnoSuchName, SNMPNoResponse
+from pycopia.SNMP import Engine
+
+TARGET_SIZE = 1400 # fits in an ethernet frame
+MAX_REPETITIONS = 25 # used until an agent's responses are measured
+REPETITIONS_LIMIT = 200
+PARALLEL = 4 # request chains per walk
+
+
+class _Chain(object):
+    """A sequence of requests walking a group of columns."""
+    __slots__ = ("columns", "current", "counts")
+
+    def __init__(self, columns, current):
+        self.columns = columns
+        self.current = current
+        self.counts = [0] * len(columns)
+
+
+class _AgentInfo(object):
+    """What the walker has learned about an agent."""
+    __slots__ = ("target", "varbind_size", "repetitions", "parallel")
+
+    def __init__(self, target, repetitions, parallel):
+        self.target = target
+        self.varbind_size = None
+        self.repetitions = repetitions # until varbind_size is known
+        self.parallel = parallel
+
+
+class _Walk(object):
+    def __init__(self, walker, sessiondata, columns, callback, start, maxrows):
+        self.walker = walker
+        self.sessiondata = sessiondata
+        self.callback = callback
+        self.maxrows = maxrows
+        self.info = walker._get_info(sessiondata)
+        self.count = 0
+        self.active = 0
+        self.future = asyncio.Future(walker.engine._loop)
+        columns = [ObjectIdentifier(col) for col in columns]
+        start = list(start or [])
+        nchains = max(1, min(self.info.parallel, len(columns)))
+        self.waiting = collections.deque()
+        for i in range(nchains):
+            group = columns[i::nchains]
+            self.waiting.append(_Chain(group,
+                    [ObjectIdentifier(col + start) for col in group]))
+
+    def start(self):
+        if not self.waiting:
+            self.future.set_result(0)
+        else:
+            self._start_waiting()
+        return self.future
+
+    def _start_waiting(self):
+        while self.waiting and self.active < self.info.parallel:
+            self.active += 1
+            self._send(self.waiting.popleft())
+
+    def _repetitions(self, chain):
+        info = self.info
+        if info.varbind_size is None:
+            reps = info.repetitions
+        else:
+            reps = int(info.target / (info.varbind_size * len(chain.columns)))
+        reps = max(1, min(reps, self.walker.limit))
+        if self.maxrows:
+            reps = min(reps, self.maxrows - min(chain.counts))
+        return reps
+
+    def _send(self, chain):
+        if self.sessiondata.version == 0: # SNMPv1 has no GETBULK
+            pdu = GetNextRequestPDU()
+            for oid in chain.current:
+                pdu.add_oid(oid)
+            reps = 1
+        else:
+            reps = self._repetitions(chain)
+            pdu = GetBulkRequestPDU()
+            pdu.set_max_repetitions(reps)
+            for oid in chain.current:
+                pdu.add_repeater(oid)
+        try:
+            self.walker.engine.request(self.sessiondata, pdu,
+                    lambda sd, varbinds, error: self._response(chain, reps, varbinds, error))
+        except Exception as err:
+            self._fail(err)
+
+    def _response(self, chain, reps, varbinds, error):
+        if self.future.done():
+            return
+        if error is not None:
+            self._error(chain, reps, error)
+            return
+        info = self.info
+        if varbinds:
+            size = self.walker.engine.message_size / len(varbinds)
+            if info.varbind_size is None:
+                info.varbind_size = size
+            else:
+                info.varbind_size = (info.varbind_size + size) / 2.0
+        columns = chain.columns
+        ncols = len(columns)
+        active = [True] * ncols
+        counts = chain.counts
+        maxrows = self.maxrows
+        callback = self.callback
+        for i, vb in enumerate(varbinds):
+            col = i % ncols
+            if not active[col]:
+                continue
+            oid = vb.oid
+            column = columns[col]
+            # An agent that does not move forward would keep the walk going.
+            if (isinstance(vb.value, endOfMibView) or oid[:len(column)] != column
+                        or oid <= chain.current[col]
+                        or (maxrows and counts[col] >= maxrows)):
+                active[col] = False
+                continue
+            callback(vb)
+            self.count += 1
+            counts[col] += 1
+            chain.current[col] = oid
+        if not varbinds:
+            active = [False] * ncols
+        remaining = [n for n in range(ncols)
+                if active[n] and not (maxrows and counts[n] >= maxrows)]
+        if remaining:
+            if len(remaining) < ncols:
+                chain.columns = [columns[n] for n in remaining]
+                chain.current = [chain.current[n] for n in remaining]
+                chain.counts = [counts[n] for n in remaining]
+            self._send(chain)
+        else:
+            self._chain_done()
+
+    def _error(self, chain, reps, error):
+        info = self.info
+        if isinstance(error, SNMPtooBig):
+            if reps > 1:
+                # Other requests of the same size may have failed too, so
+                # halve the size of this one, not the current target.
+                if info.varbind_size is None:
+                    info.repetitions = min(info.repetitions, reps // 2)
+                else:
+                    info.target = min(info.target,
+                            info.varbind_size * len(chain.columns) * reps / 2.0)
+                self._send(chain)
+                return
+            if len(chain.columns) > 1:
+                half = len(chain.columns) // 2
+                self.waiting.append(_Chain(chain.columns[half:], chain.current[half:]))
+                self.waiting[-1].counts = chain.counts[half:]
+                chain.columns = chain.columns[:half]
+                chain.current = chain.current[:half]
+                chain.counts = chain.counts[:half]
+                self._send(chain)
+                self._start_waiting()
+                return
+        elif isinstance(error, SNMPnoSuchName) and self.sessiondata.version == 0:
+            self._chain_done() # end of MIB view in SNMPv1
+            return
+        elif isinstance(error, SNMPNoResponse) and self.active > 1:
+            # Too many requests at once for this agent. Try again later, with
+            # fewer at a time.
+            info.parallel = max(1, self.active - 1)
+            self.active -= 1
+            self.waiting.appendleft(chain)
+            return
+        self._fail(error)
+
+    def _chain_done(self):
+        self.active -= 1
+        self._start_waiting()
+        if not self.active and not self.waiting:
+            self.future.set_result(self.count)
+
+    def _fail(self, error):
+        self.waiting.clear()
+        if not self.future.done():
+            self.future.set_exception(error)
+
+
+class TableWalker(object):
+    """Walks table columns with adaptive GETBULK requests.
+
+    Parameters:
+        engine:          SNMP Engine to use (default is the shared one).
+        target_size:     response message size to aim for.
+        max_repetitions: max-repetitions of the first requests to an agent.
+        limit:           largest max-repetitions used.
+        parallel:        request chains per walk.
+    """
+    def __init__(self, engine=None, target_size=TARGET_SIZE,
+            max_repetitions=MAX_REPETITIONS, limit=REPETITIONS_LIMIT, parallel=PARALLEL):
+        self.engine = engine or Engine.get_engine()
+        self.target_size = target_size
+        self.max_repetitions = max_repetitions
+        self.limit = limit
+        self.parallel = parallel
+        self._agents = {} # (agent, port) -> _AgentInfo
+
+    def _get_info(self, sessiondata):
+        key = (sessiondata.agent, sessiondata.port)
+        info = self._agents.get(key)
+        if info is None:
+            info = self._agents[key] = _AgentInfo(self.target_size,
+                    self.max_repetitions, self.parallel)
+        return info
+
+    def walk(self, device, columns, callback, start=None, maxrows=None):
+        """Walk the column OIDs of the device's table, calling the callback
+        with each VarBind. Starts after the row index `start`, if given,
+        and fetches no more than `maxrows` rows, if given.
+
+        Returns a Future with the number of VarBinds found.
+        """
+        sessiondata = Engine._get_sessiondata(device)
+        return _Walk(self, sessiondata, columns, callback, start, maxrows).start()
+
+    def walk_table(self, device, rowclass, callback, start=None, maxrows=None):
+        """Walk all the readable columns of a table row class."""
+        return self.walk(device, get_columns(rowclass), callback, start, maxrows)
+
+    def run(self, future, timeout=None):
+        return self.engine.run(future, timeout)
+
+
+def get_columns(rowclass):
+    """Return the OIDs of the readable columns of a table row class."""
+    columns = [col for col in rowclass.columns.values()
+            if col.access not in (SMI_ACCESS_NOT_ACCESSIBLE, SMI_ACCESS_NOTIFY)]
+    return [col.OID for col in sorted(columns, key=lambda c: c.OID)]
+
+
+# walkers are singleton instances. Use this factory function to get it.
+def get_walker():
+    global walker
+    try:
+        return walker
+    except NameError:
+        walker = TableWalker()
+        return walker
+
+def walk(device, columns, callback, start=None, maxrows=None, timeout=None):
+    """Walk columns, and wait for the walk to finish. Returns the number of
+    VarBinds found."""
+    w = get_walker()
+    return w.run(w.walk(device, columns, callback, start, maxrows), timeout)
+
+def walk_table(device, rowclass, callback, start=None, maxrows=None, timeout=None):
+    w = get_walker()
+    return w.run(w.walk_table(device, rowclass, callback, start, maxrows), timeout)
+
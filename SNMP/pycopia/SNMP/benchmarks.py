@@ -0,0 +1,173 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks of SNMP message decoding.
+
+These run over a corpus of encoded response messages. A corpus may be
+recorded from real agents and saved with write_corpus (one hex encoded
+message per line), or made up from the objects of a MIB module with
+make_corpus.
+
+    python -m pycopia.SNMP.benchmarks [corpusfile]
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+
+import random
+import binascii
+
+from pycopia.benchmarks import BenchCompare
+from pycopia.SMI import OIDMAP
+from pycopia.SMI import Basetypes
+from pycopia.SNMP import SNMP
+from pycopia.SNMP import BER_decode
+
+
+def read_corpus(fo):
+    """Read a corpus of messages from a file object."""
+    messages = []
+    for line in fo:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            messages.append(binascii.unhexlify(line))
+    return messages
+
+def write_corpus(fo, messages):
+    for msg in messages:
+        fo.write(binascii.hexlify(msg))
+        fo.write("\n")
+
+
+def make_corpus(count=100, varbinds=30, seed=1, mib=None):
+    """Make a list of encoded response messages, as from table walks, using
+    the OIDs of the objects in a MIB module (SNMPv2-MIB by default). Indexes
+    of several lengths are used, as in real tables (ifIndex, IP address,
+    strings)."""
+    if mib is None:
+        from pycopia.mibs import SNMPv2_MIB as mib
+    rnd = random.Random(seed)
+    objects = []
+    for name, obj in sorted(vars(mib).items()):
+        syntax = getattr(obj, "syntaxobject", None)
+        if syntax is None or len(getattr(obj, "OID", ())) < 7:
+            continue
+        for sample in (1, "text"):
+            try:
+                syntax(sample)
+            except Exception:
+                continue
+            objects.append((Basetypes.ObjectIdentifier(obj.OID), syntax, sample))
+            break
+    messages = []
+    for i in range(count):
+        pdu = Basetypes.ResponsePDU(Basetypes.get_RequestId(), Basetypes.INTEGER(0),
+                Basetypes.INTEGER(0), Basetypes.VarBindList())
+        for j in range(varbinds):
+            oid, syntax, sample = rnd.choice(objects)
+            kind = rnd.randint(0, 2)
+            if kind == 0:
+                index = [rnd.randint(1, 500)]
+            elif kind == 1:
+                index = [rnd.randint(1, 50)] + [rnd.randint(0, 255) for k in range(4)]
+            else:
+                name = "eth%d/%d" % (rnd.randint(0, 9), rnd.randint(0, 48))
+                index = [len(name)] + [ord(c) for c in name]
+            if isinstance(sample, str):
+                value = syntax("port %d" % (rnd.randint(0, 48),))
+            else:
+                value = syntax(1)
+            pdu.add_varbind(Basetypes.VarBind(Basetypes.ObjectIdentifier(oid + index), value))
+        messages.append(SNMP.ber(SNMP.CommunityBasedMessage("public", pdu, 1)))
+    return messages
+
+
+def _find_object_map(oid):
+    """The OIDMAP probing lookup that the tree replaced."""
+    oidmap = OIDMAP
+    for i in range(len(oid), 6, -1):
+        obj = oidmap.get(str(oid[:i]), None)
+        if obj:
+            return obj
+    return None
+
+
+def compare_find_object(corpus=None, iterations=20, loops=3):
+    """Compare decoding a corpus with the OIDMAP dictionary probing, and
+    with the OIDTREE prefix tree."""
+    if corpus is None:
+        corpus = make_corpus()
+    find_object_tree = BER_decode._find_object
+
+    def _decode_all():
+        found = 0
+        for msg in corpus:
+            version, community, pdu = BER_decode.get_tlv(msg).decode()
+            for vb in pdu.varbinds:
+                if vb.Object is not None:
+                    found += 1
+        return found
+
+    def decode_oidmap():
+        BER_decode._find_object = _find_object_map
+        try:
+            return _decode_all()
+        finally:
+            BER_decode._find_object = find_object_tree
+
+    def decode_oidtree():
+        return _decode_all()
+
+    bc = BenchCompare((decode_oidmap, decode_oidtree), iterations=iterations, loops=loops)
+    return bc()
+
+
+def compare_decoders(corpus=None, iterations=20, loops=3):
+    """Compare decoding a corpus with the TLV decoder, and with the buffer
+    decoder."""
+    if corpus is None:
+        corpus = make_corpus()
+
+    def decode_tlv():
+        count = 0
+        for msg in corpus:
+            count += len(BER_decode.get_tlv(msg).decode()[2].varbinds)
+        return count
+
+    def decode_buffer():
+        count = 0
+        for msg in corpus:
+            count += len(BER_decode.decode(msg)[2].varbinds)
+        return count
+
+    bc = BenchCompare((decode_tlv, decode_buffer), iterations=iterations, loops=loops)
+    return bc()
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as fo:
+            corpus = read_corpus(fo)
+    else:
+        corpus = make_corpus()
+    for compare in (compare_find_object, compare_decoders):
+        cmpres = compare(corpus)
+        print (cmpres)
+        print (cmpres.get_ratios())
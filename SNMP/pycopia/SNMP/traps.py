@@ -160,8 +160,8 @@ class TrapDispatcher(socket.AsyncSocket):
         src.port = port
         msg = self.recv(length)
         assert length == len(msg)
-        tlv = BER_decode.get_tlv(msg) # should be community based message
-        version, community, pdu = tlv.decode()
+        # should be community based message
+        version, community, pdu = BER_decode.decode(msg)
         if version == 0:
             pdu = _translate2v2(ip, community, pdu)
         tr = TrapRecord(now(), src, community, pdu)
@@ -20,6 +20,7 @@
 """
 
 import unittest
+import bisect
 
 from pycopia.SNMP import BER_tags
 from pycopia.SNMP import BER_decode
@@ -30,11 +31,250 @@ from pycopia.SNMP import Poller
 #from pycopia.SNMP import Stripcharts
 from pycopia.SNMP import traps
 #from pycopia.SNMP import trapserver
+from pycopia.SNMP import Engine
+from pycopia.SNMP import Walker
+from pycopia.SNMP import benchmarks
+from pycopia.SNMP import BERBadEncoding
+from pycopia.SNMP import SNMPNoResponse
+from pycopia.SMI import Basetypes
+from pycopia import asyncio
+from pycopia import socket
+
+
+class FakeAgent(asyncio.PollerInterface):
+    """Answers GET, GETNEXT and GETBULK requests from a dictionary of OID
+    tuples to values, after holding back the first `drop` requests."""
+    def __init__(self, mib, drop=0, maxsize=65000):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.mib = mib
+        self.drop = drop
+        self.maxsize = maxsize
+        self.requests = 0
+        self.toobig = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def readable(self):
+        return True
+
+    def _next(self, oid):
+        keys = sorted(self.mib)
+        i = bisect.bisect_right(keys, tuple(oid))
+        if i == len(keys):
+            return Basetypes.VarBind(oid, Basetypes.endOfMibView())
+        return Basetypes.VarBind(Basetypes.ObjectIdentifier(list(keys[i])), self.mib[keys[i]])
+
+    def read_handler(self):
+        data, addr = self.sock.recvfrom(65536)
+        self.requests += 1
+        if self.drop:
+            self.drop -= 1
+            return
+        version, community, pdu = BER_decode.get_tlv(data).decode()
+        resp = Basetypes.ResponsePDU(pdu.request_id, Basetypes.INTEGER(0),
+                Basetypes.INTEGER(0), Basetypes.VarBindList())
+        if isinstance(pdu, Basetypes.GetBulkRequestPDU):
+            nonrep = int(pdu.non_repeaters)
+            for vb in pdu.varbinds[:nonrep]:
+                resp.add_varbind(self._next(vb.oid))
+            current = [vb.oid for vb in pdu.varbinds[nonrep:]]
+            for i in range(int(pdu.max_repetitions)):
+                row = [self._next(oid) for oid in current]
+                for vb in row:
+                    resp.add_varbind(vb)
+                current = [vb.oid for vb in row]
+        elif isinstance(pdu, Basetypes.GetNextRequestPDU):
+            for vb in pdu.varbinds:
+                resp.add_varbind(self._next(vb.oid))
+        else:
+            for vb in pdu.varbinds:
+                value = self.mib.get(tuple(vb.oid), Basetypes.noSuchInstance())
+                resp.add_varbind(Basetypes.VarBind(vb.oid, value))
+        msg = SNMP.ber(SNMP.CommunityBasedMessage(community, resp, version))
+        if len(msg) > self.maxsize:
+            self.toobig += 1
+            resp = Basetypes.ResponsePDU(pdu.request_id, Basetypes.INTEGER(1),
+                    Basetypes.INTEGER(0), Basetypes.VarBindList())
+            msg = SNMP.ber(SNMP.CommunityBasedMessage(community, resp, version))
+        self.sock.sendto(msg, addr)
+
 
 class SNMPTests(unittest.TestCase):
     def setUp(self):
         pass
 
+    def test_engine(self):
+        agents = []
+        for i in range(6):
+            agent = FakeAgent({}, drop=i % 2)
+            agent.mib[(1,3,6,1,4,1,99999,1,0)] = Basetypes.Integer32(agent.port)
+            agent.mib[(1,3,6,1,4,1,99999,2,0)] = Basetypes.Integer32(agent.port)
+            agents.append(agent)
+        for agent in agents:
+            asyncio.poller.register(agent)
+        sessions = [SNMP.sessionData("127.0.0.1", port=agent.port, timeout=0.1) for agent in agents]
+        dead = SNMP.sessionData("127.0.0.1", port=1, retries=2, timeout=0.05)
+        for sd in sessions + [dead]:
+            sd.add_community("public")
+        engine = Engine.SNMPEngine(window=2)
+        try:
+            oids = [[1,3,6,1,4,1,99999,1,0], [1,3,6,1,4,1,99999,2,0]]
+            results = engine.get_many(sessions + [dead], oids, timeout=10.0)
+            self.assertEqual(len(results), 7)
+            for agent, varbinds in zip(agents, results):
+                self.assertEqual(len(varbinds), 2)
+                self.assertEqual(int(varbinds[0].value), agent.port)
+            self.assertTrue(isinstance(results[-1], SNMPNoResponse))
+            self.assertEqual(engine.stats.retransmitted, 3 + 1)
+            self.assertEqual(len(engine), 0)
+            # windowed requests to one agent, with callbacks.
+            got = []
+            futures = [engine.get(sessions[0], oids[:1], lambda sd, vbl, err: got.append(err))
+                    for i in range(5)]
+            engine.run(asyncio.get_event_loop().gather(*futures), 10.0)
+            self.assertEqual(got, [None]*5)
+        finally:
+            engine.close()
+            for agent in agents:
+                asyncio.poller.unregister(agent)
+                agent.sock.close()
+
+    def test_poller(self):
+        ifInOctets = [1,3,6,1,2,1,2,2,1,10]
+        ifOutOctets = [1,3,6,1,2,1,2,2,1,16]
+        mib = {(1,3,6,1,2,1,1,3,0): Basetypes.TimeTicks(100),
+               (1,3,6,1,2,1,2,2,1,20,1): Basetypes.Counter32(0)}
+        for i in range(1, 51):
+            mib[tuple(ifInOctets+[i])] = Basetypes.Counter32(4294967290)
+            mib[tuple(ifOutOctets+[i])] = Basetypes.Counter32(i)
+        agent = FakeAgent(mib)
+        asyncio.poller.register(agent)
+        sd = SNMP.sessionData("127.0.0.1", port=agent.port, timeout=0.5)
+        sd.add_community("public")
+        engine = Engine.SNMPEngine()
+        poller = Poller.Poller(engine=engine, jitter=0.0, max_repetitions=7)
+        try:
+            job = poller.add(sd, [[1,3,6,1,2,1,1,3,0], [1,3,6,1,2,1,1,4,0]],
+                    interval=0.1, columns=[ifInOctets, ifOutOctets])
+            first = engine.run(poller.poll(job), 10.0)
+            self.assertEqual(len(first), 101) # missing sysContact left out
+            for i in range(1, 51):
+                mib[tuple(ifInOctets+[i])] = Basetypes.Counter32(10) # wrapped
+            second = engine.run(poller.poll(job), 10.0)
+            self.assertEqual(len(second), 101)
+            t0 = first[0].timestamp
+            t1 = second[0].timestamp
+            for s in second:
+                if s.oid[:10] == ifInOctets:
+                    self.assertAlmostEqual(s.rate * (t1 - t0), 16.0, 3)
+                elif s.oid[:10] == ifOutOctets:
+                    self.assertEqual(s.rate, 0.0)
+                else:
+                    self.assertTrue(s.rate is None)
+            poller.run(0.35)
+            self.assertTrue(poller.stats.polls >= 4, str(poller.stats))
+            self.assertEqual(poller.stats.errors, 0)
+        finally:
+            poller.close()
+            engine.close()
+            asyncio.poller.unregister(agent)
+            agent.sock.close()
+
+
+    def test_walker(self):
+        columns = [[1,3,6,1,2,1,2,2,1,2], [1,3,6,1,2,1,2,2,1,5], [1,3,6,1,2,1,2,2,1,10]]
+        mib = {(1,3,6,1,2,1,2,2,1,20,1): Basetypes.Counter32(0)}
+        for col in columns:
+            for i in range(1, 301):
+                mib[tuple(col+[i])] = Basetypes.Counter32(i)
+        agent = FakeAgent(mib, maxsize=1200)
+        asyncio.poller.register(agent)
+        sd = SNMP.sessionData("127.0.0.1", port=agent.port, timeout=0.5)
+        sd.add_community("public")
+        engine = Engine.SNMPEngine()
+        walker = Walker.TableWalker(engine, max_repetitions=100, parallel=2)
+        try:
+            got = []
+            count = walker.run(walker.walk(sd, columns, got.append), 10.0)
+            self.assertEqual(count, 900)
+            self.assertEqual(sorted(tuple(vb.oid) for vb in got),
+                    sorted(k for k in mib if k[9] != 20))
+            self.assertTrue(agent.toobig > 0)
+            # Adapted to the agent, so no more tooBig errors.
+            agent.toobig = 0
+            requests = agent.requests
+            got = []
+            walker.run(walker.walk(sd, columns, got.append), 10.0)
+            self.assertEqual(len(got), 900)
+            self.assertEqual(agent.toobig, 0)
+            self.assertTrue(agent.requests - requests < 40, agent.requests - requests)
+            # partial table
+            got = []
+            count = walker.run(walker.walk(sd, columns, got.append, start=[100], maxrows=50), 10.0)
+            self.assertEqual(count, 150)
+            self.assertEqual(sorted(set(int(vb.oid[-1]) for vb in got)), range(101, 151))
+        finally:
+            engine.close()
+            asyncio.poller.unregister(agent)
+            agent.sock.close()
+    def test_walker_not_increasing(self):
+        column = [1,3,6,1,2,1,2,2,1,2]
+        mib = dict((tuple(column+[i]), Basetypes.Counter32(i)) for i in range(1, 21))
+
+        class LoopingAgent(FakeAgent):
+            def _next(self, oid):
+                if tuple(oid) >= tuple(column+[10]): # back to an earlier row
+                    oid = column+[4]
+                return FakeAgent._next(self, oid)
+
+        agent = LoopingAgent(mib)
+        asyncio.poller.register(agent)
+        sd = SNMP.sessionData("127.0.0.1", port=agent.port, timeout=0.5)
+        sd.add_community("public")
+        engine = Engine.SNMPEngine()
+        walker = Walker.TableWalker(engine, max_repetitions=3)
+        try:
+            got = []
+            count = walker.run(walker.walk(sd, [column], got.append), 10.0)
+            self.assertEqual(count, 10)
+            self.assertEqual([int(vb.oid[-1]) for vb in got], range(1, 11))
+        finally:
+            engine.close()
+            asyncio.poller.unregister(agent)
+            agent.sock.close()
+
+    def test_buffer_decoder(self):
+        corpus = benchmarks.make_corpus(20)
+        pdu = Basetypes.ResponsePDU(Basetypes.get_RequestId(), Basetypes.INTEGER(0),
+                Basetypes.INTEGER(0), Basetypes.VarBindList())
+        for oid, value in (
+                ([1,3,6,1,4,1,2147483647,16384,128,0], Basetypes.Integer32(-2147483648)),
+                ([1,3,6,1,4,1,9,2], Basetypes.Counter64(18446744073709551615)),
+                ([1,3,6,1,4,1,9,3], Basetypes.IpAddress("192.168.1.254")),
+                ([1,3,6,1,4,1,9,4], Basetypes.TimeTicks(4294967295)),
+                ([1,3,6,1,4,1,9,5], Basetypes.Gauge32(128)),
+                ([1,3,6,1,4,1,9,6], Basetypes.OctetString("x" * 300)),
+                ([1,3,6,1,4,1,9,7], Basetypes.noSuchObject()),
+                ([1,3,6,1,4,1,9,8], Basetypes.endOfMibView()),
+                ([1,3,6,1,4,1,9,9], None),
+                ([1,3,6,1,2,1,1,3,0], Basetypes.TimeTicks(0)),
+                ):
+            pdu.add_varbind(Basetypes.VarBind(Basetypes.ObjectIdentifier(oid), value))
+        corpus.append(SNMP.ber(SNMP.CommunityBasedMessage("private", pdu, 0)))
+        for msg in corpus:
+            old = BER_decode.get_tlv(msg).decode()
+            for new in (BER_decode.decode(msg), BER_decode.decode(bytearray(msg))):
+                self.assertEqual(repr(new), repr(old))
+                for oldvb, newvb in zip(old[2].varbinds, new[2].varbinds):
+                    self.assertEqual(type(newvb.value), type(oldvb.value))
+                    self.assertTrue(newvb.Object is oldvb.Object)
+        buf = bytearray(100) + bytearray(corpus[-1]) + bytearray(50)
+        new = BER_decode.decode(buf, 100, len(buf) - 50)
+        self.assertEqual(repr(new), repr(old))
+        self.assertRaises(BERBadEncoding, BER_decode.decode, corpus[0][:-10])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,115 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks of URL resolving.
+
+Compares trying each URL map in turn with the compiled RoutingTable, for
+more and more registered maps. The time per path of the routing table should
+stay about the same as the number of maps grows.
+
+    python -m pycopia.WWW.benchmarks
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+
+import random
+
+from pycopia.benchmarks import BenchCompare
+from pycopia.WWW import framework
+
+
+# Shaped like the LOCATIONMAP entries of the web applications.
+ROUTE_FORMS = [
+    r"^/%s/?$",
+    r"^/%s/table/(?P<tablename>\w+)/$",
+    r"^/%s/table/(?P<tablename>\w+)/edit/(?P<rowid>\d+)/$",
+    r"^/%s/view/(?P<name>\S+)/?$",
+    r"^/%s/api/(?P<methodname>\w+)$",
+]
+
+PATH_FORMS = [
+    "/%s/",
+    "/%s/table/equipment/",
+    "/%s/table/equipment/edit/42/",
+    "/%s/view/report1",
+    "/%s/api/get_status",
+    "/%s/nothing/here",
+]
+
+
+def _handler(request, **kwargs):
+    return kwargs
+
+
+def make_urlmaps(count):
+    """Make a list of count URL maps, under different application names."""
+    maps = []
+    for i in range(count):
+        maps.append(framework.URLMap(ROUTE_FORMS[i % len(ROUTE_FORMS)] % (
+                "app%d" % (i // len(ROUTE_FORMS),)), _handler))
+    return maps
+
+
+def make_paths(count, npaths=100, seed=1):
+    """Make paths to resolve with maps from make_urlmaps(count). Some of them
+    match nothing."""
+    rnd = random.Random(seed)
+    napps = max(1, count // len(ROUTE_FORMS))
+    return [rnd.choice(PATH_FORMS) % ("app%d" % (rnd.randrange(napps),))
+            for i in range(npaths)]
+
+
+def compare_resolvers(counts=(10, 100, 1000), iterations=200, loops=3):
+    """Compare trying the maps in turn with the routing table, for each
+    number of maps in counts. Returns a list of (count, results) pairs."""
+    results = []
+    for count in counts:
+        maps = make_urlmaps(count)
+        table = framework.RoutingTable(maps)
+        paths = make_paths(count)
+
+        def match_loop():
+            found = 0
+            for path in paths:
+                for urlmap in maps:
+                    method, kwargs = urlmap.match(path)
+                    if method:
+                        found += 1
+                        break
+            return found
+
+        def match_table():
+            found = 0
+            for path in paths:
+                method, kwargs = table.match(path)
+                if method:
+                    found += 1
+            return found
+
+        bc = BenchCompare((match_loop, match_table), iterations=iterations, loops=loops)
+        results.append((count, bc()))
+    return results
+
+
+if __name__ == "__main__":
+    for count, cmpres in compare_resolvers():
+        print ("%d URL maps:" % (count,))
+        print (cmpres)
+        print (cmpres.get_ratios())
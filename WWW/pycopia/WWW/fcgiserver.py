@@ -34,7 +34,7 @@ from pycopia import module
 from pycopia.WWW import framework
 from pycopia import proctools
 
-from pycopia.inet.fcgi import FCGIServer
+from pycopia.inet.fcgi import FCGIServer, PreforkFCGIServer
 
 
 class ProcessManager(object):
@@ -65,7 +65,6 @@ def get_server(config):
         pwent = passwd.getpwnam(username)
     else:
         pwent = None
-    pm = ProcessManager(pwent)
 
     app = framework.FrameworkAdapter(config)
 
@@ -78,8 +77,26 @@ def get_server(config):
     if config.DEBUG:
         logging.loglevel_debug()
 
+    # Pre-forked workers, unless WORKERS is zero. Then a process is forked
+    # for each connection. Debug mode serves in the server process.
+    workers = config.get("WORKERS", 4)
+    if workers and not config.DEBUG:
+        if pwent is not None:
+            worker_init = lambda: proctools.run_as(pwent)
+        else:
+            worker_init = None
+        return PreforkFCGIServer(app,
+                workers=workers,
+                maxrequests=config.get("MAX_REQUESTS", 0),
+                maxrss=config.get("MAX_RSS", 0),
+                statuspath=config.get("STATUS_PATH"),
+                worker_init=worker_init,
+                bindAddress=config.SOCKETPATH,
+                errorhandler=None,
+                umask=config.get("SOCKET_UMASK", 0))
+
     return FCGIServer(app,
-            procmanager=pm,
+            procmanager=ProcessManager(pwent),
             bindAddress=config.SOCKETPATH,
             errorhandler=None,
             umask=config.get("SOCKET_UMASK", 0),
@@ -39,6 +39,7 @@ import simplejson
 
 from pycopia import urlparse
 from pycopia.inet import httputils
+from pycopia import dictlib
 from pycopia.dictlib import ObjectCache
 from pycopia.WWW.middleware import POMadapter
 
@@ -161,7 +162,7 @@ class HttpResponse(object):
         return self.headers.asWSGI()
 
     def _get_content(self):
-        return b''.join([o.encode(self._charset) for o in self._container])
+        return b''.join([self._encode(o) for o in self._container])
 
     def _set_content(self, value):
         self._container = [value]
@@ -174,10 +175,15 @@ class HttpResponse(object):
         return self
 
     def __next__(self):
-        chunk = self._iterator.next()
-        return chunk.encode(self._charset)
+        return self._encode(self._iterator.next())
     next = __next__
 
+    def _encode(self, chunk):
+        # Chunks from a document's iterencode() are already encoded.
+        if isinstance(chunk, bytes):
+            return chunk
+        return chunk.encode(self._charset)
+
     def close(self):
         try:
             self._container.close()
@@ -490,28 +496,200 @@ class URLRedirector(object):
         return HttpResponsePermanentRedirect(self._loc % kwargs)
 
 
+_REGEX_SPECIAL = set(".^$*+?{}[]\\|()")
+_REGEX_REPEAT = set("*+?{")
+_GROUP_NAME_RE = re.compile(r"\(\?P([<=])(\w+)")
+_UNSAFE_TAIL_RE = re.compile(r"\\[1-9]|\(\?[iLmsux]")
+_MAX_GROUPS = 99 # the re module allows 100 named groups.
+
+
+def _split_prefix(regexp):
+    """Split a URL pattern into its static prefix, and the regular expression
+    for the rest of it.
+    """
+    pos = 1 if regexp.startswith("^") else 0
+    if _has_branch(regexp):
+        return "", regexp[pos:]
+    prefix = []
+    end = len(regexp)
+    while pos < end:
+        c = regexp[pos]
+        if c == "\\" and pos + 1 < end and not regexp[pos + 1].isalnum():
+            nextpos = pos + 2
+            c = regexp[pos + 1]
+        elif c not in _REGEX_SPECIAL:
+            nextpos = pos + 1
+        else:
+            break
+        if nextpos < end and regexp[nextpos] in _REGEX_REPEAT:
+            break
+        prefix.append(c)
+        pos = nextpos
+    return "".join(prefix), regexp[pos:]
+
+
+def _has_branch(regexp):
+    """True if the pattern has an alternation at the top level."""
+    depth = 0
+    inclass = False
+    i = 0
+    while i < len(regexp):
+        c = regexp[i]
+        if c == "\\":
+            i += 1
+        elif inclass:
+            if c == "]":
+                inclass = False
+        elif c == "[":
+            inclass = True
+            if regexp[i + 1:i + 2] == "^":
+                i += 1
+            if regexp[i + 1:i + 2] == "]":
+                i += 1
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "|" and depth == 0:
+            return True
+        i += 1
+    return False
+
+
+class _RouteNode(object):
+    """A node of the routing table prefix tree. Holds the URL maps whose
+    static prefix ends here, with their pattern tails compiled into
+    alternations.
+    """
+    __slots__ = ("children", "routes", "first", "_matchers")
+
+    def __init__(self):
+        self.children = {}
+        self.routes = [] # (order, urlmap, tail)
+        self.first = None # order of the first route
+        self._matchers = None
+
+    def compile(self):
+        self.first = self.routes[0][0]
+        self._matchers = matchers = []
+        parts = []
+        groupmap = {}
+        ngroups = 0
+        for order, urlmap, tail in self.routes:
+            names = urlmap._regexp.groupindex.keys()
+            if _UNSAFE_TAIL_RE.search(tail) or len(names) >= _MAX_GROUPS:
+                # Numbered backreferences and inline flags do not survive
+                # being combined. Match this one on its own.
+                if parts:
+                    matchers.append((re.compile("|".join(parts), re.I), groupmap))
+                    parts, groupmap, ngroups = [], {}, 0
+                matchers.append((re.compile(tail, re.I), (order, urlmap)))
+                continue
+            if ngroups + len(names) + 1 > _MAX_GROUPS:
+                matchers.append((re.compile("|".join(parts), re.I), groupmap))
+                parts, groupmap, ngroups = [], {}, 0
+            tag = "_r%d" % (order,)
+            parts.append("(?P<%s>%s)" % (tag,
+                    _GROUP_NAME_RE.sub(r"(?P\1%s_\2" % (tag,), tail)))
+            groupmap[tag] = (order, urlmap, [(n, "%s_%s" % (tag, n)) for n in names])
+            ngroups += len(names) + 1
+        if parts:
+            matchers.append((re.compile("|".join(parts), re.I), groupmap))
+
+    def match(self, path, pos):
+        """Return the first route here that matches the path from pos, as
+        (order, method, kwargs), or None."""
+        for cre, groupmap in self._matchers:
+            mo = cre.match(path, pos)
+            if mo:
+                if type(groupmap) is tuple:
+                    order, urlmap = groupmap
+                    return order, urlmap._method, mo.groupdict()
+                order, urlmap, names = groupmap[mo.lastgroup]
+                return order, urlmap._method, dict((name, mo.group(gname))
+                        for name, gname in names)
+        return None
+
+
+class RoutingTable(object):
+    """URL maps grouped by the static prefixes of their patterns, in a prefix
+    tree. The pattern tails at each node are compiled into one alternation,
+    so a path is resolved with a few regular expression matches, no matter
+    how many maps there are. The first registered map that matches a path
+    is found, as when trying each map in turn.
+    """
+    def __init__(self, urlmaps):
+        self._root = root = _RouteNode()
+        nodes = []
+        for order, urlmap in enumerate(urlmaps):
+            prefix, tail = _split_prefix(urlmap._regexp.pattern)
+            node = root
+            for c in prefix.lower():
+                try:
+                    node = node.children[c]
+                except KeyError:
+                    child = node.children[c] = _RouteNode()
+                    node = child
+            if not node.routes:
+                nodes.append(node)
+            node.routes.append((order, urlmap, tail))
+        for node in nodes:
+            node.compile()
+
+    def match(self, path):
+        found = None
+        node = self._root
+        lpath = path.lower()
+        pos = 0
+        end = len(lpath)
+        while True:
+            if node.routes and (found is None or node.first < found[0]):
+                m = node.match(path, pos)
+                if m is not None and (found is None or m[0] < found[0]):
+                    found = m
+            if pos == end:
+                break
+            node = node.children.get(lpath[pos])
+            if node is None:
+                break
+            pos += 1
+        if found is None:
+            return None, None
+        return found[1], found[2]
+
+
 class URLResolver(object):
-    """Supports mapping URL paths to handler functions."""
-    def __init__(self, mapconfig, urlbase=""):
+    """Supports mapping URL paths to handler functions.
+
+    The URL maps are compiled into a RoutingTable when first used, and the
+    most recent resolutions of paths are cached.
+    """
+    def __init__(self, mapconfig, urlbase="", cachesize=1024):
         self._reverse = {}
         self._aliases = {}
         self._patterns = []
         self._urlbase = urlbase
+        self._table = None
+        self._cache = dictlib.LRUCache(cachesize)
         for pattern, methname in mapconfig:
             self.register(pattern, methname)
 
     def register(self, pattern, method):
         if isinstance(method, basestring):
             if b"." in method:
-                method = get_method(method)
+                name, method = method, get_method(method)
             else:
                 self._aliases[method] = URLAlias(pattern, method)
                 return
         else:
             assert callable(method), "Must register a callable."
+            name = None
         urlmap = URLMap(pattern, method)
         self._patterns.append(urlmap)
         self._reverse[method] = urlmap
+        if name:
+            self._reverse[name] = urlmap
+        self._invalidate()
 
     def unregister(self, method):
         if isinstance(method, basestring):
@@ -521,32 +699,37 @@ class URLResolver(object):
         except KeyError:
             return # not registered anyway
         else:
-            del self._reverse[method]
-            i = 0
-            for urlmap in self._patterns:
-                if urlmap._method is m:
-                    break
-                else:
-                    i += 1
-            del self._patterns[i]
+            for key, urlmap in self._reverse.items():
+                if urlmap is m:
+                    del self._reverse[key]
+            self._patterns.remove(m)
+            self._invalidate()
+
+    def _invalidate(self):
+        self._table = None
+        self._cache.clear()
 
     def match(self, uri):
-        for mapper in self._patterns:
-            method, kwargs = mapper.match(uri)
-            if method:
-                return method, kwargs
+        try:
+            method, kwargs = self._cache[uri]
+        except KeyError:
+            table = self._table
+            if table is None:
+                table = self._table = RoutingTable(self._patterns)
+            method, kwargs = self._cache[uri] = table.match(uri)
+        if method:
+            return method, kwargs.copy()
         return None, None
 
     def dispatch(self, request):
         path = request.environ[b"PATH_INFO"]
-        for mapper in self._patterns:
-            method, kwargs = mapper.match(path)
-            if method:
-                response = method(request, **kwargs)
-                if response is None:
-                    request.log_error("Handler %r returned none.\n" % (method,))
-                    raise HttpErrorServerError("handler returned None")
-                return response
+        method, kwargs = self.match(path)
+        if method:
+            response = method(request, **kwargs)
+            if response is None:
+                request.log_error("Handler %r returned none.\n" % (method,))
+                raise HttpErrorServerError("handler returned None")
+            return response
         else:
             raise HttpErrorNotFound(path)
 
@@ -556,7 +739,8 @@ class URLResolver(object):
         """
         if isinstance(method, basestring):
             if "." in method:
-                method = get_method(method)
+                if method not in self._reverse:
+                    method = get_method(method)
             else:
                 try:
                     urlmap = self._aliases[method]
@@ -777,12 +961,20 @@ class ResponseDocument(object):
     def get_object(self, key, ctor, **kwargs):
         return ELEMENTCACHE.get_object(key, ctor, **kwargs)
 
-    def finalize(self):
-        """Handlers should return the return value of this method."""
+    def finalize(self, stream=False):
+        """Handlers should return the return value of this method.
+
+        If stream is true the document is encoded in chunks as the server
+        sends it, without a Content-Length, instead of all at once.
+        """
         doc = self._doc
         self._doc = None
         self.config = None
         self.resolver = None
+        if stream:
+            response = HttpResponse(doc.iterencode(doc.encoding), doc.MIMETYPE, doc.encoding)
+            response.add_header(httputils.CacheControl("no-cache"))
+            return response
         adapter = POMadapter.WSGIAdapter(doc)
         doc.emit(adapter)
         response = HttpResponse(adapter)
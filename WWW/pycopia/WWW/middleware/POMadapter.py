@@ -75,7 +75,8 @@ class WSGIAdapter(object):
 
     #  emit() calls this
     def write(self, data):
-        data = data.encode(self.charset)
+        if not isinstance(data, bytes):
+            data = data.encode(self.charset)
         self.length += len(data)
         self._chunks.append(data)
 
@@ -92,8 +93,11 @@ class WSGIAdapter(object):
 
 
 def get_iterator(doc, writer=None, encoding=None):
-    """Return an iterable of the content."""
-    it = WSGIAdapter(mimetype=doc.MIMETYPE, writer=writer)
-    doc.emit(it, encoding)
+    """Return an iterable of the content. Without a writer, the document is
+    encoded in chunks as it is iterated over."""
+    if writer is None:
+        return doc.iterencode(encoding or doc.encoding)
+    it = WSGIAdapter(doc, writer=writer)
+    doc.emit(it, encoding or doc.encoding)
     return it
 
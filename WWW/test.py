@@ -202,6 +202,29 @@ class WWWTests(unittest.TestCase):
         self.assertEqual(path, "/selftest/part1/22/")
         self.assertTrue( m.match(path))
 
+    def test_urlresolver(self):
+        def F(r, **kw):
+            return 1
+        def G(r, **kw):
+            return 2
+        def H(r, **kw):
+            return 3
+        resolver = framework.URLResolver([
+                (r'^/table/(?P<tablename>\w+)/$', F),
+                (r'^/table/(?P<tablename>\w+)/edit/(?P<rowid>\d+)/$', G),
+                (r'^/table/equipment/edit/(?P<rowid>\d+)/$', H),
+                (r'^/(?P<name>\S+)/$', H),
+                ])
+        self.assertEqual(resolver.match("/table/equipment/"), (F, {"tablename": "equipment"}))
+        # The first registered match wins, not the longest prefix.
+        self.assertEqual(resolver.match("/TABLE/equipment/edit/3/"),
+                (G, {"tablename": "equipment", "rowid": "3"}))
+        self.assertEqual(resolver.match("/other/"), (H, {"name": "other"}))
+        self.assertEqual(resolver.match("/table/x/y"), (None, None))
+        resolver.unregister(G)
+        self.assertEqual(resolver.match("/table/equipment/edit/3/"), (H, {"rowid": "3"}))
+        self.assertEqual(resolver.get_url(F, tablename="netobjects"), "/table/netobjects/")
+
     def test_Zfetch(self):
         doc = XHTML.get_document("http://www.pycopia.net/")
         self.assertEqual(doc.title.get_text(), "Python Application Frameworks")
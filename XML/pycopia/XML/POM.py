@@ -31,6 +31,7 @@ from __future__ import division
 import sys, os, re
 import codecs
 import unicodedata
+from io import BytesIO
 
 try: # python 3 compatibility
     maxint = sys.maxint
@@ -183,8 +184,8 @@ class Comment(Text):
     append = add_text
     def _fix(self, data):
         data = escape(data)
-        if data.find("--") != -1:
-            data = data.replace("--", "- ")
+        if data.find(b"--") != -1:
+            data = data.replace(b"--", b"- ")
         return data
 
 class ASIS(object):
@@ -569,12 +570,7 @@ class ElementNode(object):
                 dtdattr.verify(aval.value)
 
     def encode(self, encoding, verify=False):
-        if verify:
-            self._verify_attributes()
-        if not self.CONTENTMODEL or self.CONTENTMODEL.is_empty():
-            return self._empty_str(encoding)
-        else:
-            return self._non_empty_str(encoding)
+        return b"".join(_iterencode(self, encoding, maxint, verify))
 
     def set_namespace(self, ns):
         self._namespace = ns
@@ -587,35 +583,20 @@ class ElementNode(object):
     def _get_ns(self, encoding):
         return self._namespace.encode(encoding)
 
-    def _non_empty_str(self, encoding):
-        ns = self._get_ns(encoding)
-        name = self._name.encode(encoding)
-        s = [b"<%s%s%s>" % (ns, name, self._attr_str(encoding))]
-        map(s.append, map(lambda o: o.encode(encoding), self._children))
-        s.append(b"</%s%s>" % (ns, name))
-        return b"".join(s)
-
-    def _empty_str(self, encoding):
-        return b"<%s%s%s />" % (self._get_ns(encoding), self._name.encode(encoding),
-                       self._attr_str(encoding))
-
     def _attr_str(self, encoding):
         attrs = map(lambda o: o.encode(encoding), self._attribs.values())
         attrs.insert(0, b"") # for space before first attribute
         return b" ".join(attrs)
 
     def emit(self, fo, encoding=None, verify=False):
-        enc = encoding or self._encoding
-        if verify:
-            self._verify_attributes()
-        if not self.CONTENTMODEL or self.CONTENTMODEL.is_empty():
-            fo.write(self._empty_str(enc))
-        else:
-            ns = self._get_ns(enc)
-            name = self._name.encode(enc)
-            fo.write(b"<%s%s%s>" % (ns, name, self._attr_str(enc)))
-            map(lambda o: o.emit(fo, enc), self._children)
-            fo.write(b"</%s%s>" % (ns, name))
+        """Write the encoded element to the file-like object fo, in chunks of
+        about DEFAULT_BUFSIZE bytes. A writer that must see every tag as a
+        separate write, such as the BeautifulWriter, sets an emit_bufsize
+        attribute of zero.
+        """
+        bufsize = getattr(fo, "emit_bufsize", DEFAULT_BUFSIZE)
+        for chunk in _iterencode(self, encoding or self._encoding, bufsize, verify):
+            fo.write(chunk)
 
     def validate(self, encoding=DEFAULT_ENCODING):
         ff = FakeFile(None)
@@ -794,14 +775,6 @@ class Fragments(ElementNode):
     def __str__(self):
         return self.encode(self._encoding)
 
-    def encode(self, encoding):
-        s = []
-        map(s.append, map(lambda o: o.encode(encoding), self._children))
-        return "".join(s)
-
-    def emit(self, fo, encoding=None):
-        map(lambda o: o.emit(fo, encoding), self._children)
-
     def matchpath(self, pathelement):
         return False
 
@@ -830,6 +803,8 @@ class BeautifulWriter(object):
     is basically a shim. It attempts to beautify the XML stream emitted by the
     POM tree. Pass one of these to the emit method if you want better looking
     output."""
+    emit_bufsize = 0 # see each tag as a separate write.
+
     def __init__(self, fo, inline=[]):
         self._fo = fo # the wrapped file object
         self._inline = list(inline) # list of special tags that are inline
@@ -857,6 +832,152 @@ class BeautifulWriter(object):
         return self._fo.write(data)
 
 
+#########################################################
+# Serializer
+# Walks a POM tree without recursion, collecting the encoded markup into a
+# buffer that is handed out in chunks of about bufsize bytes.
+#########################################################
+
+DEFAULT_BUFSIZE = 65536
+ATTRIBUTE_CACHE_SIZE = 1024 # encoded attributes kept per element class
+
+
+class _TagFragments(object):
+    """Encoded tag fragments for one element class, namespace, and encoding.
+
+    Also caches the encoded form of attributes that are seen with the same
+    value again, such as class names.
+    """
+    def __init__(self, cls, namespace, encoding):
+        self.encoding = encoding
+        # Subclasses with their own encode method are asked to encode
+        # themselves. Those with only their own emit method emit to a buffer.
+        own_encode = _function(cls.encode) is not _ELEMENT_ENCODE
+        own_emit = _function(cls.emit) is not _ELEMENT_EMIT
+        self.inline = not (own_encode or own_emit)
+        self.emits = own_emit and not own_encode
+        if issubclass(cls, Fragments): # has no markup of its own.
+            self.empty = False
+            self.start = self.end = None
+        else:
+            self.empty = not cls.CONTENTMODEL or cls.CONTENTMODEL.is_empty()
+            name = namespace.encode(encoding) + cls._name.encode(encoding)
+            self.start = b"<" + name
+            self.end = b"</" + name + b">"
+        self._attributes = {}
+
+    def start_tag(self, attribs):
+        if self.start is None:
+            return b""
+        s = [self.start]
+        cache = self._attributes
+        for attr in attribs.values():
+            key = (attr.name, attr.value)
+            data = cache.get(key)
+            if data is None:
+                data = b" " + attr.encode(self.encoding)
+                if len(cache) < ATTRIBUTE_CACHE_SIZE:
+                    cache[key] = data
+            s.append(data)
+        s.append(b" />" if self.empty else b">")
+        return b"".join(s)
+
+
+def _function(method):
+    return getattr(method, "__func__", method)
+
+_ELEMENT_ENCODE = _function(ElementNode.encode)
+_ELEMENT_EMIT = _function(ElementNode.emit)
+_TAGCACHE = {}
+
+def _get_tag_fragments(node, encoding):
+    key = (node.__class__, node._namespace, encoding)
+    try:
+        return _TAGCACHE[key]
+    except KeyError:
+        frags = _TAGCACHE[key] = _TagFragments(node.__class__, node._namespace, encoding)
+        return frags
+
+
+def _encode_own(node, frags, encoding):
+    """Encode an element that has its own encode or emit method."""
+    if frags.emits:
+        buf = BytesIO()
+        node.emit(buf, encoding)
+        return buf.getvalue()
+    return node.encode(encoding)
+
+
+def iterencode(node, encoding=None, bufsize=DEFAULT_BUFSIZE, verify=False):
+    """Generate the encoded markup of a POM node and all its children, as
+    byte strings of about bufsize bytes. A bufsize of zero produces each
+    tag and text node separately.
+
+    This is suitable as a WSGI response body.
+    """
+    if encoding is None:
+        encoding = getattr(node, "_encoding", None) or getattr(node, "encoding", DEFAULT_ENCODING)
+    if isinstance(node, ElementNode):
+        frags = _get_tag_fragments(node, encoding)
+        if not frags.inline:
+            yield _encode_own(node, frags, encoding)
+            return
+    for chunk in _iterencode(node, encoding, bufsize, verify):
+        yield chunk
+
+
+def _iterencode(node, encoding, bufsize, verify):
+    # The node's own markup, even if its class has its own encode or emit
+    # method, since those may call the ElementNode methods.
+    if encoding is None:
+        encoding = getattr(node, "_encoding", None) or getattr(node, "encoding", DEFAULT_ENCODING)
+    if verify:
+        node._verify_attributes()
+    parts = []
+    append = parts.append
+    size = 0
+    stack = []
+    children = iter((node,))
+    endtag = None
+    while True:
+        for child in children:
+            if isinstance(child, ElementNode):
+                frags = _get_tag_fragments(child, encoding)
+                if frags.inline or child is node:
+                    data = frags.start_tag(child._attribs)
+                    if not frags.empty:
+                        if data:
+                            append(data)
+                            size += len(data)
+                        stack.append((children, endtag))
+                        children = iter(child._children)
+                        endtag = frags.end
+                        break
+                else:
+                    data = _encode_own(child, frags, encoding)
+            else:
+                data = child.encode(encoding)
+            append(data)
+            size += len(data)
+            if size >= bufsize:
+                yield b"".join(parts)
+                del parts[:]
+                size = 0
+        else: # children done, close the element.
+            if endtag:
+                append(endtag)
+                size += len(endtag)
+            if not stack:
+                break
+            children, endtag = stack.pop()
+        if parts and size >= bufsize:
+            yield b"".join(parts)
+            del parts[:]
+            size = 0
+    if parts:
+        yield b"".join(parts)
+
+
 # base class for whole POM documents, including Header.
 class POMDocument(object):
     XMLHEADER = b'<?xml version="1.0" encoding="%s"?>\n' % DEFAULT_ENCODING
@@ -935,9 +1056,17 @@ class POMDocument(object):
         return self.encode(self.encoding)
 
     def encode(self, encoding=DEFAULT_ENCODING):
+        return b"".join(self.iterencode(encoding, maxint))
+
+    def iterencode(self, encoding=DEFAULT_ENCODING, bufsize=DEFAULT_BUFSIZE):
+        """Generate the encoded document in chunks of about bufsize bytes.
+        Pass this to an HttpResponse to stream a large document."""
         if encoding != self.encoding:
             self.set_encoding(encoding)
-        return self.XMLHEADER + self.DOCTYPE + self.root.encode(encoding) + b"\n"
+        yield self.XMLHEADER + self.DOCTYPE
+        for chunk in iterencode(self.root, encoding, bufsize):
+            yield chunk
+        yield b"\n"
 
     def emit(self, fo, encoding=DEFAULT_ENCODING):
         if encoding != self.encoding:
@@ -183,6 +183,36 @@ class UnknownXMLAttribute(object):
         raise POM.ValidationError("Can't validate unknown attribute: %r" % (self.name,))
 
 
+# Element classes and attribute keyword names, by name in the document.
+_CLASSCACHE = {} # per DTD module
+_ATTRNAMECACHE = {}
+
+def get_element_class(dtdmods, name):
+    """Return the element class for the element name from the first of the
+    DTD modules that defines it. Raises AttributeError if none does.
+    """
+    for mod in dtdmods:
+        try:
+            cache = _CLASSCACHE[mod]
+        except KeyError:
+            cache = _CLASSCACHE[mod] = {}
+        try:
+            klass = cache[name]
+        except KeyError:
+            klass = cache[name] = getattr(mod, identifier(name), None)
+        if klass:
+            return klass
+    raise AttributeError(name)
+
+
+def _get_attribute_name(name):
+    try:
+        return _ATTRNAMECACHE[name]
+    except KeyError:
+        kwname = _ATTRNAMECACHE[name] = keyword_identifier(POM.normalize_unicode(name))
+        return kwname
+
+
 #### new sax2 parser ###
 class ContentHandler(object):
 
@@ -195,28 +225,13 @@ class ContentHandler(object):
         self.encoding = POM.DEFAULT_ENCODING # default to regenerate as
         self.modules = []
         self._prefixes = {}
-        self._classcache = {}
         if logfile:
             self._errormethod = logfile.write
         else:
             self._errormethod = write_error
 
     def _get_class(self, name):
-        klass = None
-        name = identifier(name)
-        try:
-            return self._classcache[name]
-        except KeyError:
-            pass
-        for mod in self.doc.dtds:
-            try:
-                klass = getattr(mod, name)
-            except AttributeError:
-                continue
-            if klass:
-                self._classcache[name] = klass
-                return klass
-        raise AttributeError
+        return get_element_class(self.doc.dtds, name)
 
     def setDocumentLocator(self, locator):
         self._locator = locator
@@ -245,7 +260,7 @@ class ContentHandler(object):
             raise POM.ValidationError("Undefined element tag: " + name)
         attr = {}
         for name, value in atts.items():
-            attr[keyword_identifier(POM.normalize_unicode(name))] = POM.unescape(value)
+            attr[_get_attribute_name(name)] = POM.unescape(value)
         obj = klass(**attr)
         self.stack.append(obj)
 
@@ -314,6 +329,119 @@ class ContentHandler(object):
         return FakeFile(systemId)
 
 
+class IterContentHandler(ContentHandler):
+    """Collects the elements selected by a match function as they are
+    completed, for iterparse().
+
+    With free set, the selected elements are detached from their parents,
+    and whatever is completed outside of them is discarded, so the tree does
+    not grow as the document is parsed.
+    """
+    def __init__(self, match, free=True, **kwargs):
+        super(IterContentHandler, self).__init__(**kwargs)
+        self._match = match
+        self._free = free
+        self._path = []
+        self._matched = []
+        self._inside = 0 # number of open, selected, elements
+        self.completed = []
+
+    def startDocument(self):
+        ContentHandler.startDocument(self)
+        self._path = []
+        self._matched = []
+        self._inside = 0
+
+    def startElement(self, name, atts):
+        ContentHandler.startElement(self, name, atts)
+        self._path.append(name)
+        matched = bool(self._match(self.stack[-1], self._path))
+        self._matched.append(matched)
+        if matched:
+            self._inside += 1
+
+    def endElement(self, name):
+        obj = self.stack.pop()
+        self._path.pop()
+        if self._matched.pop():
+            self._inside -= 1
+            self.completed.append(obj)
+        if not self.stack:
+            self.msg = obj
+        elif self._inside or not self._free:
+            self.stack[-1].append(obj)
+
+    def characters(self, text):
+        if self._inside or not self._free:
+            ContentHandler.characters(self, text)
+
+
+def get_matcher(match):
+    """Return a function that selects elements for iterparse.
+
+    The match may be an element class, or tuple of them, an element name, a
+    path of element names relative to any element ("host/address"), or an
+    absolute path ("/nmaprun/host"). A callable is used as-is, and is
+    called with the element and the list of element names from the root.
+    """
+    if isinstance(match, basestring):
+        if match.startswith("/"):
+            names = match[1:].split("/")
+            return lambda node, path: path == names
+        names = match.split("/")
+        count = len(names)
+        return lambda node, path: path[-count:] == names
+    if isinstance(match, tuple) or isinstance(match, type):
+        return lambda node, path: isinstance(node, match)
+    if callable(match):
+        return match
+    raise ValueError("Can't match elements with %r" % (match,))
+
+
+def iterparse(source, match, document=None, free=True, bufsize=65536,
+        doc_factory=POM.new_document, logfile=None):
+    """Parse the XML file, or file name, source incrementally, and generate
+    the elements selected by match (see get_matcher) as they are completed.
+
+    With free true (the default), each element is detached from the tree
+    when it is handed out, and the parts of the document outside of the
+    selected elements are not kept. The memory used then depends on the
+    size of the selected elements, not the document. When the parse is done
+    the document root holds whatever was kept.
+    """
+    import xml.sax
+    import xml.sax.handler
+    handler = IterContentHandler(get_matcher(match), free, doc=document,
+            doc_factory=doc_factory, logfile=logfile)
+    parser = xml.sax.make_parser()
+    parser.setFeature(xml.sax.handler.feature_namespaces, 0)
+    parser.setContentHandler(handler)
+    parser.setDTDHandler(handler)
+    parser.setEntityResolver(handler)
+    parser.setErrorHandler(ErrorHandler(logfile))
+    if isinstance(source, basestring):
+        fo = open(source, "rb")
+    else:
+        fo = None
+    try:
+        read = (fo or source).read
+        while True:
+            data = read(bufsize)
+            if data:
+                parser.feed(data)
+            else:
+                parser.close()
+            completed = handler.completed
+            handler.completed = []
+            for node in completed:
+                yield node
+            if not data:
+                break
+    finally:
+        if fo is not None:
+            fo.close()
+
+
 class FakeFile(object):
     def __init__(self, name):
         self.name = name
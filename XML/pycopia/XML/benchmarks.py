@@ -0,0 +1,137 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks of POM document serialization.
+
+Compares the recursive encoder, which joins the encoded children at each
+level, and writing every tag separately, with the buffered serializer, on an
+XHTML document holding a large table.
+
+    python -m pycopia.XML.benchmarks
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+
+from pycopia.benchmarks import BenchCompare
+from pycopia.XML import POM
+from pycopia import dtds
+
+
+def make_document(nodes=100000, columns=4):
+    """Make an XHTML document with a table of about nodes elements, each
+    cell holding some text."""
+    doc = POM.POMDocument(doctype=dtds.XHTML)
+    dtd = doc.dtd
+    body = dtd.Body()
+    doc.root.append(body)
+    table = dtd.Table(class_="data")
+    body.append(table)
+    tbody = dtd.Tbody()
+    table.append(tbody)
+    for rownum in range(nodes // (columns + 1)):
+        row = dtd.Tr(class_=("odd" if rownum % 2 else "even"))
+        tbody.append(row)
+        for col in range(columns):
+            td = dtd.Td()
+            td.append(POM.Text("cell %d <%d> & co" % (rownum, col)))
+            row.append(td)
+    return doc
+
+
+# The previous, recursive, implementations, for reference.
+
+def _recursive_encode(node, encoding):
+    if not isinstance(node, POM.ElementNode):
+        return node.encode(encoding)
+    ns = node._get_ns(encoding)
+    name = node._name.encode(encoding)
+    if not node.CONTENTMODEL or node.CONTENTMODEL.is_empty():
+        return b"<%s%s%s />" % (ns, name, node._attr_str(encoding))
+    s = [b"<%s%s%s>" % (ns, name, node._attr_str(encoding))]
+    s.extend([_recursive_encode(child, encoding) for child in node._children])
+    s.append(b"</%s%s>" % (ns, name))
+    return b"".join(s)
+
+
+def _recursive_emit(node, fo, encoding):
+    if not isinstance(node, POM.ElementNode):
+        return node.emit(fo, encoding)
+    ns = node._get_ns(encoding)
+    name = node._name.encode(encoding)
+    if not node.CONTENTMODEL or node.CONTENTMODEL.is_empty():
+        fo.write(b"<%s%s%s />" % (ns, name, node._attr_str(encoding)))
+    else:
+        fo.write(b"<%s%s%s>" % (ns, name, node._attr_str(encoding)))
+        for child in node._children:
+            _recursive_emit(child, fo, encoding)
+        fo.write(b"</%s%s>" % (ns, name))
+
+
+class _CountingWriter(object):
+    """Stands in for a socket or file."""
+    def __init__(self):
+        self.writes = 0
+        self.length = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.length += len(data)
+
+
+def compare_encoders(nodes=100000, iterations=1, loops=3):
+    """Compare encoding a document of about nodes elements to one string."""
+    doc = make_document(nodes)
+    root = doc.root
+
+    def encode_recursive():
+        return len(_recursive_encode(root, "utf-8"))
+
+    def encode_buffered():
+        return len(root.encode("utf-8"))
+
+    bc = BenchCompare((encode_recursive, encode_buffered), iterations=iterations, loops=loops)
+    return bc()
+
+
+def compare_emitters(nodes=100000, iterations=1, loops=3):
+    """Compare writing a document of about nodes elements to a file-like
+    object."""
+    doc = make_document(nodes)
+    root = doc.root
+
+    def emit_each_tag():
+        fo = _CountingWriter()
+        _recursive_emit(root, fo, "utf-8")
+        return fo.length
+
+    def emit_buffered():
+        fo = _CountingWriter()
+        root.emit(fo, "utf-8")
+        return fo.length
+
+    bc = BenchCompare((emit_each_tag, emit_buffered), iterations=iterations, loops=loops)
+    return bc()
+
+
+if __name__ == "__main__":
+    for compare in (compare_encoders, compare_emitters):
+        cmpres = compare()
+        print (cmpres)
+        print (cmpres.get_ratios())
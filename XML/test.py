@@ -26,10 +26,12 @@ from __future__ import division
 
 import sys
 import unittest
+from io import BytesIO
 
 from pycopia.XML import POM
 from pycopia.XML import DTD
 from pycopia.XML import Plaintext
+from pycopia.XML import POMparse
 
 import pycopia.dtds
 import pycopia.dtds.pomtest
@@ -74,6 +76,75 @@ class XMLTests(unittest.TestCase):
         doc.root.idval = "someid" # satisfy #REQUIRED attribute
         doc.emit(sys.stdout)
 
+    def test_iterencode(self):
+        doc = POM.POMDocument(doctype=pycopia.dtds.XHTML)
+        body = doc.dtd.Body()
+        doc.root.append(body)
+        frag = POM.Fragments()
+        frag.append(POM.Text("loose <text>"))
+        frag.append(doc.dtd.Br())
+        body.append(frag)
+        for i in range(500):
+            p = doc.dtd.P(class_="c%d" % (i % 2))
+            p.append(POM.Text("para %d" % i))
+            body.append(p)
+        body.append(POM.Comment("done -- here"))
+        encoded = body.encode("utf-8")
+        self.assertTrue(encoded.startswith(b'<body>loose &lt;text&gt;<br /><p class="c0">para 0</p>'))
+        self.assertTrue(encoded.endswith(b'<p class="c1">para 499</p><!-- done -  here --></body>'))
+        chunks = list(POM.iterencode(body, "utf-8", 1024))
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(all(len(chunk) >= 1024 for chunk in chunks[:-1]))
+        self.assertEqual(b"".join(chunks), encoded)
+        self.assertEqual(b"".join(doc.iterencode("utf-8", 1024)), doc.encode("utf-8"))
+        pieces = list(POM.iterencode(body, "utf-8", 0))
+        self.assertEqual(pieces[:3], [b"<body>", b"loose &lt;text&gt;", b"<br />"])
+
+    def test_iterencode_own_methods(self):
+        doc = POM.POMDocument(doctype=pycopia.dtds.XHTML)
+        class Marked(doc.dtd.P): # only its own emit.
+            def emit(self, fo, encoding=None):
+                fo.write(b"<!-- marked -->")
+                super(Marked, self).emit(fo, encoding)
+        class Shouting(doc.dtd.P):
+            def encode(self, encoding, verify=False):
+                return super(Shouting, self).encode(encoding, verify).upper()
+        body = doc.dtd.Body()
+        marked = Marked()
+        marked.append(POM.Text("one"))
+        body.append(marked)
+        shouting = Shouting()
+        shouting.append(POM.Text("two"))
+        body.append(shouting)
+        expected = b"<body><!-- marked --><p>one</p><P>TWO</P></body>"
+        self.assertEqual(body.encode("utf-8"), expected)
+        self.assertEqual(b"".join(POM.iterencode(body, "utf-8", 0)), expected)
+        self.assertEqual(list(POM.iterencode(marked, "utf-8")), [b"<!-- marked --><p>one</p>"])
+        self.assertEqual(list(POM.iterencode(shouting, "utf-8")), [b"<P>TWO</P>"])
+        fo = BytesIO()
+        marked.emit(fo, "utf-8")
+        self.assertEqual(fo.getvalue(), b"<!-- marked --><p>one</p>")
+
+    def test_iterparse(self):
+        paras = b"".join([b'<p class="c%d">para <b>%d</b></p>' % (i % 2, i) for i in range(300)])
+        data = (b'<?xml version="1.0" encoding="utf-8"?>\n'
+                b'<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" '
+                b'"http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">\n'
+                b'<html><head><title>iterparse</title></head><body>' + paras +
+                b'</body></html>')
+        nodes = list(POMparse.iterparse(BytesIO(data), "body/p", bufsize=512))
+        self.assertEqual(len(nodes), 300)
+        self.assertEqual(nodes[7].encode("utf-8"), b'<p class="c1">para <b>7</b></p>')
+        self.assertTrue(nodes[7]._parent is None)
+        doc = POM.POMDocument(doctype=pycopia.dtds.XHTML)
+        nodes = list(POMparse.iterparse(BytesIO(data), doc.dtd.B, document=doc))
+        self.assertEqual([node.encode("utf-8") for node in nodes[:2]], [b"<b>0</b>", b"<b>1</b>"])
+        self.assertEqual(doc.root._children, []) # the rest was discarded.
+        doc = POM.POMDocument(doctype=pycopia.dtds.XHTML)
+        nodes = list(POMparse.iterparse(BytesIO(data), "/html/body/p", document=doc, free=False))
+        self.assertEqual(len(nodes), 300)
+        self.assertTrue(nodes[0]._parent is doc.get_path("/html/body"))
+
     def test_negdocencoding(self):
         import pomtest
         doc = POM.POMDocument(dtd=pomtest)
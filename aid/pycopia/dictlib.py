@@ -20,6 +20,9 @@ variants live here.
 
 """
 
+import collections
+
+
 class MultiValueDictKeyError(KeyError):
     pass
 
@@ -161,6 +164,45 @@ class ObjectCache(dict):
         return obj
 
 
+class LRUCache(object):
+    """A cache that holds at most `size` items. When full, the least recently
+    used item is dropped to make room for a new one.
+    """
+    def __init__(self, size=1024):
+        self.size = size
+        self._data = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        value = self._data.pop(key)
+        self._data[key] = value # now the most recent
+        return value
+
+    def __setitem__(self, key, value):
+        data = self._data
+        data.pop(key, None)
+        if len(data) >= self.size:
+            data.popitem(last=False)
+        data[key] = value
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def clear(self):
+        self._data.clear()
+
+
 class SortedDict(dict):
     "A dictionary that keeps its keys in the order in which they're inserted."
     def __init__(self, data=None):
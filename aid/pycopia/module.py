@@ -200,3 +200,36 @@ def find_module(modname, path=None):
         return None
     return info
 
+
+
+class LazyModule(object):
+    """Stands in for a module that is imported when one of its attributes is
+    first used.
+
+    Use this for modules that are needed only on some code paths, so that
+    importing the using module stays cheap.
+
+        debugger = LazyModule("pycopia.debugger")
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        mod = self.__dict__["_module"]
+        if mod is None:
+            mod = self.__dict__["_module"] = get_module(self.__dict__["_name"])
+        return mod
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __repr__(self):
+        mod = self.__dict__["_module"]
+        if mod is None:
+            return "<LazyModule {!r} (not loaded)>".format(self.__dict__["_name"])
+        return repr(mod)
@@ -21,6 +21,7 @@ from __future__ import division
 import unittest
 
 from pycopia import aid
+from pycopia import module
 from pycopia import dictlib
 from pycopia import UserFile
 from pycopia import getopt
@@ -85,6 +86,27 @@ class AidTests(unittest.TestCase):
         print(d.two)
         print(d["two"])
 
+    def test_LRUCache(self):
+        c = dictlib.LRUCache(3)
+        for i in range(3):
+            c[i] = str(i)
+        self.assertEqual(c[0], "0") # 0 is now the most recent
+        c[3] = "3"
+        self.assertFalse(1 in c)
+        self.assertEqual(len(c), 3)
+        self.assertEqual(c.get(1, "none"), "none")
+        c[4] = "4"
+        self.assertFalse(2 in c)
+        self.assertTrue(0 in c)
+
+    def test_LazyModule(self):
+        mod = module.LazyModule("pycopia.timespec")
+        self.assertTrue("not loaded" in repr(mod))
+        self.assertTrue(mod.parse_timespan is timespec.parse_timespan)
+        self.assertEqual(repr(mod), repr(timespec))
+        mod = module.LazyModule("pycopia.nosuchmodule")
+        self.assertRaises(module.ModuleImportError, getattr, mod, "anything")
+
     def test_UserFile(self):
         fd = UserFile.UserFile("/etc/hosts", "rb")
         while 1:
@@ -21,6 +21,7 @@ from __future__ import print_function
 
 import sys, os
 import select, signal, fcntl, struct
+import collections
 # the only signal module function that is exposed here. The rest are wrapped by
 # Poll.
 pause = signal.pause
@@ -30,15 +31,16 @@ EPOLLHUP = select.EPOLLHUP
 EPOLLIN = select.EPOLLIN
 EPOLLOUT = select.EPOLLOUT
 EPOLLPRI = select.EPOLLPRI
-# These are not implemented here
-#EPOLLET = select.EPOLLET
-#EPOLLONESHOT = select.EPOLLONESHOT
+# Used by Poll objects created with edge_triggered or oneshot set.
+EPOLLET = select.EPOLLET
+EPOLLONESHOT = select.EPOLLONESHOT
 
 POLLNVAL = select.POLLNVAL
 
 from errno import EINTR
 
 from pycopia.aid import NULL
+from pycopia.timelib import now
 
 
 class AsyncIOException(Exception):
@@ -71,16 +73,75 @@ except AttributeError:
 FIONREAD = TIOCINQ = SIOCINQ = 0x541B
 TIOCOUTQ = SIOCOUTQ = 0x5411
 
+class PollStats(object):
+    """Counters for a Poll object, to see where the loop time goes."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.wakeups = 0 # epoll_wait calls that returned events
+        self.events = 0 # events returned by epoll_wait
+        self.dispatched = 0 # events dispatched to handlers
+        self.deferred = 0 # events put off to the next poll by the budget
+        self.max_batch = 0 # most events returned by one epoll_wait
+        self.handler_time = 0.0 # seconds spent in handlers
+
+    def __str__(self):
+        return ("wakeups: {}, events: {} ({:.2f}/wakeup, max {}), deferred: {}, "
+                "handler time: {:.6f} s ({:.2f} us/event)".format(
+                self.wakeups, self.events, self.events_per_wakeup, self.max_batch,
+                self.deferred, self.handler_time, self.time_per_event * 1000000.0))
+
+    @property
+    def events_per_wakeup(self):
+        if self.wakeups:
+            return self.events / float(self.wakeups)
+        return 0.0
+
+    @property
+    def time_per_event(self):
+        if self.dispatched:
+            return self.handler_time / self.dispatched
+        return 0.0
+
+
 class Poll(object):
     """Object oriented interface to epoll.
 
     Register objects that implement the PollerInterface in the singleton instance.
+
+    By default descriptors are level-triggered. If edge_triggered is set the
+    objects are registered with EPOLLET, and their handlers must read or
+    write until the operation would block. If oneshot is set they are
+    registered with EPOLLONESHOT, and a descriptor is disabled after each
+    event until it is re-armed with the modify method. Descriptors added with
+    register_fd are always level-triggered.
+
+    The maxevents value bounds the number of events fetched per wakeup. The
+    budget value, if not zero, is the most handler calls made per poll call;
+    the rest are kept for the next call in the edge-triggered and oneshot
+    modes, and reported again by the kernel otherwise.
+
+    If stats is set, counters are kept in a PollStats object, the stats
+    attribute.
     """
-    def __init__(self):
+    def __init__(self, edge_triggered=False, oneshot=False, maxevents=-1,
+            budget=0, stats=False):
         self.smap = {}
         self._fd_callbacks = {}
         self._idle_callbacks = {}
         self._idle_handle = 0
+        self._masks = {} # registered event mask, by fd
+        self._trigger = 0
+        if edge_triggered:
+            self._trigger |= EPOLLET
+        if oneshot:
+            self._trigger |= EPOLLONESHOT
+        self._oneshot = oneshot
+        self.maxevents = maxevents
+        self.budget = budget
+        self._pending = []
+        self.stats = PollStats() if stats else None
         self.pollster = select.epoll()
         self.closed = False
         fd = self.pollster.fileno()
@@ -103,17 +164,27 @@ class Poll(object):
         flags = self._getflags(obj)
         if flags:
             fd = obj.fileno()
+            flags |= self._trigger
             self.pollster.register(fd, flags)
             self.smap[fd] = obj
+            self._masks[fd] = flags
 
     def is_registered(self, obj):
         return obj.fileno() in self.smap
 
     def modify(self, obj):
+        """Update the event mask from the object's current interest. The
+        system call is skipped if nothing changed, except in oneshot mode
+        where this also re-arms the descriptor."""
         fd = obj.fileno()
         if fd in self.smap:
-            flags = self._getflags(obj)
-            self.pollster.modify(fd, flags)
+            flags = self._getflags(obj) | self._trigger
+            if self._oneshot or flags != self._masks.get(fd):
+                self.pollster.modify(fd, flags)
+                self._masks[fd] = flags
+            self._drop_pending(fd)
+
+    rearm = modify
 
     def unregister(self, obj):
         fd = obj.fileno()
@@ -121,6 +192,8 @@ class Poll(object):
             del self.smap[fd]
         except KeyError:
             return
+        self._masks.pop(fd, None)
+        self._drop_pending(fd)
         try:
             self.pollster.unregister(fd)
         except IOError:
@@ -135,6 +208,8 @@ class Poll(object):
         return fd in self._fd_callbacks
 
     def unregister_fd(self, fd):
+        self._masks.pop(fd, None)
+        self._drop_pending(fd)
         try:
             del self.smap[fd]
         except KeyError:
@@ -151,6 +226,11 @@ class Poll(object):
             return True
         return False
 
+    def _drop_pending(self, fd):
+        # Deferred events carry the old interest, and the fd may be reused.
+        if self._pending:
+            self._pending = [ev for ev in self._pending if ev[0] != fd]
+
     def register_idle(self, callback):
         self._idle_handle += 1
         self._idle_callbacks[self._idle_handle] = callback
@@ -168,9 +248,11 @@ class Poll(object):
             callback()
 
     def poll(self, timeout=-1.0):
+        if self._pending: # events left over from the last budget
+            timeout = 0.0
         while 1:
             try:
-                rl = self.pollster.poll(timeout)
+                rl = self.pollster.poll(timeout, self.maxevents)
             except IOError as why:
                 if why.errno == EINTR:
                     self._run_idle()
@@ -179,10 +261,33 @@ class Poll(object):
                     raise
             else:
                 break
+        stats = self.stats
+        if stats is not None and rl:
+            stats.wakeups += 1
+            stats.events += len(rl)
+            stats.max_batch = max(stats.max_batch, len(rl))
+        if self._pending:
+            rl = self._pending + rl
+            self._pending = []
+        if self.budget and len(rl) > self.budget:
+            if self._trigger: # the kernel won't report these again.
+                self._pending = rl[self.budget:]
+            if stats is not None:
+                stats.deferred += len(rl) - self.budget
+            rl = rl[:self.budget]
+        if stats is None:
+            self._dispatch(rl)
+        else:
+            start = now()
+            self._dispatch(rl)
+            stats.handler_time += now() - start
+            stats.dispatched += len(rl)
+
+    def _dispatch(self, rl):
+        smap = self.smap
         for fd, flags in rl:
-            try:
-                hobj = self.smap[fd]
-            except KeyError: # this should never happen, but let's be safe.
+            hobj = smap.get(fd, NULL)
+            if hobj is NULL: # unregistered by an earlier handler.
                 continue
             if hobj is None: # signals simple callback
                 self._fd_callbacks[fd]()
@@ -223,6 +328,7 @@ class Poll(object):
             self.unregister(obj)
         self._fd_callbacks = {}
         self._idle_callbacks = {}
+        self._pending = []
 
     clear = unregister_all
 
@@ -615,3 +721,427 @@ class AsyncIOHandler(PollerInterface):
     def exception_handler(self, ex, val, tb):
         print("AsyncIOHandler exception: %s (%s)" % (ex, val), file=sys.stderr)
 
+
+
+# Coroutine support, in the style of PEP 3156 (Tulip). Coroutines are
+# generators that yield Future objects (or other coroutines) to wait for them.
+# Since Python 2 generators can't return a value, a coroutine returns one by
+# raising Return(value). Everything runs from the Poll loop, so thousands of
+# conversations can proceed at once without threads or forks.
+#
+#   def fetch(sock):
+#       yield wait_writable(sock)
+#       sock.send(request)
+#       yield wait_readable(sock)
+#       raise Return(sock.recv(4096))
+#
+#   result = run(fetch(sock), timeout=10)
+
+class CancelledError(AsyncIOException):
+    pass
+
+class TimeoutError(AsyncIOException):
+    pass
+
+class InvalidStateError(AsyncIOException):
+    pass
+
+
+class Return(Exception):
+    """Raise in a coroutine to return a value from it."""
+    def __init__(self, value=None):
+        super(Return, self).__init__(value)
+        self.value = value
+
+
+_PENDING = 0
+_CANCELLED = 1
+_FINISHED = 2
+
+class Future(object):
+    """The result of an operation that completes later.
+
+    Done callbacks are called from the event loop, with the future as the
+    argument.
+    """
+    def __init__(self, loop=None):
+        self._loop = loop or get_event_loop()
+        self._state = _PENDING
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def __repr__(self):
+        state = ("pending", "cancelled", "finished")[self._state]
+        return "<%s %s>" % (self.__class__.__name__, state)
+
+    def cancel(self):
+        if self._state != _PENDING:
+            return False
+        self._state = _CANCELLED
+        self._schedule_callbacks()
+        return True
+
+    def cancelled(self):
+        return self._state == _CANCELLED
+
+    def done(self):
+        return self._state != _PENDING
+
+    def result(self):
+        if self._state == _CANCELLED:
+            raise CancelledError()
+        if self._state != _FINISHED:
+            raise InvalidStateError("Result is not ready.")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self):
+        if self._state == _CANCELLED:
+            raise CancelledError()
+        if self._state != _FINISHED:
+            raise InvalidStateError("Exception is not set.")
+        return self._exception
+
+    def add_done_callback(self, callback):
+        if self._state != _PENDING:
+            self._loop.call_soon(callback, self)
+        else:
+            self._callbacks.append(callback)
+
+    def remove_done_callback(self, callback):
+        n = len(self._callbacks)
+        self._callbacks = [cb for cb in self._callbacks if cb != callback]
+        return n - len(self._callbacks)
+
+    def set_result(self, result):
+        if self._state != _PENDING:
+            raise InvalidStateError("Future is already done.")
+        self._result = result
+        self._state = _FINISHED
+        self._schedule_callbacks()
+
+    def set_exception(self, exception):
+        if self._state != _PENDING:
+            raise InvalidStateError("Future is already done.")
+        if isinstance(exception, type):
+            exception = exception()
+        self._exception = exception
+        self._state = _FINISHED
+        self._schedule_callbacks()
+
+    def _schedule_callbacks(self):
+        callbacks = self._callbacks
+        self._callbacks = []
+        for callback in callbacks:
+            self._loop.call_soon(callback, self)
+
+
+class Task(Future):
+    """Runs a coroutine (a generator) to completion, as a Future."""
+    def __init__(self, coro, loop=None):
+        super(Task, self).__init__(loop)
+        self._coro = coro
+        self._waiting = None # Future the coroutine is blocked on
+        self._must_cancel = False
+        self._loop.call_soon(self._step)
+
+    def cancel(self):
+        if self.done():
+            return False
+        if self._waiting is not None and self._waiting.cancel():
+            return True # _wakeup will throw CancelledError into the coroutine.
+        self._must_cancel = True
+        return True
+
+    def _step(self, value=None, exc=None):
+        if self.done():
+            return
+        if self._must_cancel:
+            exc = CancelledError()
+            self._must_cancel = False
+        self._waiting = None
+        try:
+            if exc is not None:
+                yielded = self._coro.throw(exc)
+            else:
+                yielded = self._coro.send(value)
+        except StopIteration:
+            self.set_result(None)
+        except Return as ret:
+            self.set_result(ret.value)
+        except CancelledError:
+            super(Task, self).cancel()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception as err:
+            self.set_exception(err)
+        else:
+            if yielded is None: # a bare yield just lets others run.
+                self._loop.call_soon(self._step)
+                return
+            if not isinstance(yielded, Future):
+                if hasattr(yielded, "send") and hasattr(yielded, "throw"):
+                    yielded = Task(yielded, self._loop)
+                else:
+                    self._loop.call_soon(self._step, None,
+                            TypeError("Coroutine yielded {!r}.".format(yielded)))
+                    return
+            self._waiting = yielded
+            yielded.add_done_callback(self._wakeup)
+
+    def _wakeup(self, future):
+        try:
+            value = future.result()
+        except Exception as err:
+            self._step(None, err)
+        else:
+            self._step(value)
+
+
+class _FDWaiter(PollerInterface):
+    """Holds the futures waiting on one file descriptor."""
+    def __init__(self, fd):
+        self._fd = fd
+        self.readers = []
+        self.writers = []
+
+    def fileno(self):
+        return self._fd
+
+    def readable(self):
+        return bool(self.readers)
+
+    def writable(self):
+        return bool(self.writers)
+
+    def _wake(self, waiters):
+        for fut in waiters:
+            if not fut.done():
+                fut.set_result(self._fd)
+
+    def read_handler(self):
+        readers, self.readers = self.readers, []
+        self._wake(readers)
+
+    def write_handler(self):
+        writers, self.writers = self.writers, []
+        self._wake(writers)
+
+    def hangup_handler(self):
+        self.read_handler()
+        self.write_handler()
+
+    error_handler = hangup_handler
+
+    def exception_handler(self, ex, val, tb):
+        for fut in self.readers + self.writers:
+            if not fut.done():
+                fut.set_exception(val)
+        self.readers = []
+        self.writers = []
+
+
+class EventLoop(object):
+    """Runs callbacks, timers, and coroutines from a Poll object (the module
+    poller by default)."""
+    def __init__(self, poll=None):
+        from pycopia import scheduler
+        self.poller = poll or poller
+        self._ready = collections.deque()
+        self._timers = scheduler.PollScheduler(self.poller)
+        self._waiters = {} # fd -> _FDWaiter
+
+    def close(self):
+        self._timers.close()
+        for waiter in list(self._waiters.values()):
+            self.poller.unregister(waiter)
+        self._waiters = {}
+        self._ready.clear()
+
+    def call_soon(self, callback, *args):
+        self._ready.append((callback, args))
+
+    def call_later(self, delay, callback, *args):
+        """Run the callback after delay seconds. Returns an event with a stop
+        method to cancel it."""
+        return self._timers.add(max(delay, 0.000001), 0, callback, args)
+
+    def create_task(self, coro):
+        return Task(coro, self)
+
+    def _waiter_future(self, fd_or_obj, readers):
+        if isinstance(fd_or_obj, int):
+            fd = fd_or_obj
+        else:
+            fd = fd_or_obj.fileno()
+        fut = Future(self)
+        waiter = self._waiters.get(fd)
+        if waiter is None:
+            waiter = self._waiters[fd] = _FDWaiter(fd)
+            (waiter.readers if readers else waiter.writers).append(fut)
+            self.poller.register(waiter)
+        else:
+            (waiter.readers if readers else waiter.writers).append(fut)
+            self.poller.modify(waiter)
+        fut.add_done_callback(lambda f: self._release(fd))
+        return fut
+
+    def _release(self, fd):
+        waiter = self._waiters.get(fd)
+        if waiter is None:
+            return
+        waiter.readers = [f for f in waiter.readers if not f.done()]
+        waiter.writers = [f for f in waiter.writers if not f.done()]
+        if waiter.readers or waiter.writers:
+            self.poller.modify(waiter)
+        else:
+            del self._waiters[fd]
+            self.poller.unregister(waiter)
+
+    def wait_readable(self, fd_or_obj):
+        """Return a Future that is done when the descriptor is readable."""
+        return self._waiter_future(fd_or_obj, True)
+
+    def wait_writable(self, fd_or_obj):
+        """Return a Future that is done when the descriptor is writable."""
+        return self._waiter_future(fd_or_obj, False)
+
+    def sleep(self, delay, result=None):
+        fut = Future(self)
+        def _wake():
+            if not fut.done():
+                fut.set_result(result)
+        ev = self.call_later(delay, _wake)
+        fut.add_done_callback(lambda f: ev.stop())
+        return fut
+
+    def wait_for(self, fut, timeout):
+        """Return a Future for the result of fut, that raises TimeoutError
+        and cancels fut if it is not done in timeout seconds."""
+        fut = self._as_future(fut)
+        if timeout is None:
+            return fut
+        outer = Future(self)
+        def _expire():
+            if not outer.done():
+                fut.cancel()
+                outer.set_exception(TimeoutError("timed out after {} s".format(timeout)))
+        ev = self.call_later(timeout, _expire)
+        def _done(f):
+            ev.stop()
+            if not outer.done():
+                _copy_state(f, outer)
+        fut.add_done_callback(_done)
+        outer.add_done_callback(lambda f: f.cancelled() and fut.cancel())
+        return outer
+
+    def gather(self, *futs, **kwargs):
+        """Return a Future for the list of results of all the futures or
+        coroutines, in order.
+
+        Keyword arguments:
+            timeout: raise TimeoutError, and cancel what is left, if they are
+                     not all done in this many seconds.
+            return_exceptions: put exceptions in the result list instead of
+                     failing the whole gather on the first one.
+        """
+        timeout = kwargs.get("timeout")
+        return_exceptions = kwargs.get("return_exceptions", False)
+        children = [self._as_future(f) for f in futs]
+        outer = Future(self)
+        results = [None] * len(children)
+        pending = [len(children)]
+        if not children:
+            outer.set_result(results)
+            return outer
+
+        def _child_done(i, child):
+            if outer.done():
+                return
+            if child.cancelled():
+                err = CancelledError()
+            else:
+                err = child.exception()
+            if err is not None and not return_exceptions:
+                outer.set_exception(err)
+                for other in children:
+                    other.cancel()
+                return
+            results[i] = err if err is not None else child.result()
+            pending[0] -= 1
+            if pending[0] == 0:
+                outer.set_result(results)
+
+        for i, child in enumerate(children):
+            child.add_done_callback(lambda f, i=i: _child_done(i, f))
+        outer.add_done_callback(
+                lambda f: f.cancelled() and [c.cancel() for c in children])
+        if timeout is not None:
+            return self.wait_for(outer, timeout)
+        return outer
+
+    def _as_future(self, obj):
+        if isinstance(obj, Future):
+            return obj
+        return Task(obj, self)
+
+    def run_once(self, timeout=-1.0):
+        """Run ready callbacks, then poll for I/O and timers once."""
+        ready = self._ready
+        for i in range(len(ready)):
+            callback, args = ready.popleft()
+            callback(*args)
+        self.poller.poll(0.0 if ready else timeout)
+        self._timers.run_pending()
+
+    def run_until_complete(self, fut, timeout=None):
+        """Run the loop until the Future or coroutine is done, and return its
+        result."""
+        fut = self.wait_for(self._as_future(fut), timeout)
+        while not fut.done():
+            self.run_once(5.0)
+        return fut.result()
+
+
+def _copy_state(source, dest):
+    if source.cancelled():
+        dest.cancel()
+    elif source.exception() is not None:
+        dest.set_exception(source.exception())
+    else:
+        dest.set_result(source.result())
+
+
+# The event loop is a singleton instance, using the module poller.
+_event_loop = None
+
+def get_event_loop():
+    global _event_loop
+    if _event_loop is None:
+        _event_loop = EventLoop()
+    return _event_loop
+
+def spawn(coro):
+    """Start running a coroutine. Returns its Task."""
+    return get_event_loop().create_task(coro)
+
+def run(coro, timeout=None):
+    """Run a coroutine, or Future, until it is done and return the result."""
+    return get_event_loop().run_until_complete(coro, timeout)
+
+def sleep(delay, result=None):
+    return get_event_loop().sleep(delay, result)
+
+def wait_readable(fd_or_obj):
+    return get_event_loop().wait_readable(fd_or_obj)
+
+def wait_writable(fd_or_obj):
+    return get_event_loop().wait_writable(fd_or_obj)
+
+def wait_for(fut, timeout):
+    return get_event_loop().wait_for(fut, timeout)
+
+def gather(*futs, **kwargs):
+    return get_event_loop().gather(*futs, **kwargs)
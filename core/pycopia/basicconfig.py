@@ -17,6 +17,11 @@
 """
 Basic configuration holder objects.
 
+Configuration files are Python source. The compiled code of each file read,
+including the files it includes, is kept for the life of the process, and
+also saved beside the file (when its directory is writable) for the next
+process. Either is used only while the file's modification time and size
+are unchanged.
 """
 from __future__ import absolute_import
 from __future__ import print_function
@@ -24,15 +29,96 @@ from __future__ import unicode_literals
 from __future__ import division
 
 import sys, os
+import io
+import __future__
+import marshal
+import struct
 import warnings
 
-
-
-if sys.version_info.major == 3:
-    def execfile(fn, glbl, loc):
-        exec(open(fn).read(), glbl, loc)
-else: # python 2
-    execfile = execfile
+try:
+    from importlib.util import MAGIC_NUMBER
+except ImportError: # python 2
+    from imp import get_magic
+    MAGIC_NUMBER = get_magic()
+
+
+# Compiled config files are kept in memory, and written beside the source
+# file (if possible), with this added to the name.
+COMPILED_SUFFIX = "c"
+
+_HEADER = struct.Struct(b"<dqI") # source mtime and size, compiler flags
+
+# Config files were run by execfile from here, which compiled them with the
+# future features of this module. Keep them, so the files mean the same.
+_FLAGS = (__future__.absolute_import.compiler_flag |
+        __future__.print_function.compiler_flag |
+        __future__.unicode_literals.compiler_flag |
+        __future__.division.compiler_flag)
+_CODECACHE = {} # by file name, (mtime, size, flags, code)
+
+
+def execfile(filename, glbl, loc):
+    """Execute the Python file like the built-in execfile, using the
+    compiled code from an earlier call, or an earlier process, if the file
+    has not changed since."""
+    exec(get_code(filename), glbl, loc)
+
+
+def get_code(filename):
+    """Return the code object of a Python syntax config file."""
+    st = os.stat(filename)
+    stamp = (st.st_mtime, st.st_size, _FLAGS)
+    cached = _CODECACHE.get(filename)
+    if cached is not None and cached[:3] == stamp:
+        return cached[3]
+    compiledname = filename + COMPILED_SUFFIX
+    code = _read_compiled(compiledname, stamp)
+    if code is None:
+        with io.open(filename, "rb") as fo:
+            source = fo.read()
+        code = compile(source, filename, "exec", _FLAGS, True)
+        _write_compiled(compiledname, stamp, code)
+    _CODECACHE[filename] = stamp + (code,)
+    return code
+
+
+def _read_compiled(compiledname, stamp):
+    try:
+        with io.open(compiledname, "rb") as fo:
+            data = fo.read()
+    except (IOError, OSError):
+        return None
+    start = len(MAGIC_NUMBER)
+    end = start + _HEADER.size
+    if (len(data) < end or data[:start] != MAGIC_NUMBER or
+            _HEADER.unpack(data[start:end]) != stamp):
+        return None
+    try:
+        return marshal.loads(data[end:])
+    except (ValueError, EOFError, TypeError):
+        return None
+
+
+def _write_compiled(compiledname, stamp, code):
+    # Written to a temporary file then renamed, so a reader never sees a
+    # partial file. The config directory may not be writable, that's OK.
+    tempname = "%s.%d" % (compiledname, os.getpid())
+    try:
+        with io.open(tempname, "wb") as fo:
+            fo.write(MAGIC_NUMBER)
+            fo.write(_HEADER.pack(*stamp))
+            fo.write(marshal.dumps(code))
+        os.rename(tempname, compiledname)
+    except (IOError, OSError):
+        try:
+            os.unlink(tempname)
+        except OSError:
+            pass
+
+
+def clear_cache():
+    """Forget the compiled config files kept in memory."""
+    _CODECACHE.clear()
 
 
 class BasicConfigError(Exception):
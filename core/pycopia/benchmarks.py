@@ -210,6 +210,39 @@ class BenchCompare(object):
         return rep
 
 
+def compare_pattern_matching(npatterns=40, iterations=2000, loops=3):
+    """Compare searching lines for the first of a list of patterns, one pattern
+    at a time, with the combined stringmatch.PatternSet. Most of the lines
+    match nothing, as with prompt and error patterns on device output.
+    """
+    import re
+    from pycopia import stringmatch
+    patterns = []
+    for i in range(npatterns):
+        if i % 2:
+            patterns.append(stringmatch.compile_exact("ERROR %d:" % (i,)))
+        else:
+            patterns.append(re.compile(r"state%d\s+(\w+)=(\d+)" % (i,)))
+    lines = ["interface eth%d is up, line protocol is up" % (i,) for i in range(30)]
+    lines.append("ERROR %d: device busy" % (npatterns - 1,))
+    pset = stringmatch.compile_set(patterns)
+
+    def search_loop(line):
+        for i, so in enumerate(patterns):
+            if so.search(line):
+                return i
+        return -1
+
+    def search_set(line):
+        found = pset.search(line)
+        if found:
+            return found[0]
+        return -1
+
+    bc = BenchCompare((search_loop, search_set), iterations=iterations, loops=loops)
+    return bc(argiterator=[(line,) for line in lines])
+
+
 if __name__ == "__main__":
     from pycopia import autodebug
     import random
@@ -234,5 +267,9 @@ if __name__ == "__main__":
     rr.append([1,2,3,4,5], 3)
     rat = rr.get_ratios()
     print (rat)
+    print()
+    cmpres = compare_pattern_matching()
+    print (cmpres)
+    print (cmpres.get_ratios())
 
 
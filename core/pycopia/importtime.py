@@ -0,0 +1,217 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure how long it takes to import modules, and which modules take the time.
+
+The ImportTimer wraps the builtin __import__ function. Each module loaded
+while it is installed is charged with the time spent importing it (its
+cumulative time), and with that time less the time spent importing other new
+modules from it (its self time). Importing a module already loaded costs
+nothing, so only the first importer pays for a module.
+
+The report ranks the pycopia modules by their self time, which is where a
+startup regression will show up.
+
+    pycopia-importtime [-a] [-c] [-n <count>] <module>...
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import sys
+import getopt
+from timeit import default_timer
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+
+class ImportRecord(object):
+    """Import cost of one module. Times are in seconds."""
+
+    def __init__(self, name, cumulative, selftime, importer):
+        self.name = name
+        self.cumulative = cumulative
+        self.selftime = selftime
+        self.importer = importer
+
+    def __repr__(self):
+        return "{}({!r}, {!r}, {!r}, {!r})".format(self.__class__.__name__,
+                self.name, self.cumulative, self.selftime, self.importer)
+
+    def __str__(self):
+        return "{:10.2f} {:10.2f}  {} ({})".format(self.selftime * 1000.0,
+                self.cumulative * 1000.0, self.name, self.importer or "-")
+
+
+class ImportTimer(object):
+    """Time module imports.
+
+    Use as a context manager, or call install() and uninstall(). The records
+    attribute maps module names to ImportRecord objects.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self._original = None
+        self._seen = None
+        self._count = 0  # size of sys.modules when last examined.
+        self._pending = set()  # loading modules passed over when last examined.
+        self._children = []  # stack of time spent in nested imports.
+        self._importers = []  # stack of importing module names.
+
+    def install(self):
+        if self._original is None:
+            self._seen = set(sys.modules)
+            self._count = len(sys.modules)
+            self._original = builtins.__import__
+            builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, extype, exvalue, traceback):
+        self.uninstall()
+
+    def _import(self, name, globals=None, locals=None, fromlist=None, level=-1):
+        importer = globals.get("__name__") if globals else None
+        self._children.append(0.0)
+        self._importers.append(importer)
+        start = default_timer()
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = default_timer() - start
+            children = self._children.pop()
+            if len(sys.modules) != self._count or (self._pending and
+                    not self._pending.issubset(self._importers)):
+                if self._record(name, elapsed, elapsed - children, importer) and self._children:
+                    self._children[-1] += elapsed
+            self._importers.pop()
+
+    def _record(self, name, elapsed, selftime, importer):
+        # Nested imports have already claimed their own modules, what is left
+        # was loaded by this call. That is the requested module, and perhaps
+        # its parent packages. Modules still being imported are already in
+        # sys.modules, but they are claimed when their own import finishes.
+        loading = set(self._importers)
+        new = [modname for modname, mod in list(sys.modules.items())
+                if mod is not None and modname not in self._seen and modname not in loading]
+        self._pending = loading.difference(self._seen).intersection(sys.modules)
+        self._seen.update(new)
+        self._seen.update(modname for modname, mod in list(sys.modules.items()) if mod is None)
+        self._count = len(sys.modules)
+        if not new:
+            return False
+        new.sort(key=len)
+        target = new[-1]
+        for modname in new:
+            if modname == name or modname.endswith("." + name):
+                target = modname
+        for modname in new:
+            if modname == target:
+                self.records[modname] = ImportRecord(modname, elapsed, selftime, importer)
+            else:
+                self.records[modname] = ImportRecord(modname, 0.0, 0.0, importer)
+        return True
+
+    def get_records(self, prefix="pycopia", sortkey="selftime"):
+        """Return the records of modules whose names start with prefix, most
+        expensive first. Sort by "selftime" or "cumulative"."""
+        recs = [rec for name, rec in self.records.items() if name.startswith(prefix)]
+        recs.sort(key=lambda rec: getattr(rec, sortkey), reverse=True)
+        return recs
+
+    def total(self, prefix=""):
+        return sum(rec.selftime for name, rec in self.records.items() if name.startswith(prefix))
+
+
+def time_imports(modnames, ignore_errors=False):
+    """Import the named modules, and return the ImportTimer that timed them.
+
+    If ignore_errors is true, modules that fail to import are reported on
+    stderr and the others are still timed.
+    """
+    timer = ImportTimer()
+    with timer:
+        for modname in modnames:
+            try:
+                __import__(modname)
+            except ImportError as err:
+                if not ignore_errors:
+                    raise
+                print("{}: {}".format(modname, err), file=sys.stderr)
+    return timer
+
+
+def report(timer, prefix="pycopia", sortkey="selftime", count=None, out=sys.stdout):
+    recs = timer.get_records(prefix, sortkey)
+    print("{:>10s} {:>10s}  {} ({})".format("self ms", "total ms", "module", "imported by"), file=out)
+    for rec in recs[:count]:
+        print(rec, file=out)
+    print("{:d} of {:d} modules. {} self time {:.2f} ms, all modules {:.2f} ms.".format(
+            len(recs), len(timer.records), prefix or "Total", timer.total(prefix) * 1000.0,
+            timer.total() * 1000.0), file=out)
+
+
+def importtime(argv):
+    """Rank pycopia modules by the time taken to import them.
+
+    pycopia-importtime [-a] [-c] [-n <count>] <module>...
+
+    Options:
+        -a  Report all modules, not only pycopia modules.
+        -c  Sort by cumulative time, rather than self time.
+        -n  Report only the <count> most expensive modules.
+    """
+    try:
+        opts, args = getopt.getopt(argv[1:], "h?acn:")
+    except getopt.GetoptError as err:
+        print(err, file=sys.stderr)
+        print(importtime.__doc__, file=sys.stderr)
+        return 2
+    prefix = "pycopia"
+    sortkey = "selftime"
+    count = None
+    for opt, optarg in opts:
+        if opt in ("-h", "-?"):
+            print(importtime.__doc__)
+            return
+        elif opt == "-a":
+            prefix = ""
+        elif opt == "-c":
+            sortkey = "cumulative"
+        elif opt == "-n":
+            count = int(optarg)
+    if not args:
+        print(importtime.__doc__, file=sys.stderr)
+        return 2
+    timer = time_imports(args, ignore_errors=True)
+    report(timer, prefix, sortkey, count)
+
+
+if __name__ == "__main__":
+    sys.exit(importtime(sys.argv))
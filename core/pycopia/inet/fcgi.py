@@ -57,7 +57,7 @@ variable FCGI_FORCE_CGI to "Y" or "y".
 
 __version__ = '$Revision$'
 
-__all__ = ['FCGIServer']
+__all__ = ['FCGIServer', 'PreforkFCGIServer']
 
 import sys
 import os
@@ -67,6 +67,8 @@ import fcntl
 import select
 import errno
 import traceback
+import time
+import mmap
 
 from pycopia import socket
 from pycopia.aid import systemcall, NULL
@@ -124,8 +126,6 @@ FCGI_UnknownTypeBody_LEN = struct.calcsize(FCGI_UnknownTypeBody)
 WSGI_VERSION = (1,0)
 
 if __debug__:
-    import time
-
     # Set non-zero to write debug output to a file.
     DEBUG = 10
     DEBUGLOG = '/var/tmp/fcgi.log'
@@ -759,7 +759,52 @@ class Connection(object):
         outrec = Record(FCGI_UNKNOWN_TYPE)
         outrec.contentData = struct.pack(FCGI_UnknownTypeBody, inrec.type)
         outrec.contentLength = FCGI_UnknownTypeBody_LEN
-        self.writeRecord(rec)
+        self.writeRecord(outrec)
+
+
+class MultiplexedConnection(Connection):
+    """
+    A Connection that accepts several requests at once (FCGI_MPXS_CONNS).
+
+    A request is run when all of its input has arrived, so the records of
+    other requests on the same connection are buffered while it runs.
+    Requests are run one at a time, in the order they become ready.
+    """
+    _multiplexed = True
+
+    def _do_begin_request(self, inrec):
+        Connection._do_begin_request(self, inrec)
+        req = self._requests.get(inrec.requestId)
+        if req is not None:
+            req.paramsDone = False
+
+    def _do_params(self, inrec):
+        req = self._requests.get(inrec.requestId)
+        if req is not None:
+            if inrec.contentLength:
+                pos = 0
+                while pos < inrec.contentLength:
+                    pos, (name, value) = decode_pair(inrec.contentData, pos)
+                    req.params[name] = value
+            else:
+                req.paramsDone = True
+                self._run_ready(req)
+
+    def _do_stdin(self, inrec):
+        req = self._requests.get(inrec.requestId)
+        if req is not None:
+            req.stdin.add_data(inrec.contentData)
+            if not inrec.contentLength:
+                self._run_ready(req)
+
+    def _run_ready(self, req):
+        # Only responders get a stdin stream.
+        if req.paramsDone and (req.stdin._eof or req.role != FCGI_RESPONDER):
+            req.run()
+
+    def busy(self):
+        """True if some request has been started, but not ended."""
+        return bool(self._requests)
 
 
 
@@ -1058,6 +1103,336 @@ class FCGIServer(object):
                                              (self.__class__.__name__, name))
                 environ[name] = default
 
+
+# Shared status of a pre-forked worker: pid, open connections, requests
+# served, resident set size (KB), and start time.
+_WORKER_SLOT = struct.Struct("=iiQQd")
+
+RSS_CHECK_INTERVAL = 16 # requests between resident set size checks
+PAGESIZE = resource.getpagesize()
+
+
+def _get_rss():
+    """Return the resident set size of this process, in kilobytes."""
+    try:
+        with open("/proc/self/statm") as fo:
+            return int(fo.read().split()[1]) * PAGESIZE // 1024
+    except (IOError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class WorkerStatus(object):
+    """Counters of one worker process, as recorded in the shared table."""
+    __slots__ = ("pid", "connections", "requests", "rss", "started")
+
+    def __init__(self, pid, connections, requests, rss, started):
+        self.pid = pid
+        self.connections = connections
+        self.requests = requests
+        self.rss = rss
+        self.started = started
+
+    def __str__(self):
+        return "%8d %11d %10d %9d %9d" % (self.pid, self.connections,
+                self.requests, self.rss, int(time.time() - self.started))
+
+
+class WorkerTable(object):
+    """
+    Status slots of worker processes, in anonymous memory shared by the
+    master process and the workers forked after it was made.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._map = mmap.mmap(-1, _WORKER_SLOT.size * size)
+
+    def close(self):
+        self._map.close()
+
+    def set(self, slot, pid, connections, requests, rss, started):
+        _WORKER_SLOT.pack_into(self._map, slot * _WORKER_SLOT.size,
+                pid, connections, requests, rss, started)
+
+    def get(self, slot):
+        return WorkerStatus(*_WORKER_SLOT.unpack_from(self._map,
+                slot * _WORKER_SLOT.size))
+
+    def clear(self, slot):
+        self.set(slot, 0, 0, 0, 0, 0.0)
+
+    def free_slot(self):
+        for slot in range(self.size):
+            if self.get(slot).pid == 0:
+                return slot
+        return None
+
+    def workers(self):
+        return [st for st in map(self.get, range(self.size)) if st.pid]
+
+    def __str__(self):
+        s = ["     pid connections   requests   rss(KB) uptime(s)"]
+        for st in self.workers():
+            s.append(str(st))
+        return "\n".join(s)
+
+
+class PreforkFCGIServer(FCGIServer):
+    """
+    FastCGI server with a pool of long-lived worker processes.
+
+    The listening socket is opened once, by the master process, and shared by
+    `workers` forked worker processes. Each worker accepts connections itself,
+    and serves any number of them at once, and any number of multiplexed
+    requests on each. Connections stay open for as long as the web server
+    keeps them.
+
+    A worker exits, and is replaced, after it has served `maxrequests`
+    requests, or when its resident set grows past `maxrss` kilobytes. SIGHUP
+    replaces all the workers gracefully: the old ones stop accepting, finish
+    the requests they have, and exit. SIGINT and SIGTERM stop the server.
+
+    If `statuspath` is given, a request for that path is answered by the
+    server itself with a plain text table of the workers and their counters.
+    `worker_init`, if given, is called in each worker after it is forked
+    (for example, to drop privileges).
+    """
+    def __init__(self, application, workers=4, maxrequests=0, maxrss=0,
+            statuspath=None, worker_init=None, graceful_timeout=30.0, **kwargs):
+        kwargs.pop("procmanager", None)
+        FCGIServer.__init__(self, application, **kwargs)
+        self.capability[FCGI_MPXS_CONNS] = 1
+        self._nworkers = workers
+        self._maxrequests = maxrequests
+        self._maxrss = maxrss
+        self._statuspath = statuspath
+        self._worker_init = worker_init
+        self._graceful_timeout = graceful_timeout
+        self.table = None
+
+    def _installSignalHandlers(self):
+        FCGIServer._installSignalHandlers(self)
+        self._oldSIGs.append((signal.SIGCHLD, signal.getsignal(signal.SIGCHLD)))
+        signal.signal(signal.SIGCHLD, self._chldHandler)
+
+    def _hupHandler(self, signum, frame):
+        self._hupReceived = True
+
+    def _chldHandler(self, signum, frame):
+        pass # Just wakes the master loop, to replace the worker.
+
+    def run(self, timeout=1.0):
+        """
+        The master loop. Keeps the workers running until SIGINT or SIGTERM.
+        Returns False.
+        """
+        self._web_server_addrs = os.environ.get('FCGI_WEB_SERVER_ADDRS')
+        if self._web_server_addrs is not None:
+            self._web_server_addrs = map(lambda x: x.strip(),
+                                   self._web_server_addrs.split(','))
+        sock = self._setupSocket()
+        sock.setblocking(0) # workers race to accept
+        self.table = WorkerTable(self._nworkers * 2) # room for retiring ones
+        self._workers = {} # pid -> slot
+        self._retired = {} # pid -> (slot, time retired)
+        self._keepGoing = True
+        self._hupReceived = False
+        self._installSignalHandlers()
+        try:
+            while self._keepGoing:
+                if self._hupReceived:
+                    self._hupReceived = False
+                    self._retire_workers(self._workers.keys())
+                self._reap()
+                self._kill_retired(self._graceful_timeout)
+                while len(self._workers) < self._nworkers:
+                    slot = self.table.free_slot()
+                    if slot is None:
+                        break
+                    self._spawn(sock, slot)
+                if self._keepGoing:
+                    time.sleep(timeout)
+                self._idle_cb()
+        finally:
+            self._retire_workers(self._workers.keys())
+            self._cleanupSocket(sock)
+            endtime = time.time() + self._graceful_timeout
+            while self._retired and time.time() < endtime:
+                self._reap()
+                time.sleep(0.1)
+            self._kill_retired(0)
+            while self._retired:
+                self._reap()
+                time.sleep(0.01)
+            self._restoreSignalHandlers()
+            self.table.close()
+            self.table = None
+        return False
+
+    def _spawn(self, sock, slot):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                try:
+                    self._restoreSignalHandlers()
+                    self._worker(sock, slot)
+                    status = 0
+                except:
+                    traceback.print_exc()
+            finally:
+                os._exit(status)
+        self._workers[pid] = slot
+        self.table.set(slot, pid, 0, 0, 0, time.time())
+
+    def _retire_workers(self, pids):
+        now = time.time()
+        for pid in pids:
+            self._retired[pid] = (self._workers.pop(pid), now)
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except OSError:
+                pass
+
+    def _kill_retired(self, timeout):
+        now = time.time()
+        for pid, (slot, retired) in self._retired.items():
+            if now - retired >= timeout:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+
+    def _reap(self):
+        while self._workers or self._retired:
+            try:
+                pid, sts = os.waitpid(-1, os.WNOHANG)
+            except OSError, e:
+                if e[0] == errno.EINTR:
+                    continue
+                if e[0] == errno.ECHILD:
+                    break
+                raise
+            if pid == 0:
+                break
+            if pid in self._workers:
+                self.table.clear(self._workers.pop(pid))
+            elif pid in self._retired:
+                self.table.clear(self._retired.pop(pid)[0])
+
+    # worker side
+    def _worker(self, sock, slot):
+        for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self._intHandler)
+        if self._worker_init is not None:
+            self._worker_init()
+        self._slot = slot
+        self._started = time.time()
+        self._nrequests = 0
+        self._conns = {} # fileno -> Connection
+        self._keepGoing = True
+        self._update_status()
+        conns = self._conns
+        stoptime = None
+        while self._keepGoing or conns:
+            if not self._keepGoing:
+                # Stopping. Close the idle connections, and give the busy
+                # ones some time to finish.
+                if stoptime is None:
+                    stoptime = time.time() + self._graceful_timeout
+                for fd, conn in conns.items():
+                    if not conn.busy() or time.time() > stoptime:
+                        self._close_connection(conn)
+                if not conns:
+                    break
+            fds = conns.keys()
+            if self._keepGoing:
+                fds.append(sock.fileno())
+            try:
+                r, w, e = select.select(fds, [], [], 1.0)
+            except select.error, e:
+                if e[0] == errno.EINTR:
+                    continue
+                raise
+            for fd in r:
+                if fd == sock.fileno():
+                    self._accept(sock)
+                else:
+                    self._serve(conns[fd])
+            self._idle_cb()
+        sock.close()
+
+    def _accept(self, sock):
+        try:
+            clientSock, addr = sock.accept()
+        except socket.error, e:
+            if e[0] in (errno.EINTR, errno.EAGAIN, errno.ECONNABORTED):
+                return # Another worker got it.
+            raise
+        if self._web_server_addrs and \
+               (len(addr) != 2 or addr[0] not in self._web_server_addrs):
+            clientSock.close()
+            return
+        clientSock.setblocking(1)
+        close_on_exec(clientSock.fileno())
+        conn = MultiplexedConnection(clientSock, addr, self)
+        conn._keepGoing = True
+        self._conns[clientSock.fileno()] = conn
+        self._update_status()
+
+    def _serve(self, conn):
+        try:
+            conn.process_input()
+        except EOFError:
+            conn._keepGoing = False
+        except (select.error, socket.error), e:
+            if e[0] not in (errno.EBADF, errno.EPIPE, errno.ECONNRESET):
+                raise
+            conn._keepGoing = False
+        if not conn._keepGoing:
+            self._close_connection(conn)
+
+    def _close_connection(self, conn):
+        for fd, c in self._conns.items():
+            if c is conn:
+                del self._conns[fd]
+        try:
+            conn._sock.close()
+        except socket.error:
+            pass
+        self._update_status()
+
+    def _update_status(self):
+        if self._nrequests % RSS_CHECK_INTERVAL == 0:
+            self._rss = _get_rss()
+        self.table.set(self._slot, os.getpid(), len(self._conns),
+                self._nrequests, self._rss, self._started)
+
+    def handler(self, req):
+        """Handles WSGI request, or the status request."""
+        if self._statuspath and req.role == FCGI_RESPONDER and \
+                req.params.get("SCRIPT_NAME", "") + \
+                req.params.get("PATH_INFO", "") == self._statuspath:
+            rv = self._status_handler(req)
+        else:
+            rv = FCGIServer.handler(self, req)
+        self._nrequests += 1
+        self._update_status()
+        if self._maxrequests and self._nrequests >= self._maxrequests:
+            self._keepGoing = False
+        elif self._maxrss and self._rss > self._maxrss:
+            self._keepGoing = False
+        return rv
+
+    def _status_handler(self, req):
+        body = "%s\n" % (self.table,)
+        req.stdout.write('Status: 200 OK\r\n')
+        req.stdout.write('Content-Type: text/plain\r\n')
+        req.stdout.write('Content-Length: %d\r\n' % (len(body),))
+        req.stdout.write('\r\n')
+        req.stdout.write(body)
+        return FCGI_REQUEST_COMPLETE, 0
+
+
 if __name__ == '__main__':
     def test_app(environ, start_response):
         """Probably not the most efficient example."""
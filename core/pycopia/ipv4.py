@@ -24,6 +24,11 @@ Exports helper functions::
     iprange(startip, number) - return a list of sequential hosts in a network, as strings.
     ipnetrange(startnet, number) - return a list of sequential networks, as strings.
     netrange(startnet, number, [increment]) - return a list of networks, as IPv4 objects.
+    findnet(ip, networks) - return the most specific network containing an address.
+
+The NetworkTable class holds many networks, for fast longest prefix matching
+and supernet and subnet queries. The IPAddressSet class is a set of addresses
+kept as ranges, with set operations.
 
 
 The IPv4 class stores the IP address and mask. It also makes available the
@@ -38,6 +43,7 @@ from __future__ import print_function
 from __future__ import division
 
 import struct
+import bisect
 
 # for python 2.x and 3.x interoperability
 try:
@@ -562,19 +568,20 @@ def resolve(host, mask=None):
         raise ValueError("No addresses found.")
 
 def sortnets(l):
-    l = list(l)
-    def _netcmp(a, b):
-        return cmp(b.maskbits, a.maskbits)
-    l.sort(_netcmp)
-    return l
+    """Return a list of the networks, most specific first."""
+    return sorted(l, key=lambda net: net._mask, reverse=True)
 
 def findnet(ip, ipnets):
-    ip = IPv4(ip)
-    for ipnet in sortnets(ipnets):
-        ip.mask = ipnet.mask
-        if ip in ipnet:
-            return ipnet
-    return None
+    """Return the most specific of the networks that contains the address,
+    or None. Use a NetworkTable to look up many addresses."""
+    address = IPv4(ip)._address
+    found = None
+    for ipnet in ipnets:
+        mask = ipnet._mask
+        if (address & mask) == (ipnet._address & mask):
+            if found is None or mask > found._mask:
+                found = ipnet
+    return found
 
 # objects for IP address management
 
@@ -628,7 +635,383 @@ class IPRange(object):
         else:
             return self._start + idx
 
+
+def _bits2mask(bits):
+    return (0xffffffff << (32 - bits)) & 0xffffffff
+
+_SHIFTS = range(31, -1, -1)
+
+
+class _TrieNode(object):
+    __slots__ = ["children", "network", "value"]
+    def __init__(self):
+        self.children = [None, None]
+        self.network = None # set when a network ends here.
+        self.value = None
+
+
+class NetworkTable(object):
+    """A table of networks, with optional values, kept in a binary trie of
+    the network prefixes.
+
+    Finds the most specific network containing an address (longest prefix
+    match), and the networks containing, or contained in, a network,
+    without looking at all the networks.
+
+    Usage::
+
+        table = NetworkTable(["10.0.0.0/8", "10.1.1.0/24"])
+        table["172.16.0.0/12"] = "private"
+        table.match("10.1.1.5") # IPv4('10.1.1.0/24')
+        table.supernets("10.1.1.0/24") # [IPv4('10.0.0.0/8')]
+
+    Networks may be given as anything the IPv4 constructor accepts.
+    Iterating over the table produces the networks in address order.
+    """
+    def __init__(self, networks=None):
+        self._root = _TrieNode()
+        self._len = 0
+        if networks is not None:
+            self.update(networks)
+
+    @classmethod
+    def from_objects(cls, objects, attrname="ipnetwork"):
+        """Build a table of objects, such as database Network rows, keyed
+        by their network attribute. Objects without one are skipped.
+        """
+        table = cls()
+        for obj in objects:
+            net = getattr(obj, attrname)
+            if net is not None:
+                table.add(net, obj)
+        return table
+
+    def update(self, networks):
+        """Add networks from a mapping, or an iterable of networks or
+        (network, value) pairs."""
+        if hasattr(networks, "items"):
+            networks = networks.items()
+        for net in networks:
+            if isinstance(net, tuple):
+                self.add(*net)
+            else:
+                self.add(net)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, list(self))
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for node in self._walk(self._root):
+            yield node.network
+
+    def items(self):
+        return [(node.network, node.value) for node in self._walk(self._root)]
+
+    def add(self, network, value=None):
+        address, bits = _prefix(network)
+        node = self._root
+        for shift in _SHIFTS[:bits]:
+            bit = (address >> shift) & 1
+            child = node.children[bit]
+            if child is None:
+                child = node.children[bit] = _TrieNode()
+            node = child
+        if node.network is None:
+            self._len += 1
+        node.network = IPv4(address, _bits2mask(bits))
+        node.value = value
+
+    __setitem__ = add
+
+    def remove(self, network):
+        address, bits = _prefix(network)
+        path = [self._root]
+        for shift in _SHIFTS[:bits]:
+            node = path[-1].children[(address >> shift) & 1]
+            if node is None:
+                raise KeyError(network)
+            path.append(node)
+        node = path[-1]
+        if node.network is None:
+            raise KeyError(network)
+        node.network = node.value = None
+        self._len -= 1
+        # prune the branch that no longer leads to a network.
+        while len(path) > 1:
+            node = path.pop()
+            if node.network is not None or node.children != [None, None]:
+                break
+            parent = path[-1]
+            parent.children[parent.children.index(node)] = None
+
+    __delitem__ = remove
+
+    def _find(self, network):
+        address, bits = _prefix(network)
+        node = self._root
+        for shift in _SHIFTS[:bits]:
+            node = node.children[(address >> shift) & 1]
+            if node is None:
+                return None
+        return node
+
+    def __contains__(self, network):
+        node = self._find(network)
+        return node is not None and node.network is not None
+
+    def __getitem__(self, network):
+        node = self._find(network)
+        if node is None or node.network is None:
+            raise KeyError(network)
+        return node.value
+
+    def get(self, network, default=None):
+        node = self._find(network)
+        if node is None or node.network is None:
+            return default
+        return node.value
+
+    def _match(self, address):
+        address = _address(address)
+        node = self._root
+        found = node if node.network is not None else None
+        for shift in _SHIFTS:
+            node = node.children[(address >> shift) & 1]
+            if node is None:
+                break
+            if node.network is not None:
+                found = node
+        return found
+
+    def match(self, address):
+        """Return the most specific network that contains the address, or
+        None."""
+        node = self._match(address)
+        return node.network if node is not None else None
+
+    def lookup(self, address, default=None):
+        """Return the value of the most specific network that contains the
+        address."""
+        node = self._match(address)
+        return node.value if node is not None else default
+
+    def supernets(self, network):
+        """Return the networks that contain the network, least specific
+        first."""
+        address, bits = _prefix(network)
+        node = self._root
+        found = []
+        for shift in _SHIFTS[:bits]:
+            if node.network is not None:
+                found.append(node.network)
+            node = node.children[(address >> shift) & 1]
+            if node is None:
+                break
+        return found
+
+    def subnets(self, network):
+        """Return the networks contained in the network, in address order."""
+        node = self._find(network)
+        if node is None:
+            return []
+        found = [n.network for n in self._walk(node)]
+        if node.network is not None:
+            del found[0]
+        return found
+
+    def _walk(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.network is not None:
+                yield node
+            one, zero = node.children[1], node.children[0]
+            if one is not None:
+                stack.append(one)
+            if zero is not None:
+                stack.append(zero)
+
+
+def _address(address):
+    if isinstance(address, (int, long)):
+        return address
+    return IPv4(address)._address
+
+
+def _prefix(network):
+    net = IPv4(network)
+    bits = net.maskbits
+    return net._address & _bits2mask(bits), bits
+
+
+def _range(item):
+    """An item of an IPAddressSet as an (first, last) pair of integers."""
+    if isinstance(item, (int, long)):
+        return item, item
+    if isinstance(item, IPRange):
+        return item._start._address, item._end._address
+    if isinstance(item, tuple):
+        first, last = _address(item[0]), _address(item[1])
+        return min(first, last), max(first, last)
+    if isinstance(item, basestring) and "/" not in item: # a single address
+        address = _address(item)
+        return address, address
+    net = IPv4(item)
+    first = net._address & net._mask
+    return first, first | (~net._mask & 0xffffffff)
+
+
+def _merge(ranges):
+    """Sort the ranges and join the overlapping and adjacent ones."""
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+
 class IPAddressSet(object):
-    pass
+    """A set of IPv4 addresses, kept as a sorted list of address ranges.
+
+    Add networks (all of their addresses), IPRange objects, (first, last)
+    address pairs, or addresses. An address string without a "/" mask is a
+    single address, not its class network. An IPv4 object is always taken
+    as its network.
+
+    Supports the set operations union, intersection, difference and
+    symmetric_difference, and the matching operators.
+    """
+    def __init__(self, items=None):
+        if items is None:
+            self._ranges = []
+        else:
+            self._ranges = _merge(_range(item) for item in items)
+
+    @classmethod
+    def _from_ranges(cls, ranges):
+        new = cls()
+        new._ranges = ranges
+        return new
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__,
+                [(itodq(first), itodq(last)) for first, last in self._ranges])
+
+    def __str__(self):
+        return ", ".join(net.CIDR for net in self.networks())
+
+    def copy(self):
+        return self._from_ranges(list(self._ranges))
+
+    def ranges(self):
+        """The addresses as a list of (first, last) IPv4 pairs."""
+        return [(IPv4(first, 0xffffffff), IPv4(last, 0xffffffff))
+                for first, last in self._ranges]
+
+    def networks(self):
+        """The addresses as the shortest list of networks that covers them."""
+        nets = []
+        for first, last in self._ranges:
+            while first <= last:
+                size = (first & -first) or 0x100000000
+                while size > last - first + 1:
+                    size >>= 1
+                nets.append(IPv4(first, _bits2mask(33 - size.bit_length())))
+                first += size
+        return nets
+
+    def __len__(self):
+        return sum(last - first + 1 for first, last in self._ranges)
+
+    def __nonzero__(self):
+        return bool(self._ranges)
+    __bool__ = __nonzero__
+
+    def __iter__(self):
+        for first, last in self._ranges:
+            while first <= last:
+                yield IPv4(first, 0xffffffff)
+                first += 1
+
+    def __contains__(self, item):
+        first, last = _range(item)
+        i = bisect.bisect_right(self._ranges, (first, 0x100000000)) - 1
+        return i >= 0 and self._ranges[i][1] >= last
+
+    def __eq__(self, other):
+        return isinstance(other, IPAddressSet) and self._ranges == other._ranges
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def add(self, item):
+        self._ranges = _merge(self._ranges + [_range(item)])
+
+    def update(self, items):
+        self._ranges = _merge(self._ranges + [_range(item) for item in items])
+
+    def discard(self, item):
+        self._ranges = _difference(self._ranges, [_range(item)])
+
+    def union(self, other):
+        return self._from_ranges(_merge(self._ranges + _ranges(other)))
+
+    def intersection(self, other):
+        other = _ranges(other)
+        result = []
+        i = j = 0
+        while i < len(self._ranges) and j < len(other):
+            first = max(self._ranges[i][0], other[j][0])
+            last = min(self._ranges[i][1], other[j][1])
+            if first <= last:
+                result.append((first, last))
+            if self._ranges[i][1] < other[j][1]:
+                i += 1
+            else:
+                j += 1
+        return self._from_ranges(result)
+
+    def difference(self, other):
+        return self._from_ranges(_difference(self._ranges, _ranges(other)))
+
+    def symmetric_difference(self, other):
+        other = IPAddressSet._from_ranges(_ranges(other))
+        return self.union(other).difference(self.intersection(other))
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+    __xor__ = symmetric_difference
+
+
+def _ranges(other):
+    if isinstance(other, IPAddressSet):
+        return other._ranges
+    return _merge(_range(item) for item in other)
+
+
+def _difference(ranges, other):
+    """Subtract the sorted, disjoint, ranges of other from ranges."""
+    result = []
+    j = 0
+    for first, last in ranges:
+        while j < len(other) and other[j][1] < first:
+            j += 1
+        k = j
+        while first <= last:
+            if k >= len(other) or other[k][0] > last:
+                result.append((first, last))
+                break
+            if other[k][0] > first:
+                result.append((first, other[k][0] - 1))
+            first = max(first, other[k][1] + 1)
+            k += 1
+    return result
 
 
@@ -18,30 +18,48 @@
 Managing logfile rotation. A ManagedLog object is a file-like object that
 rotates itself when a maximum size is reached.
 
+A BufferedLog is a ManagedLog that collects writes in memory, writing them
+out when enough have collected or some time has passed, and rotates the log
+files in a background thread.
+
 """
 
-import sys, os
+from __future__ import absolute_import
 
+import sys, os
+import time
+import gzip
+import shutil
+import atexit
+import weakref
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import io
 if sys.version_info.major == 3:
-    import io
     file = io.FileIO
 
 class SizeError(IOError):
     pass
 
 class LogFile(file):
-    """LogFile(name, [mode="w"], [maxsize=360000])
+    """LogFile(name, [mode="w"], [maxsize=360000], [autoflush=True])
     Opens a new file object. After writing <maxsize> bytes a SizeError will be
-    raised.  """
-    def __init__(self, name, mode="w", maxsize=360000):
+    raised. Each write is flushed unless autoflush is false. """
+    def __init__(self, name, mode="w", maxsize=360000, autoflush=True):
         super(LogFile, self).__init__(name, mode)
         self.maxsize = maxsize
+        self.autoflush = autoflush
         self.written = 0
 
     def write(self, data):
         self.written += len(data)
         super(LogFile, self).write(data)
-        self.flush()
+        if self.autoflush:
+            self.flush()
         if self.written > self.maxsize:
             raise SizeError
 
@@ -108,32 +126,257 @@ class ManagedStdio(ManagedLog):
             sys.stdout = sys.stderr = self
 
 
+class BufferedLog(ManagedLog):
+    """BufferedLog(name, [maxsize=360000], [maxsave=9], [bufsize=65536],
+                   [interval=1.0], [compress=False], [flusher=False])
+
+    A ManagedLog that collects written data in memory. The data is written
+    to the file when bufsize bytes have collected, or on a write interval
+    seconds after the last flush. Call check_flush() from a poll loop (for
+    example, register it with Poll.register_idle), or set flusher to have a
+    background thread do that, so that data does not wait for the next
+    write. The sync() method writes the data and waits for it to be on the
+    disk.
+
+    When the log is full it is renamed, and a new one opened. Saved logs are
+    shifted, and compressed with gzip if compress is set, by a background
+    thread. Call close() to write out the data and wait for that to finish.
+    """
+    def __init__(self, name, maxsize=360000, maxsave=9, bufsize=65536,
+            interval=1.0, compress=False, flusher=False):
+        self.maxsave = maxsave
+        self.bufsize = bufsize
+        self.interval = interval
+        self.suffix = ".gz" if compress else ""
+        self._buf = []
+        self._buffered = 0
+        self._lock = threading.RLock()
+        self._rotator = None
+        self._rotations = 0
+        self._lf = None
+        if os.path.isfile(name):
+            self._retire(name)
+        self._lf = LogFile(name, "w", maxsize, autoflush=False)
+        self._last_flush = time.time()
+        self._flusher = None
+        if flusher:
+            self._flusher = _Flusher(self)
+            self._flusher.start()
+        _buffered_logs.add(self)
+
+    def __repr__(self):
+        return "%s(%r, %r, %r, %r, %r)" % (self.__class__.__name__, self._lf.name,
+                self._lf.maxsize, self.maxsave, self.bufsize, self.interval)
+
+    def write(self, data):
+        with self._lock:
+            self._buf.append(data)
+            self._buffered += len(data)
+            if (self._buffered >= self.bufsize or
+                    time.time() - self._last_flush >= self.interval):
+                self._flush()
+
+    def writelines(self, lines):
+        with self._lock:
+            for line in lines:
+                self.write(line)
+
+    def note(self, text):
+        self.write("\n#*===== %s =====\n" % (text,))
+
+    def written(self):
+        return self._lf.written + self._buffered
+
+    def check_flush(self):
+        """Write out the buffered data if the interval has passed."""
+        if self._buf and time.time() - self._last_flush >= self.interval:
+            with self._lock:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def sync(self):
+        """Write out the buffered data and wait for it to reach the disk."""
+        with self._lock:
+            self._flush()
+            os.fsync(self._lf.fileno())
+
+    def _flush(self):
+        self._last_flush = time.time()
+        if not self._buf:
+            return
+        data = "".join(self._buf)
+        self._buf = []
+        self._buffered = 0
+        try:
+            self._lf.write(data)
+        except SizeError:
+            self._rotate()
+        else:
+            self._lf.flush()
+
+    def rotate(self):
+        with self._lock:
+            self._flush()
+            self._rotate()
+
+    def _rotate(self):
+        lf = self._lf
+        lf.close()
+        self._retire(lf.name)
+        self._lf = LogFile(lf.name, lf.mode, lf.maxsize, autoflush=False)
+        self._reopened()
+
+    def _reopened(self):
+        pass
+
+    def _retire(self, name):
+        # Only a rename is done here, the rest by the rotator thread.
+        self._rotations += 1
+        tempname = "%s.rotating.%d" % (name, self._rotations)
+        os.rename(name, tempname)
+        if self._rotator is None:
+            self._rotator = _Rotator()
+            self._rotator.start()
+        self._rotator.add(name, tempname, self.maxsave, self.suffix)
+
+    def close(self):
+        """Write out the buffered data, close the log, and wait for any
+        rotation to finish."""
+        with self._lock:
+            if self._flusher is not None:
+                self._flusher.stop()
+                self._flusher = None
+            self._flush()
+            self._lf.close()
+        if self._rotator is not None:
+            self._rotator.stop()
+            self._rotator = None
+        _buffered_logs.discard(self)
+
+
+class BufferedStdio(BufferedLog):
+    """A BufferedLog for logged stdout and stderr of daemon processes."""
+    def _reopened(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        fd = self._lf.fileno()
+        os.dup2(fd, 1)
+        os.dup2(fd, 2)
+        sys.stdout = sys.stderr = self
+
+
+class _Flusher(threading.Thread):
+    """Flushes a BufferedLog about every interval seconds."""
+    def __init__(self, log):
+        super(_Flusher, self).__init__(name="BufferedLog flusher")
+        self.daemon = True
+        self._log = weakref.ref(log)
+        self._interval = log.interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            log = self._log()
+            if log is None:
+                break
+            log.check_flush()
+            del log
+
+    def stop(self):
+        self._stopped.set()
+
+
+class _Rotator(threading.Thread):
+    """Shifts, and maybe compresses, rotated log files, in order."""
+    def __init__(self):
+        super(_Rotator, self).__init__(name="BufferedLog rotator")
+        self.daemon = True
+        self._queue = queue.Queue()
+
+    def add(self, basename, tempname, maxsave, suffix):
+        self._queue.put((basename, tempname, maxsave, suffix))
+
+    def run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    break
+                basename, tempname, maxsave, suffix = job
+                try:
+                    shiftsaved(basename, maxsave, suffix)
+                    savedname = "%s.1%s" % (basename, suffix)
+                    if suffix:
+                        compress(tempname, savedname)
+                    else:
+                        os.rename(tempname, savedname)
+                except Exception as err: # keep going for the other logs.
+                    sys.stderr.write("logfile: rotating %s: %s\n" % (basename, err))
+            finally:
+                self._queue.task_done()
+
+    def stop(self):
+        """Wait for the pending rotations, and end the thread."""
+        self._queue.put(None)
+        self.join()
+
+
+_buffered_logs = weakref.WeakSet()
+
+def _flush_buffered_logs():
+    for log in list(_buffered_logs):
+        try:
+            log.flush()
+        except (IOError, OSError, ValueError):
+            pass
+
+atexit.register(_flush_buffered_logs)
+
+
 def rotate(fileobj, maxsave=9):
     name = fileobj.name
     mode = fileobj.mode
     maxsize = fileobj.maxsize
+    autoflush = getattr(fileobj, "autoflush", True)
     fileobj.close()
     shiftlogs(name, maxsave)
-    return LogFile(name, mode, maxsize)
+    return LogFile(name, mode, maxsize, autoflush)
 
 
 # assumes basename logfile is closed.
 def shiftlogs(basename, maxsave):
-    topname = "%s.%d" % (basename, maxsave)
+    shiftsaved(basename, maxsave)
+    try:
+        os.rename(basename, "%s.1" % (basename))
+    except OSError:
+        pass
+
+
+def shiftsaved(basename, maxsave, suffix=""):
+    """Shift the saved logs, basename.1 to basename.2, and so on, dropping
+    the oldest. The suffix is added to the saved names (e.g. ".gz")."""
+    topname = "%s.%d%s" % (basename, maxsave, suffix)
     if os.path.isfile(topname):
         os.unlink(topname)
 
     for i in range(maxsave, 0, -1):
-        oldname = "%s.%d" % (basename, i)
-        newname = "%s.%d" % (basename, i+1)
+        oldname = "%s.%d%s" % (basename, i, suffix)
+        newname = "%s.%d%s" % (basename, i+1, suffix)
         try:
             os.rename(oldname, newname)
         except OSError:
             pass
-    try:
-        os.rename(basename, "%s.1" % (basename))
-    except OSError:
-        pass
+
+
+def compress(name, gzname):
+    """Compress file name to gzname, and remove name."""
+    with io.open(name, "rb") as src:
+        with gzip.open(gzname, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+    os.unlink(name)
 
 
 def open(name, maxsize=360000, maxsave=9):
@@ -19,7 +19,8 @@ Replacement logging module. The Java-inspired Python logging module is
 overkill, we just let syslog handle everything.
 
 The configuration file /etc/pycopia/logging.conf can set the default
-logging parameters.
+logging parameters. It is read, and syslog opened, when the first message is
+logged rather than at import time.
 """
 
 from __future__ import absolute_import
@@ -29,8 +30,6 @@ from __future__ import division
 import sys
 import syslog
 
-from pycopia import basicconfig
-
 
 # stderr functions
 
@@ -45,64 +44,77 @@ def DEBUG(*args, **kwargs):
         parts.append("{}: {!r}".format(name, value))
     print("DEBUG", " ".join(str(o) for o in args), ", ".join(parts), file=sys.stderr)
 
-# config file is optional here
-try:
-    cf = basicconfig.get_config("logging.conf")
-except basicconfig.ConfigReadError as err:
-    warn(err, "Using default values.")
-    FACILITY = "USER"
-    LEVEL = "WARNING"
-else:
-    FACILITY = cf.FACILITY
-    LEVEL = cf.LEVEL
-    del cf
-
-del basicconfig
-
-
-syslog.openlog(sys.argv[0].split("/")[-1], syslog.LOG_PID, getattr(syslog, "LOG_" + FACILITY))
-
-_oldloglevel = syslog.setlogmask(syslog.LOG_UPTO(getattr(syslog, "LOG_" + LEVEL)))
+# Reading the configuration and opening syslog is deferred until something is
+# actually logged, so merely importing this module is cheap.
+FACILITY = None
+LEVEL = None
+_oldloglevel = None
+_opened = False
+
+def _open():
+    global FACILITY, LEVEL, _oldloglevel, _opened
+    from pycopia import basicconfig
+    # config file is optional here
+    try:
+        cf = basicconfig.get_config("logging.conf")
+    except basicconfig.ConfigReadError as err:
+        warn(err, "Using default values.")
+        FACILITY = "USER"
+        LEVEL = "WARNING"
+    else:
+        FACILITY = cf.FACILITY
+        LEVEL = cf.LEVEL
+    syslog.openlog(sys.argv[0].split("/")[-1], syslog.LOG_PID, getattr(syslog, "LOG_" + FACILITY))
+    _oldloglevel = syslog.setlogmask(syslog.LOG_UPTO(getattr(syslog, "LOG_" + LEVEL)))
+    _opened = True
 
 def close():
-    syslog.closelog()
+    global _opened
+    if _opened:
+        syslog.closelog()
+        _opened = False
+
+def _log(priority, msg):
+    if not _opened:
+        _open()
+    syslog.syslog(priority, _encode(msg))
 
 
 def debug(msg):
-    syslog.syslog(syslog.LOG_DEBUG, _encode(msg))
+    _log(syslog.LOG_DEBUG, msg)
 
 def info(msg):
-    syslog.syslog(syslog.LOG_INFO, _encode(msg))
-
-def notice(msg):
-    syslog.syslog(syslog.LOG_NOTICE, _encode(msg))
+    _log(syslog.LOG_INFO, msg)
 
 def notice(msg):
-    syslog.syslog(syslog.LOG_NOTICE, _encode(msg))
+    _log(syslog.LOG_NOTICE, msg)
 
 def warning(msg):
-    syslog.syslog(syslog.LOG_WARNING, _encode(msg))
+    _log(syslog.LOG_WARNING, msg)
 
 def error(msg):
-    syslog.syslog(syslog.LOG_ERR, _encode(msg))
+    _log(syslog.LOG_ERR, msg)
 
 def critical(msg):
-    syslog.syslog(syslog.LOG_CRIT, _encode(msg))
+    _log(syslog.LOG_CRIT, msg)
 
 def alert(msg):
-    syslog.syslog(syslog.LOG_ALERT, _encode(msg))
+    _log(syslog.LOG_ALERT, msg)
 
 def emergency(msg):
-    syslog.syslog(syslog.LOG_EMERG, _encode(msg))
+    _log(syslog.LOG_EMERG, msg)
 
 ### set loglevels
 
 def loglevel(level):
     global _oldloglevel
+    if not _opened:
+        _open()
     _oldloglevel = syslog.setlogmask(syslog.LOG_UPTO(level))
 
 def loglevel_restore():
-    syslog.setlogmask(_oldloglevel)
+    if _oldloglevel is not None:
+        syslog.setlogmask(_oldloglevel)
 
 def loglevel_debug():
     loglevel(syslog.LOG_DEBUG)
@@ -167,6 +179,8 @@ class LogLevel(object):
         self._level = LEVELS[level.upper()]
 
     def __enter__(self):
+        if not _opened:
+            _open()
         self._oldloglevel = syslog.setlogmask(syslog.LOG_UPTO(self._level))
 
     def __exit__(self, extype, exvalue, traceback):
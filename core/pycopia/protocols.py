@@ -26,7 +26,7 @@ from __future__ import division
 import sys
 import re
 
-from pycopia.stringmatch import compile_exact
+from pycopia.stringmatch import compile_exact, compile_set
 from pycopia.aid import Enum
 
 
@@ -54,6 +54,7 @@ class StateMachine(object):
         self._exact_transitions = {}
         self._any_transitions = {}
         self._re_transitions = {}
+        self._re_matchers = {} # state -> PatternSet of _re_transitions
         self.default_transition = (transition_error, initial_state)
         self.initial_state = initial_state
         self.reset()
@@ -92,17 +93,19 @@ class StateMachine(object):
         except KeyError:
             pass
 
-        try:
-            rel =  self._re_transitions[state]
-            for cre, action, next in rel:
-                mo = cre.search(symbol)
-                if mo:
-                    self.current_state = next
-                    if action:
-                        action(mo)
-                    return
-        except KeyError:
-            pass
+        rel = self._re_transitions.get(state)
+        if rel:
+            matcher = self._re_matchers.get(state)
+            if matcher is None:
+                matcher = self._re_matchers[state] = compile_set([t[0] for t in rel])
+            found = matcher.search(symbol)
+            if found:
+                index, mo = found
+                cre, action, next = rel[index]
+                self.current_state = next
+                if action:
+                    action(mo)
+                return
 
         try:
             action, next =  self._any_transitions[state]
@@ -142,6 +145,7 @@ class StateMachine(object):
     def add_regex(self, expression, state, action, next_state,
             ignore_case=False, multiline=False):
         cre = re.compile(expression, _get_re_flags(ignore_case, multiline))
+        self._re_matchers.pop(state, None)
         try:
             rel = self._re_transitions[state]
             rel.append((cre, action, next_state))
@@ -20,19 +20,35 @@ this module "owns" SIGALRM, and all timing functions associated with it.
 This means that you should not use the stock time.sleep() function when
 using this module.  Instead, use get_scheduler().sleep(x) to sleep.
 
+The PollScheduler is an alternative for large numbers of events. It keeps
+absolute deadlines in a heap and runs the callbacks from the asyncio poll
+loop, driven by a timerfd. Call use_poll_scheduler() to make the module level
+add, repeat, and remove functions use it.
+
 """
 from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import division
 
 import signal
-from errno import EINTR
+from errno import EINTR, EAGAIN
+from heapq import heappush, heappop, heapify
 
 from pycopia import itimer
 alarm = itimer.alarm # allows subsecond precision using floats
 
+try:
+    from select import EPOLLIN
+    from pycopia.itimer import FDTimer, gettime, CLOCK_MONOTONIC
+except ImportError: # timerfd and epoll are Linux only
+    FDTimer = None
+
+
+__all__ = ["get_scheduler", "get_poll_scheduler"]
 
-__all__ = ["get_scheduler"]
+# timerfd_create flags.
+TFD_CLOEXEC = 0o2000000
+TFD_NONBLOCK = 0o4000
 
 # Save a function call by making a simple reference.
 sleep = itimer.nanosleep
@@ -260,6 +276,204 @@ timeout feature."""
         self._timed_out = 1
 
 
+class _PollEvent(_Event):
+    """An event in the PollScheduler heap. The deadline is an absolute
+    CLOCK_MONOTONIC time."""
+    def __init__(self, scheduler, delay, callback, args, kwargs, repeat):
+        super(_PollEvent, self).__init__(delay, callback, args, kwargs, repeat)
+        self.deadline = gettime(CLOCK_MONOTONIC) + delay
+        self.cancelled = False
+        self._scheduler = scheduler
+        self._sequence = None # of the live heap entry, if queued.
+
+    def __str__(self):
+        return "%s%r runs in %.3f seconds." % (self.callback.__name__, self.args,
+                self.deadline - gettime(CLOCK_MONOTONIC))
+
+    def __lt__(self, other):
+        return self.deadline < other.deadline
+
+    def __gt__(self, other):
+        return self.deadline > other.deadline
+
+    def stop(self):
+        self._scheduler.remove(self)
+
+
+def _dead(entry):
+    return entry[2].cancelled or entry[2]._sequence != entry[1]
+
+
+class PollScheduler(object):
+    """A PollScheduler runs callback functions from a Poll loop.
+
+    Deadlines are kept in a heap, so adding and removing events is
+    O(log n), and a timerfd registered in the poller wakes the loop when the
+    earliest one is due. Removed events are marked and dropped when they
+    reach the top of the heap. No signals are used, so callbacks may do any
+    work, but they only run while the poll loop does.
+
+    Blocking calls can only be interrupted by a signal, so timeout and
+    iotimeout use the SIGALRM scheduler.
+    """
+    def __init__(self, poller=None):
+        if FDTimer is None:
+            raise NotImplementedError("PollScheduler needs timerfd support.")
+        if poller is None:
+            from pycopia import asyncio
+            poller = asyncio.poller
+        self._poller = poller
+        self._heap = [] # entries are [deadline, sequence, event]
+        # An entry is dead if its event was removed, or queued again since.
+        self._sequence = 0 # keeps equal deadlines in FIFO order
+        self._cancelled = 0
+        self._timer = FDTimer(CLOCK_MONOTONIC, TFD_CLOEXEC | TFD_NONBLOCK)
+        self._registered = False
+
+    def __str__(self):
+        s = ["scheduled events:"]
+        for i, ev in enumerate(self.getevents()):
+            s.append("  %2d: %s" % (i, ev))
+        return "\n".join(s)
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled
+
+    def __nonzero__(self):
+        return len(self._heap) > self._cancelled
+    __bool__ = __nonzero__
+
+    def close(self):
+        if self._timer is not None:
+            self.clear()
+            self._timer.close()
+            self._timer = None
+
+    def add(self, delay, pri=0, callback=NULL, args=None, kwargs=None, repeat=False):
+        """add(delay, priority, callbackfunction, callbackargs, [repeatflag])
+Creates an Event object and adds it to the event queue. Returns the event
+object. The callback will be run with the supplied arguments, from the poll
+loop, after the elapsed interval. If the repeat flag is given the job is
+rescheduled indefinitely."""
+        assert delay > 0
+        event = _PollEvent(self, delay, callback, args or (), kwargs or {}, repeat)
+        self.add_event(event)
+        return event
+
+    def add_event(self, event):
+        if not event.cancelled and event._sequence is not None:
+            self._cancelled += 1 # already queued, that entry is now dead.
+        event.cancelled = False
+        self._push(event)
+        if self._heap[0][2] is event:
+            self._set_timer()
+
+    def _push(self, event):
+        self._sequence += 1
+        event._sequence = self._sequence
+        heappush(self._heap, [event.deadline, self._sequence, event])
+
+    def remove(self, event):
+        """remove(event)
+Removes the event from the event queue. The event is an Event object as
+returned by the add or getevents methods."""
+        if event.cancelled or event._sequence is None:
+            return
+        event.cancelled = True
+        self._cancelled += 1
+        # Compact when most of the heap is dead weight.
+        if self._cancelled > 64 and self._cancelled > len(self._heap) // 2:
+            self._heap = [entry for entry in self._heap if not _dead(entry)]
+            heapify(self._heap)
+            self._cancelled = 0
+        self._set_timer()
+
+    def clear(self):
+        for entry in self._heap:
+            entry[2].cancelled = True
+            entry[2]._sequence = None
+        self._heap = []
+        self._cancelled = 0
+        self._set_timer()
+
+    def getevents(self):
+        return [entry[2] for entry in sorted(self._heap) if not _dead(entry)]
+
+    def _set_timer(self):
+        heap = self._heap
+        while heap and _dead(heap[0]):
+            heappop(heap)
+            self._cancelled -= 1
+        if heap:
+            self._timer.settime(heap[0][0], 0.0, absolute=True)
+            if not self._registered:
+                self._poller.register_fd(self._timer.fileno(), EPOLLIN, self._timer_expired)
+                self._registered = True
+        else:
+            self._timer.settime(0.0, 0.0)
+            if self._registered:
+                self._poller.unregister_fd(self._timer.fileno())
+                self._registered = False
+
+    def _timer_expired(self):
+        try:
+            self._timer.read()
+        except OSError as err:
+            # itimer raises OSError((errno, strerror)), so errno is not set.
+            code = err.errno if err.errno is not None else err.args[0][0]
+            if code != EAGAIN: # timer was reset since the poll.
+                raise
+        self.run_pending()
+
+    def run_pending(self):
+        """Run all events that are due. Returns the number run."""
+        heap = self._heap
+        now = gettime(CLOCK_MONOTONIC)
+        count = 0
+        try:
+            while heap and heap[0][0] <= now:
+                entry = heappop(heap)
+                if _dead(entry):
+                    self._cancelled -= 1
+                    continue
+                deadline, seq, ev = entry
+                if ev.repeat:
+                    # Keep to the original period, unless we fell behind.
+                    ev.deadline = deadline + ev.interval
+                    if ev.deadline <= now:
+                        ev.deadline = now + ev.interval
+                    self._push(ev)
+                else:
+                    ev.cancelled = True # no longer queued
+                    ev._sequence = None
+                count += 1
+                ev()
+        finally:
+            self._set_timer()
+        return count
+
+    def sleep(self, delay):
+        """sleep(<secs>)
+Pause the current thread of execution for <secs> seconds, while running the
+poll loop so scheduled events and I/O handlers are serviced."""
+        end = gettime(CLOCK_MONOTONIC) + delay
+        while 1:
+            remaining = end - gettime(CLOCK_MONOTONIC)
+            if remaining <= 0.0:
+                break
+            self._poller.poll(remaining)
+
+    def timeout(self, function, args=(), kwargs={}, timeout=30):
+        """Wraps a normal thread of execution. Will raise TimeoutError when the
+timeout value is reached."""
+        return get_scheduler().timeout(function, args, kwargs, timeout)
+
+    def iotimeout(self, function, args=(), kwargs={}, timeout=30):
+        """Wraps an IO function that may block in the kernel. Provides a
+timeout feature."""
+        return get_scheduler().iotimeout(function, args, kwargs, timeout)
+
+
 # alarm schedulers are singleton instances. Only use this factory function to
 # get it.
 def get_scheduler():
@@ -275,6 +489,29 @@ def del_scheduler():
     scheduler.stop()
     del scheduler
 
+# The poll scheduler is also a singleton, using the asyncio module poller.
+def get_poll_scheduler():
+    global poll_scheduler
+    try:
+        return poll_scheduler
+    except NameError:
+        poll_scheduler = PollScheduler()
+        return poll_scheduler
+
+def del_poll_scheduler():
+    global poll_scheduler
+    poll_scheduler.close()
+    del poll_scheduler
+
+# The scheduler used by the module level add, repeat, and remove functions.
+_get_default = get_scheduler
+
+def use_poll_scheduler(flag=True):
+    """Make the module level add and repeat functions use the PollScheduler
+    (or the SIGALRM scheduler again, if flag is false)."""
+    global _get_default
+    _get_default = get_poll_scheduler if flag else get_scheduler
+
 
 def timeout(*args, **kwargs):
     return get_scheduler().timeout(*args, **kwargs)
@@ -283,15 +520,18 @@ def iotimeout(*args, **kwargs):
     return get_scheduler().iotimeout(*args, **kwargs)
 
 def add(delay, pri=0, callback=NULL, args=(), repeat=0):
-    return get_scheduler().add(delay, pri, callback, args, repeat)
+    return _get_default().add(delay, pri, callback, args, repeat=repeat)
 
 def remove(event):
     # scheduler must already exist if you have an event to remove.
-    scheduler.remove(event)
+    if isinstance(event, _PollEvent):
+        event.stop()
+    else:
+        scheduler.remove(event)
 
 def repeat(interval, method, *args):
-    s = get_scheduler()
-    return s.add(interval, 0, method, args, 1)
+    s = _get_default()
+    return s.add(interval, 0, method, args, repeat=1)
 
 
 if __name__ == "__main__":
@@ -27,6 +27,8 @@ keeping a consistent interface.
 from __future__ import print_function
 from __future__ import division
 
+import re
+
 
 
 class StringMatchObject(object):
@@ -139,12 +141,168 @@ def compile_exact(string, flags=0):
     return StringExpression(string, flags)
 
 
+# Constructs that can't be embedded in an alternation with other patterns.
+# Inline flags apply to the whole expression, and group references are
+# renumbered by the enclosing groups.
+_STANDALONE_RE = re.compile(r"\(\?[aiLmsux]+\)|\\[1-9]|\(\?P=|\(\?\(")
+_MAXGROUPS = 99
+
+
+def _match_at(so, text, pos, endpos):
+    if isinstance(so, StringExpression):
+        return text.startswith(so.pattern, pos, endpos)
+    return so.match(text, pos, endpos) is not None
+
+
+class _PatternGroup(object):
+    """A set of patterns with the same flags combined into one alternation.
+
+    The alternatives are not wrapped in capturing groups, since that defeats
+    the regular expression engine's scan for possible first characters. The
+    alternative that matched is found by trying the members at the match
+    position.
+    """
+    def __init__(self, flags):
+        self.flags = flags
+        self.members = [] # pattern indexes, in priority order
+        self._sources = []
+        self._names = set()
+        self._ngroups = 0
+        self._cre = None
+
+    def accept(self, so):
+        groupindex = getattr(so, "groupindex", {})
+        if self._ngroups + getattr(so, "groups", 0) > _MAXGROUPS:
+            return False
+        if self._names.intersection(groupindex):
+            return False
+        return True
+
+    def add(self, index, source, so):
+        self.members.append(index)
+        self._sources.append(source)
+        self._names.update(getattr(so, "groupindex", {}))
+        self._ngroups += getattr(so, "groups", 0)
+
+    def compile(self):
+        self._cre = re.compile("|".join(self._sources), self.flags)
+
+    def search(self, patterns, text, pos, endpos):
+        """Return the index of the highest priority member matching text, or
+        -1."""
+        mo = self._cre.search(text, pos, endpos)
+        if mo is None:
+            return -1
+        start = mo.start()
+        for best in self.members:
+            if _match_at(patterns[best], text, start, endpos):
+                break
+        # At the leftmost match position the alternation already tried the
+        # higher priority members, and they failed. They may still match
+        # further on.
+        start += 1
+        for index in self.members:
+            if index >= best:
+                break
+            if patterns[index].search(text, start, endpos):
+                return index
+        return best
+
+    def search_any(self, text, pos, endpos):
+        return self._cre.search(text, pos, endpos) is not None
+
+
+class _SinglePattern(object):
+    """A pattern that is searched for on its own."""
+    def __init__(self, index, so):
+        self.members = [index]
+        self._so = so
+
+    def compile(self):
+        pass
+
+    def search(self, patterns, text, pos, endpos):
+        if self._so.search(text, pos, endpos):
+            return self.members[0]
+        return -1
+
+    def search_any(self, text, pos, endpos):
+        return self._so.search(text, pos, endpos) is not None
+
+
+class PatternSet(object):
+    """Search for any of a list of patterns in one pass over the text.
+
+    The patterns are compiled pattern objects, either regular expressions or
+    StringExpression objects. They are combined into as few alternations as
+    their flags and group use permits. The search result is the same as
+    trying each pattern in list order, and taking the first that matches.
+    """
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._groups = []
+        open_groups = {}
+        for index, so in enumerate(self.patterns):
+            if isinstance(so, StringExpression):
+                source, flags = re.escape(so.pattern), 0
+            else:
+                source, flags = so.pattern, so.flags
+            if _STANDALONE_RE.search(source):
+                self._groups.append(_SinglePattern(index, so))
+                continue
+            group = open_groups.get(flags)
+            if group is None or not group.accept(so):
+                group = open_groups[flags] = _PatternGroup(flags)
+                self._groups.append(group)
+            group.add(index, source, so)
+        for group in self._groups:
+            group.compile()
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __repr__(self):
+        return "{0}({1!r})".format(self.__class__.__name__, self.patterns)
+
+    def search(self, text, pos=0, endpos=2147483647):
+        """Return a tuple of (index, match object) of the first pattern, in
+        list order, that matches the text. Return None if none match."""
+        best = -1
+        for group in self._groups: # ordered by first member
+            if best >= 0 and group.members[0] > best:
+                break
+            index = group.search(self.patterns, text, pos, endpos)
+            if index >= 0 and (best < 0 or index < best):
+                best = index
+        if best < 0:
+            return None
+        return best, self.patterns[best].search(text, pos, endpos)
+
+    def search_any(self, text, pos=0, endpos=2147483647):
+        """Return True if any pattern matches the text."""
+        for group in self._groups:
+            if group.search_any(text, pos, endpos):
+                return True
+        return False
+
+
+def compile_set(patterns):
+    """Combine a list of compiled patterns into a PatternSet."""
+    return PatternSet(patterns)
+
+
 def _test(argv):
     cs = compile_exact("me")
     mo = cs.search("matchme")
     assert mo is not None
     print(mo.span())
     assert mo.span() == (5,7)
+    ps = compile_set([re.compile(r"b\d"), compile_exact("a1"), re.compile(r"(\w)\1")])
+    index, mo = ps.search("xx a1 b2")
+    assert index == 0 and mo.group(0) == "b2"
+    index, mo = ps.search("xx a1 cc")
+    assert index == 1 and mo.group(0) == "a1"
+    assert ps.search("nothing") is None
 
 
 if __name__ == "__main__":
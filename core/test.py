@@ -24,6 +24,7 @@ from pycopia import environ
 from pycopia import ezmail
 from pycopia import fsm
 from pycopia import guid
+from pycopia import importtime
 from pycopia import interactive
 from pycopia import ipv4
 from pycopia import logfile
@@ -40,6 +41,8 @@ from pycopia import shparser
 from pycopia import table
 from pycopia import texttools
 from pycopia import passwd
+from pycopia import protocols
+from pycopia import stringmatch
 from pycopia import re_inverse
 
 if os.environ.get("DISPLAY"):
@@ -102,6 +105,132 @@ class CoreTests(unittest.TestCase):
         self.assertEqual(ip.mask, 0b11111111111111111111111111111100)
         self.assertEqual(ip.address, 0x01010101)
 
+    def test_basicconfig_cache(self):
+        import shutil, tempfile
+        tmpdir = tempfile.mkdtemp()
+        try:
+            name = os.path.join(tmpdir, "test.conf")
+            incname = os.path.join(tmpdir, "included.conf")
+            with open(name, "w") as fo:
+                fo.write("A = 1\ninclude(%r)\n" % (incname,))
+            with open(incname, "w") as fo:
+                fo.write("B = [1, 2]\n")
+            cf = basicconfig.get_config(name)
+            self.assertEqual((cf.A, cf.B), (1, [1, 2]))
+            self.assertTrue(os.path.isfile(name + basicconfig.COMPILED_SUFFIX))
+            self.assertTrue(os.path.isfile(incname + basicconfig.COMPILED_SUFFIX))
+            cf.B.append(3) # each config gets new objects.
+            self.assertEqual(basicconfig.get_config(name).B, [1, 2])
+            # A changed include is read again.
+            with open(incname, "w") as fo:
+                fo.write("B = [4, 5, 6]\n")
+            os.utime(incname, (time.time() + 10, time.time() + 10))
+            self.assertEqual(basicconfig.get_config(name).B, [4, 5, 6])
+            # A new process uses the compiled file.
+            basicconfig.clear_cache()
+            self.assertEqual(basicconfig.get_config(name, C=3).C, 3)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_basicconfig_cache_semantics(self):
+        import shutil, tempfile
+        tmpdir = tempfile.mkdtemp()
+        try:
+            name = os.path.join(tmpdir, "future.conf")
+            with open(name, "w") as fo:
+                fo.write("B = 1/2\nA = 'abc'\n")
+            uncached = basicconfig.get_config(name)
+            basicconfig.clear_cache()
+            cached = basicconfig.get_config(name) # from the compiled file.
+            for cf in (uncached, cached):
+                self.assertEqual(cf.B, 0.5)
+                self.assertTrue(isinstance(cf.A, type(u"")))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_importtime(self):
+        timer = importtime.time_imports(["pycopia.ringbuffer", "pycopia.ringbuffer"])
+        recs = timer.get_records()
+        self.assertEqual([rec.name for rec in recs], ["pycopia.ringbuffer"])
+        self.assertTrue(recs[0].cumulative >= recs[0].selftime > 0.0)
+        self.assertRaises(ImportError, importtime.time_imports, ["pycopia.nosuchmodule"])
+        self.assertTrue(__import__ is importtime.builtins.__import__)
+
+    def test_bufferedlog(self):
+        import gzip, shutil, tempfile
+        tmpdir = tempfile.mkdtemp()
+        try:
+            name = os.path.join(tmpdir, "buffered.log")
+            lf = logfile.BufferedLog(name, maxsize=500, maxsave=2, bufsize=300,
+                    interval=60.0, compress=True)
+            lf.write("first\n")
+            self.assertEqual(os.path.getsize(name), 0) # still buffered
+            lf.flush()
+            self.assertEqual(os.path.getsize(name), 6)
+            for i in range(100):
+                lf.write("line %02d of the log\n" % (i,)) # 19 bytes
+            lf.close()
+            self.assertEqual(sorted(os.listdir(tmpdir)),
+                    ["buffered.log", "buffered.log.1.gz", "buffered.log.2.gz"])
+            saved = [gzip.open(os.path.join(tmpdir, "buffered.log.%d.gz" % i)).read()
+                     for i in (2, 1)]
+            content = "".join(saved) + open(name).read()
+            # The oldest log, with the first 32 lines, was dropped.
+            self.assertTrue(content.startswith("line 32 of the log\n"))
+            self.assertTrue(content.endswith("line 99 of the log\n"))
+            self.assertEqual(len(content), 68 * 19)
+            # writelines is buffered, in order with write.
+            name = os.path.join(tmpdir, "lines.log")
+            lf = logfile.BufferedLog(name, bufsize=300, interval=60.0)
+            lf.write("one\n")
+            lf.writelines(["two\n", "three\n"])
+            self.assertEqual(os.path.getsize(name), 0)
+            lf.close()
+            self.assertEqual(open(name).read(), "one\ntwo\nthree\n")
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_ipv4_network_table(self):
+        table = ipv4.NetworkTable(["10.0.0.0/8", "10.1.0.0/16", "192.168.1.0/24"])
+        table["10.1.1.0/24"] = "lab"
+        self.assertEqual(len(table), 4)
+        self.assertEqual(table.match("10.1.1.5").CIDR, "10.1.1.0/24")
+        self.assertEqual(table.match("10.2.0.1").CIDR, "10.0.0.0/8")
+        self.assertEqual(table.match("11.0.0.1"), None)
+        self.assertEqual(table.lookup("10.1.1.5"), "lab")
+        self.assertEqual([n.CIDR for n in table.supernets("10.1.1.0/24")],
+                ["10.0.0.0/8", "10.1.0.0/16"])
+        self.assertEqual([n.CIDR for n in table.subnets("10.0.0.0/8")],
+                ["10.1.0.0/16", "10.1.1.0/24"])
+        del table["10.1.0.0/16"]
+        self.assertFalse("10.1.0.0/16" in table)
+        self.assertEqual([n.CIDR for n in table],
+                ["10.0.0.0/8", "10.1.1.0/24", "192.168.1.0/24"])
+        nets = [ipv4.IPv4(n) for n in table]
+        self.assertEqual(ipv4.findnet("10.1.1.7", nets).CIDR, "10.1.1.0/24")
+        self.assertEqual(ipv4.sortnets(nets)[-1].CIDR, "10.0.0.0/8")
+
+    def test_ipv4_address_set(self):
+        s1 = ipv4.IPAddressSet(["10.0.0.0/24", "10.0.1.0/24", ("10.0.3.5", "10.0.3.1")])
+        self.assertEqual(len(s1), 517)
+        self.assertEqual([n.CIDR for n in s1.networks()][:2], ["10.0.0.0/23", "10.0.3.1/32"])
+        self.assertTrue("10.0.1.7/32" in s1)
+        self.assertTrue("10.0.1.0/24" in s1)
+        self.assertFalse("10.0.2.0/32" in s1)
+        s2 = ipv4.IPAddressSet(["10.0.0.128/25", "10.0.3.0/30"])
+        self.assertEqual(str(s1 & s2), "10.0.0.128/25, 10.0.3.1/32, 10.0.3.2/31")
+        self.assertEqual(str(s1 - s2), "10.0.0.0/25, 10.0.1.0/24, 10.0.3.4/31")
+        self.assertEqual(str(s1 | s2), "10.0.0.0/23, 10.0.3.0/30, 10.0.3.4/31")
+        self.assertEqual(s1 ^ s2, (s1 | s2) - (s1 & s2))
+        s1.discard("10.0.0.0/23")
+        self.assertEqual(len(list(s1)), 5)
+        # An address without a mask is one address, not its class network.
+        s3 = ipv4.IPAddressSet(["10.0.0.0/24", "192.168.1.7"])
+        self.assertTrue("10.0.0.5" in s3)
+        self.assertFalse("10.0.1.5" in s3)
+        self.assertEqual(len(s3), 257)
+        self.assertEqual(str(s3), "10.0.0.0/24, 192.168.1.7/32")
+
     def test_passwd(argv):
         pwent = passwd.getpwself()
         print(repr(pwent))
@@ -132,6 +261,250 @@ class CoreTests(unittest.TestCase):
         for i in range(20):
             ms = re_inverse.make_nonmatch_string(RE)
 
+    def test_patternset(self):
+        import re
+        pats = [re.compile(r"b\d"), stringmatch.compile_exact("a1"), re.compile(r"(\w)\1")]
+        ps = stringmatch.compile_set(pats)
+        index, mo = ps.search("xx a1 b2")
+        self.assertEqual(index, 0)
+        self.assertEqual(mo.group(0), "b2")
+        index, mo = ps.search("xx a1 cc")
+        self.assertEqual(index, 1)
+        self.assertEqual(ps.search("zz")[0], 2)
+        self.assertTrue(ps.search("nothing") is None)
+
+    def test_statemachine_regex(self):
+        matched = []
+        sm = protocols.StateMachine()
+        sm.add_regex(r"error (\d+)", sm.RESET, lambda mo: matched.append(mo.group(1)), 1)
+        sm.add_regex(r"\d+", sm.RESET, lambda mo: matched.append("number"), 2)
+        sm.step("got 42 then error 7")
+        self.assertEqual(sm.current_state, 1)
+        self.assertEqual(matched, ["7"])
+        sm.add_regex(r"warning", 1, None, sm.RESET)
+        sm.step("warning 3")
+        self.assertEqual(sm.current_state, sm.RESET)
+
+    def test_poll_scheduler(self):
+        poll = asyncio.Poll()
+        sched = scheduler.PollScheduler(poll)
+        fired = []
+        events = [sched.add(0.01 * (i % 5 + 1), callback=fired.append, args=(i,))
+                for i in range(100)]
+        for ev in events[::2]:
+            sched.remove(ev)
+        self.assertEqual(len(sched), 50)
+        while sched:
+            poll.poll(1.0)
+        self.assertEqual(sorted(fired), list(range(1, 100, 2)))
+        self.assertEqual(fired[:10], [i for i in range(1, 100, 2) if i % 5 == 0])
+        self.assertFalse(poll.smap)
+        sched.close()
+
+    def test_poll_scheduler_reset(self):
+        poll = asyncio.Poll()
+        scheds = [scheduler.PollScheduler(poll), scheduler.PollScheduler(poll)]
+        fired = []
+        def stop_other(i):
+            fired.append(i)
+            events[1 - i].stop() # disarms the other timer, maybe already polled.
+        events = [sched.add(0.05, callback=stop_other, args=(i,)) for i, sched in enumerate(scheds)]
+        later = [sched.add(10.0, callback=fired.append, args=("later",)) for sched in scheds]
+        time.sleep(0.1) # both timers are readable in the same poll.
+        poll.poll(1.0)
+        self.assertEqual(len(fired), 1)
+        for ev in later:
+            ev.stop()
+        # Re-adding a removed event that is still in the heap queues it once.
+        sched = scheds[0]
+        ev = sched.add(0.01, callback=fired.append, args=("again",))
+        sched.remove(ev)
+        sched.add_event(ev)
+        sched.add_event(ev)
+        self.assertEqual(len(sched), 1)
+        while sched:
+            poll.poll(1.0)
+        self.assertEqual(fired[1:], ["again"])
+        for sched in scheds:
+            sched.close()
+        poll.close()
+
+    def test_poll_edge_budget(self):
+        import socket
+
+        class Reader(asyncio.PollerInterface):
+            def __init__(self, sock, got):
+                self._sock = sock
+                self._got = got
+            def fileno(self):
+                return self._sock.fileno()
+            def readable(self):
+                return True
+            def read_handler(self):
+                self._got.append(self._sock.recv(1))
+
+        poll = asyncio.Poll(edge_triggered=True, budget=1, stats=True)
+        got = []
+        pairs = [socket.socketpair() for i in range(3)]
+        for rs, ws in pairs:
+            poll.register(Reader(rs, got))
+            ws.send(b"ab")
+        poll.poll(1.0)
+        self.assertEqual(len(got), 1)
+        poll.poll(1.0)
+        poll.poll(1.0)
+        self.assertEqual(len(got), 3) # one byte each, the rest needs draining.
+        self.assertEqual(poll.stats.dispatched, 3)
+        self.assertEqual(poll.stats.deferred, 3) # 2, then 1.
+        poll.poll(0.1) # edge-triggered: no new data, no new events.
+        self.assertEqual(len(got), 3)
+        poll.clear()
+
+        class Writer(Reader):
+            def readable(self):
+                return False
+            def writable(self):
+                return True
+            def read_handler(self):
+                self._got.append("stale")
+            def write_handler(self):
+                self._got.append("write")
+
+        del got[:]
+        readers = [Reader(rs, got) for rs, ws in pairs]
+        for reader in readers:
+            poll.register(reader)
+        poll.poll(1.0)
+        fd = poll._pending[0][0]
+        reader = [r for r in readers if r.fileno() == fd][0]
+        poll.unregister(reader) # its deferred event must go with it.
+        poll.register(Writer(reader._sock, got))
+        while len(got) < 3:
+            poll.poll(1.0)
+        self.assertNotIn("stale", got)
+        self.assertIn("write", got)
+        poll.clear()
+        poll.close()
+        for rs, ws in pairs:
+            rs.close()
+            ws.close()
+
+    def test_coroutines(self):
+        import socket
+
+        def echo(sock):
+            yield asyncio.wait_readable(sock)
+            data = sock.recv(100)
+            yield asyncio.sleep(0.01)
+            sock.send(data.upper())
+
+        def client(sock, msg):
+            sock.send(msg)
+            yield asyncio.wait_readable(sock)
+            raise asyncio.Return(sock.recv(100))
+
+        pairs = [socket.socketpair() for i in range(20)]
+        for csock, ssock in pairs:
+            asyncio.spawn(echo(ssock))
+        results = asyncio.run(asyncio.gather(
+                *[client(csock, b"m%d" % i) for i, (csock, ssock) in enumerate(pairs)]),
+                timeout=5.0)
+        self.assertEqual(results, [b"M%d" % i for i in range(20)])
+        waiting = asyncio.spawn(client(pairs[0][0], b"x"))
+        self.assertRaises(asyncio.TimeoutError, asyncio.run, waiting, 0.05)
+        asyncio.get_event_loop().run_once(0.0) # let the cancellation go through.
+        self.assertTrue(waiting.cancelled())
+        self.assertFalse(asyncio.poller.smap)
+        for csock, ssock in pairs:
+            csock.close()
+            ssock.close()
+
+    def test_fcgi_prefork(self):
+        import signal
+        import socket
+        import struct
+        path = "/tmp/test_fcgi_prefork.sock"
+
+        def app(environ, start_response):
+            body = "%s %s %s" % (environ["PATH_INFO"], environ["wsgi.input"].read(), os.getpid())
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return [body]
+
+        def begin(sock, reqid, path, stdin):
+            rec = fcgi.Record(fcgi.FCGI_BEGIN_REQUEST, reqid)
+            rec.contentData = struct.pack(fcgi.FCGI_BeginRequestBody,
+                    fcgi.FCGI_RESPONDER, fcgi.FCGI_KEEP_CONN)
+            rec.contentLength = len(rec.contentData)
+            rec.write(sock)
+            params = "".join(fcgi.encode_pair(name, value) for name, value in (
+                    ("PATH_INFO", path), ("REQUEST_METHOD", "POST"),
+                    ("SERVER_NAME", "localhost"), ("SERVER_PORT", "80"),
+                    ("SERVER_PROTOCOL", "HTTP/1.1")))
+            records = [(fcgi.FCGI_PARAMS, params), (fcgi.FCGI_PARAMS, "")]
+            if stdin:
+                records.append((fcgi.FCGI_STDIN, stdin))
+            records.append((fcgi.FCGI_STDIN, ""))
+            for rtype, data in records:
+                rec = fcgi.Record(rtype, reqid)
+                rec.contentData = data
+                rec.contentLength = len(data)
+                rec.write(sock)
+
+        def responses(sock, count):
+            out = {}
+            ended = 0
+            while ended < count:
+                rec = fcgi.Record()
+                rec.read(sock)
+                if rec.type == fcgi.FCGI_STDOUT:
+                    out[rec.requestId] = out.get(rec.requestId, "") + rec.contentData
+                elif rec.type == fcgi.FCGI_END_REQUEST:
+                    ended += 1
+            return dict((reqid, text.split("\r\n\r\n", 1)[1]) for reqid, text in out.items())
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server = fcgi.PreforkFCGIServer(app, workers=2, maxrequests=5,
+                        statuspath="/status", bindAddress=path)
+                server.run(timeout=0.1)
+            finally:
+                os._exit(0)
+        try:
+            time.sleep(0.5)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(5.0)
+            sock.connect(path)
+            # Requests interleaved on one connection.
+            begin(sock, 1, "/one", "")
+            begin(sock, 2, "/two", "data")
+            out = responses(sock, 2)
+            self.assertEqual(out[1].split()[0], "/one")
+            self.assertEqual(out[2].split()[:2], ["/two", "data"])
+            begin(sock, 1, "/status", "")
+            status = responses(sock, 1)[1].splitlines()
+            self.assertEqual(len(status), 3) # header and two workers
+            self.assertTrue(any(line.split()[2] == "2" for line in status[1:]))
+            # The fifth request recycles the worker.
+            worker = out[1].split()[1]
+            for i in range(2):
+                begin(sock, 1, "/again", "")
+                self.assertEqual(responses(sock, 1)[1].split()[1], worker)
+            sock.close()
+            time.sleep(0.5)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(5.0)
+            sock.connect(path)
+            begin(sock, 1, "/status", "")
+            status = responses(sock, 1)[1].splitlines()
+            sock.close()
+            self.assertEqual(len(status), 3)
+            self.assertFalse(any(line.split()[0] == worker for line in status[1:]))
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        self.assertFalse(os.path.exists(path))
+
     def test_sequencer(self):
         counters = [0, 0, 0, 0, 0]
         starttimes = [None, None, None, None, None]
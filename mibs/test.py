@@ -14,6 +14,22 @@ class MibsTests(unittest.TestCase):
     def test_import(self):
         self.assertEqual(pycopia.SMI.OIDMAP['1.3.6.1.1'].OID, [1,3,6,1,1])
 
+    def test_oidtree(self):
+        tree = pycopia.SMI.OIDTREE
+        self.assertEqual(len(tree), len(pycopia.SMI.OIDMAP))
+        for soid, obj in pycopia.SMI.OIDMAP.items():
+            self.assertTrue(tree[[int(s) for s in soid.split(".")]] is obj)
+        sysDescr = SNMPv2_MIB.sysDescr
+        self.assertTrue(tree.longest_prefix(sysDescr.OID + [0]) is sysDescr)
+        self.assertTrue(tree.longest_prefix([1,3,6,1,2,1,1,1,99,5]) is sysDescr)
+        self.assertTrue(tree.longest_prefix([1,3,6,1,2,1,1,1,0], 10) is None)
+        self.assertTrue(tree.longest_prefix([1,3,6,1,4,1,99999]) is SNMPv2_SMI.enterprises)
+        self.assertTrue(tree.get([1,3,6,1,2,1,1,1,0]) is None)
+        oids = [oid for oid, obj in tree.items([1,3,6,1,2,1,1])]
+        self.assertEqual(oids, sorted(oids))
+        self.assertEqual(oids[0], [1,3,6,1,2,1,1])
+        self.assertTrue([1,3,6,1,2,1,1,9,1,2] in oids)
+
 
 if __name__ == '__main__':
     unittest.main()
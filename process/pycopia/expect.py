@@ -27,10 +27,12 @@ interacting with processes.
 
 import sys, os
 import re
+import sre_parse
+import sre_constants
 from errno import EINTR
 
 from pycopia import scheduler
-from pycopia.stringmatch import compile_exact
+from pycopia.stringmatch import compile_exact, compile_set, StringExpression
 
 if sys.version_info.major == 3:
     basestring = str
@@ -40,6 +42,13 @@ EXACT = 1 # string match (fastest)
 GLOB = 2 # POSIX shell style match, but really uses regular expressions
 REGEX = 3 # slow but powerful RE match
 
+# Patterns with these constructs may stop matching when more text arrives, so
+# the search engine must check each new end position separately.
+_UNSTABLE_RE = re.compile(r"\$|\\[ZbB]|\(\?!|\(\?=|\(\?<")
+
+# Lookahead and lookbehind text is not counted in the pattern width, so these
+# must be searched from the start of the buffer.
+_LOOKAROUND_RE = re.compile(r"\(\?<?[=!]")
 
 
 class ExpectError(Exception):
@@ -82,6 +91,7 @@ The wrapped object need only implement the following methods:
         self.cmd_interp = None
         self._prompt = prompt.encode()
         self._patt_cache = {}
+        self._set_cache = {}
         self._buf = ''
         self.eof = 0
         self.sched = scheduler.get_scheduler()
@@ -89,6 +99,9 @@ The wrapped object need only implement the following methods:
         self.expectindex = -1 # if a match on a list occurs, the index in the list
                               # search on the last 'expect' method call is saved here.
 
+    # Amount read from the wrapped object per system call when searching.
+    blocksize = 4096
+
     def fileobject(self):
         return self._fo
 
@@ -201,21 +214,50 @@ delegates this to the wrapped Process object. Otherwise, does nothing."""
         solist = self._get_search_list(patt, mtype, callback)
         if not solist:
             raise ExpectError("Empty expect search.")
-        buf = bytes()
+        searchers = list(enumerate(_Searcher(so, cb) for so, cb in solist))
+        unstable = [t for t in searchers if not t[1].stable]
+        prefilter = self._get_prefilter([t[1] for t in searchers if t[1].stable])
+        buf, self._buf = self._buf, b""
+        scanned = 0
         while 1:
-            c = self.read(1, timeout)
+            if len(buf) > scanned:
+                # One pass with the combined patterns rules out most blocks.
+                if prefilter is None or prefilter.search_any(buf,
+                        min(t[1].startpos(scanned + 1) for t in searchers)):
+                    candidates = searchers
+                else:
+                    candidates = unstable
+                best = None
+                for i, searcher in candidates:
+                    end = searcher.first_end(buf, scanned)
+                    if end is not None and (best is None or end < best[0]):
+                        best = (end, i, searcher)
+                        if end == scanned + 1: # can't do better than that.
+                            break
+                if best is not None:
+                    end, i, searcher = best
+                    self._buf = buf[end:] # unconsumed tail goes back to the stream.
+                    mo = searcher.so.search(buf[:end])
+                    self.expectindex = i # save the list index of the match object
+                    if searcher.callback:
+                        searcher.callback(mo)
+                    return mo
+                scanned = len(buf)
+            self.expectindex = -1
+            c = self._read_block(timeout)
             if not c:
                 raise ExpectError("EOF during expect.")
             buf += c
-            self.expectindex = i = -1
-            for so, cb in solist:
-                mo = so.search(buf)
-                if mo:
-                    self.expectindex = i+1 # save the list index of the match object
-                    if cb:
-                        cb(mo)
-                    return mo
-                i += 1
+
+    def _get_prefilter(self, searchers):
+        if len(searchers) < 2:
+            return None
+        key = tuple(s.so for s in searchers)
+        try:
+            return self._set_cache[key]
+        except KeyError:
+            ps = self._set_cache[key] = compile_set(key)
+            return ps
 
     def expect_exact(self, patt, callback=None, timeout=None):
         return self.expect(patt, EXACT, callback, timeout)
@@ -227,13 +269,36 @@ delegates this to the wrapped Process object. Otherwise, does nothing."""
         return self.expect(patt, REGEX, callback, timeout)
 
     def read(self, amt=-1, timeout=None):
+        if self._buf:
+            if amt < 0:
+                data, self._buf = self._buf, b""
+                return data + self._read(self._fo.read, amt, timeout)
+            data = self._buf[:amt]
+            self._buf = self._buf[amt:]
+            return data
+        return self._read(self._fo.read, amt, timeout)
+
+    def _read_block(self, timeout=None):
+        """Read whatever is available, up to blocksize, from the buffer or the
+        wrapped object. Objects without a read_some method are read one byte
+        at a time, since their read may block until all bytes arrive.
+        """
+        if self._buf:
+            data, self._buf = self._buf, b""
+            return data
+        reader = getattr(self._fo, "read_some", None)
+        if reader is None:
+            return self._read(self._fo.read, 1, timeout)
+        return self._read(reader, self.blocksize, timeout)
+
+    def _read(self, reader, amt, timeout):
         self._timed_out = 0
         timeout=timeout or self.default_timeout
         ev = self.sched.add(timeout, 0, self._timeout_cb, ())
         try:
             while 1:
                 try:
-                    data = self._fo.read(amt)
+                    data = reader(amt)
                 except EnvironmentError as val:
                     if val.errno == EINTR:
                         if self._timed_out == 1:
@@ -255,18 +320,26 @@ delegates this to the wrapped Process object. Otherwise, does nothing."""
     def _timeout_cb(self):
         self._timed_out = 1
 
+    def unread(self, data):
+        """Push data back onto the input, to be read again by the next read
+        or expect."""
+        self._buf = data + self._buf
+
     def read_until(self, patt=None, timeout=None):
         if patt is None:
             patt = self._prompt
-        buf = ""
+        buf, self._buf = self._buf, b""
+        start = 0
         while 1:
-            c = self.read(1, timeout)
+            i = buf.find(patt, start)
+            if i >= 0:
+                self._buf = buf[i+len(patt):]
+                return buf[:i]
+            start = max(0, len(buf) - len(patt) + 1)
+            c = self._read_block(timeout)
             if c == "":
                 raise ExpectError("EOF during read_until({!r}).".format(patt))
             buf += c
-            i = buf.find(patt)
-            if i >= 0:
-                return buf[:i]
 
     def readline(self, timeout=None):
         return self.read_until("\n", timeout)
@@ -330,6 +403,10 @@ through a filter function.  """
             self._fo.restart(1)
         except AttributeError:
             pass
+        if self._buf: # already read, but not consumed by an expect.
+            sys.stdout.write(self._buf)
+            sys.stdout.flush()
+            self._buf = b""
         while 1:
             try:
                 rfd, wfd, xfd = select.select([fo_fd, stdin_fd], [], [])
@@ -383,6 +460,7 @@ through a filter function.  """
     def clear_cache(self):
         """Clears the pattern cache."""
         self._patt_cache.clear()
+        self._set_cache.clear()
 
     # write methods
     def write(self, data):
@@ -442,6 +520,61 @@ through a filter function.  """
                     break
 
 
+class _Searcher(object):
+    """Incremental search state for one compiled pattern of an expect list.
+
+    The expect buffer only grows, so a pattern that could not be found before
+    only needs to be searched for again in the region that new data can
+    affect. For exact strings and regular expressions with a bounded match
+    width that is the previously scanned tail, less the pattern width. Others
+    are searched from the start of the buffer.
+    """
+    __slots__ = ("so", "callback", "minwidth", "width", "stable")
+
+    def __init__(self, so, callback):
+        self.so = so
+        self.callback = callback
+        patt = so.pattern
+        if isinstance(so, StringExpression):
+            self.minwidth = self.width = len(patt)
+            self.stable = True
+        else:
+            self.minwidth, self.width = sre_parse.parse(patt, so.flags).getwidth()
+            if self.width >= sre_constants.MAXREPEAT or _LOOKAROUND_RE.search(patt):
+                self.width = None
+            self.stable = _UNSTABLE_RE.search(patt) is None
+
+    def startpos(self, end):
+        if self.width is None:
+            return 0
+        return max(0, end - self.width)
+
+    def first_end(self, buf, scanned):
+        """Return the smallest end position, after scanned, of a buffer prefix
+        that this pattern matches. That is where the byte-at-a-time search
+        would have stopped.  Return None if there is no match.
+        """
+        so = self.so
+        if not self.stable:
+            for end in range(scanned + 1, len(buf) + 1):
+                if so.search(buf, self.startpos(end), end):
+                    return end
+            return None
+        mo = so.search(buf, self.startpos(scanned + 1))
+        if mo is None:
+            return None
+        if self.minwidth == self.width: # leftmost match is also the first one.
+            return mo.end()
+        lo, hi = scanned + 1, mo.end()
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if so.search(buf, self.startpos(mid), mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+
 # swiped from the fnmatch module for efficiency
 def glob_translate(pat):
     """Translate a shell (glob style) pattern to a regular expression.
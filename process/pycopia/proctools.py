@@ -249,6 +249,15 @@ ProcManager uses this."""
         self._buf = self._buf[amt:]
         return data
 
+    def read_some(self, amt=4096):
+        """Read what is available, up to amt. Only blocks if nothing is
+        buffered or ready."""
+        if self._buf:
+            data = self._buf[:amt]
+            self._buf = self._buf[amt:]
+            return data
+        return self._read(amt)
+
     def readerr(self, amt=2147483646):
         if amt < 0:
             amt = 2147483646
@@ -43,6 +43,21 @@ def _co_function():
     scheduler.sleep(5)
     return None
 
+class _Chunks(object):
+    """File-like object that returns the given chunks, one per read."""
+    def __init__(self, chunks):
+        self._chunks = list(chunks)
+    def read_some(self, amt):
+        return self._chunks.pop(0) if self._chunks else ""
+    read = read_some
+    def write(self, data):
+        return len(data)
+    def fileno(self):
+        return -1
+    def close(self):
+        pass
+
+
 class ProcessTests(unittest.TestCase):
     def setUp(self):
         pass
@@ -94,6 +109,30 @@ class ProcessTests(unittest.TestCase):
         es = sub.wait()
         self.assertTrue(es)
 
+    def test_expect(self):
+        proc = proctools.spawnpipe("sh -c 'seq 1 5000; echo login: ; echo rest'")
+        exp = expect.Expect(proc, prompt="\n")
+        mo = exp.expect(["Password:", ("4999\\s", expect.REGEX), "login:"])
+        self.assertEqual(exp.expectindex, 1)
+        self.assertEqual(mo.group(0), "4999\n")
+        exp.expect("login:")
+        self.assertEqual(exp.read_until("rest"), "\n")
+        exp.close()
+        proc.wait()
+
+    def test_expect_lookaround(self):
+        exp = expect.Expect(_Chunks(["a", "1\n"]))
+        mo = exp.expect("a(?=1)", expect.REGEX)
+        self.assertEqual(mo.start(), 0)
+        exp = expect.Expect(_Chunks(["xxfoobar"]))
+        mo = exp.expect(["nomatch", ("foo(?=bar)", expect.REGEX)])
+        self.assertEqual(exp.expectindex, 1)
+        self.assertEqual(mo.span(), (2, 5))
+        exp = expect.Expect(_Chunks(["xxfoo", "bar!"]))
+        mo = exp.expect("(?<=foo)bar", expect.REGEX)
+        self.assertEqual(mo.span(), (5, 8))
+        self.assertEqual(exp.read_until("!"), "")
+
     def XXXtest_sudo(self):
         pw = sudo.getpw()
         proc = sudo.sudo("/bin/ifconfig -a", password=pw)
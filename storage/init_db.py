@@ -560,13 +560,17 @@ def do_config(session):
     session.commit()
 
 
-def init_database(argv):
+def _get_url(argv):
     try:
-        url = argv[1]
+        return argv[1]
     except IndexError:
         from pycopia import basicconfig
         cf = basicconfig.get_config("database.conf")
-        url = cf["DATABASE_URL"]
+        return cf["DATABASE_URL"]
+
+
+def init_database(argv):
+    url = _get_url(argv)
     create_db(url)
 
     db = create_engine(unicode(url))
@@ -598,6 +602,18 @@ def init_database(argv):
 
 
 
+def upgrade_database(argv):
+    """Add the schema objects that newer code needs to an existing database."""
+    url = _get_url(argv)
+    db = create_engine(unicode(url))
+    # Versions the config tree, for config snapshots.
+    tables.config_version.create(db, checkfirst=True)
+    db.dispose()
+
+
 if __name__ == "__main__":
-    init_database(sys.argv)
+    if len(sys.argv) > 1 and sys.argv[1] == "upgrade":
+        upgrade_database(sys.argv[1:])
+    else:
+        init_database(sys.argv)
 
@@ -34,7 +34,22 @@ by the same user. If a user with flag superuser creates a new container it is
 not owned by anybody (set the ownership as a separate operation). A superuser can
 see all containers, but non-superuser users only see their own containers.  New
 containers created without a registered user inherit ownership from parent
-node.
+node. New values are owned the same way.
+
+A container can also be used as a snapshot. The snapshot method loads the
+container's whole subtree with one query, and the returned container, and
+the containers got from it, are then served from memory. Writes are kept
+until the commit method is called, or the snapshot is used as a context
+manager and the block exits without an error:
+
+    with cf.snapshot() as snap:
+        snap.expand("$logdir/$name")
+        snap["last_run"] = now
+
+Each change to the config tree advances a version counter. A snapshot
+checks it from time to time, and reloads itself if it is stale. Databases
+without the counter (created before it) must be reloaded explicitly, until
+they are upgraded with "init_db.py upgrade".
 
 """
 from __future__ import absolute_import
@@ -43,12 +58,15 @@ from __future__ import unicode_literals
 from __future__ import division
 
 import re
+import time
+import weakref
 
-from sqlalchemy import and_
+from sqlalchemy import and_, select, text
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 
 from pycopia.db import models
+from pycopia.db import tables
 # The NULL value is used to flag a container node.
 from pycopia.aid import NULL
 
@@ -65,54 +83,274 @@ def get_root(session):
     return c
 
 
+# Databases created before the config version sequence existed work without
+# versioning until they are upgraded (see init_db.py). Checked once per engine.
+_VERSIONED = weakref.WeakKeyDictionary()
+
+def has_versioning(session):
+    """Return True if the database has the config version sequence."""
+    bind = session.get_bind()
+    engine = getattr(bind, "engine", bind)
+    try:
+        return _VERSIONED[engine]
+    except KeyError:
+        pass
+    seq = tables.config_version
+    dialect = engine.dialect
+    versioned = bool(dialect.supports_sequences and
+            dialect.has_sequence(session.connection(), seq.name, schema=seq.schema))
+    _VERSIONED[engine] = versioned
+    return versioned
+
+def get_version(session):
+    """Return the current version of the config tree, or None if the
+    database does not keep one."""
+    if not has_versioning(session):
+        return None
+    return session.execute(_version_query(session.get_bind().dialect)).scalar()
+
+def _version_query(dialect):
+    # Reads the sequence without advancing it (PostgreSQL).
+    name = dialect.identifier_preparer.format_sequence(tables.config_version)
+    return text("SELECT last_value FROM %s" % (name,))
+
+def _advance_version(session):
+    if has_versioning(session):
+        return session.execute(select([tables.config_version.next_value()])).scalar()
+
+
+class _SnapNode(object):
+    """In-memory copy of a Config row."""
+    __slots__ = ("id", "name", "value", "user_id", "testcase_id", "testsuite_id",
+            "children")
+
+    def __init__(self, id, name, value, user_id, testcase_id, testsuite_id):
+        self.id = id
+        self.name = name
+        self.value = value
+        self.user_id = user_id
+        self.testcase_id = testcase_id
+        self.testsuite_id = testsuite_id
+        self.children = {}
+
+    def __str__(self):
+        if self.value is NULL:
+            return "[%s]" % self.name
+        else:
+            return "%s=%r" % (self.name, self.value)
+
+    def matches(self, other):
+        """Has the same owner, test case, and test suite as other."""
+        return (self.user_id == other.user_id and
+                self.testcase_id == other.testcase_id and
+                self.testsuite_id == other.testsuite_id)
+
+
+class Snapshot(object):
+    """A subtree of the config table, loaded in memory.
+
+    Changes are made to the copy at once, and kept in order until commit.
+    The tree is reloaded if the version of the config tree has changed, when
+    checked at most every check_interval seconds (never, if None).
+    """
+    def __init__(self, session, node, check_interval=5.0):
+        self.session = session
+        self.check_interval = check_interval
+        self._nodes = {} # id -> _SnapNode
+        self._pending = []
+        self.load(node.id)
+        self.root = self._nodes[node.id]
+
+    def load(self, rootid=None):
+        """Load the subtree with one recursive query. Nodes already loaded
+        are updated in place. Changes not yet committed would be lost, so
+        they must be committed or rolled back first."""
+        if self._pending:
+            raise ConfigError("Commit or roll back the changes before reloading.")
+        if rootid is None:
+            rootid = self.root.id
+        self.version = get_version(self.session)
+        self._checked = time.time()
+        cfg = tables.config
+        subtree = select([cfg]).where(cfg.c.id == rootid).cte("subtree", recursive=True)
+        parent = subtree.alias()
+        child = cfg.alias()
+        subtree = subtree.union_all(select([child]).where(child.c.parent_id == parent.c.id))
+        nodes = self._nodes
+        rows = self.session.execute(select([subtree])).fetchall()
+        for row in rows:
+            node = nodes.get(row.id)
+            if node is None:
+                node = nodes[row.id] = _SnapNode(row.id, row.name, row.value,
+                        row.user_id, row.testcase_id, row.testsuite_id)
+            else:
+                node.name, node.value = row.name, row.value
+                node.user_id, node.testcase_id, node.testsuite_id = (row.user_id,
+                        row.testcase_id, row.testsuite_id)
+            node.children.clear()
+        for row in rows:
+            if row.id != rootid:
+                nodes[row.parent_id].children[row.name] = nodes[row.id]
+
+    def is_stale(self):
+        """Without a version, staleness is not known, so reload explicitly."""
+        if self.version is None:
+            return False
+        return get_version(self.session) != self.version
+
+    def check(self):
+        """Reload if the tree is stale, unless there are writes waiting."""
+        if self.check_interval is None or self._pending:
+            return
+        now = time.time()
+        if now - self._checked >= self.check_interval:
+            self._checked = now
+            if self.is_stale():
+                self.load()
+
+    def set(self, parent, name, value, user_id):
+        node = parent.children.get(name)
+        if node is None:
+            node = parent.children[name] = _SnapNode(None, name, value, user_id, None, None)
+            self._pending.append(("add", parent, node))
+        else:
+            node.value = value
+            self._pending.append(("set", parent, node))
+
+    def add_container(self, parent, name, user_id, testcase_id, testsuite_id):
+        if name in parent.children:
+            raise ConfigError("Container %r already exists." % (name,))
+        node = parent.children[name] = _SnapNode(None, name, NULL, user_id,
+                testcase_id, testsuite_id)
+        self._pending.append(("add", parent, node))
+        return node
+
+    def delete(self, parent, name):
+        node = parent.children.pop(name)
+        self._pending.append(("delete", parent, node))
+
+    def commit(self):
+        """Write the changes to the database, in one transaction."""
+        if not self._pending:
+            return
+        session = self.session
+        rows = {} # _SnapNode -> Config row
+        def get_row(node):
+            try:
+                return rows[node]
+            except KeyError:
+                row = rows[node] = session.query(Config).get(node.id)
+                return row
+        try:
+            for op, parent, node in self._pending:
+                if op == "add":
+                    row = rows[node] = models.create(Config, name=node.name, value=node.value,
+                            parent_id=get_row(parent).id, user_id=node.user_id,
+                            testcase_id=node.testcase_id, testsuite_id=node.testsuite_id)
+                    session.add(row)
+                    session.flush()
+                    node.id = row.id
+                    self._nodes[row.id] = node
+                elif op == "set":
+                    get_row(node).value = node.value
+                elif op == "delete":
+                    if node.id is not None:
+                        session.delete(get_row(node))
+                        session.flush()
+            _advance_version(session)
+            session.commit()
+        except IntegrityError as err:
+            session.rollback()
+            self.rollback()
+            raise ConfigError(str(err))
+        del self._pending[:]
+        self.load()
+
+    def rollback(self):
+        """Drop the changes not yet committed, and reload."""
+        del self._pending[:]
+        self.load()
+
+
 class Container(object):
     """Make a relational table quack like a dictionary."""
-    def __init__(self, session, configrow, user=None, testcase=None, testsuite=None):
+    def __init__(self, session, configrow, user=None, testcase=None, testsuite=None,
+            snapshot=None):
         self.__dict__[b"session"] = session
         self.__dict__[b"node"] = configrow
         self.__dict__[b"_user"] = user
         self.__dict__[b"_testcase"] = testcase
         self.__dict__[b"_testsuite"] = testsuite
+        self.__dict__[b"_snapshot"] = snapshot
 
     def __str__(self):
         if self.node.value is NULL:
             s = []
-            for ch in self.node.children:
+            if self._snapshot is not None:
+                children = self.node.children.values()
+            else:
+                children = self.node.children
+            for ch in children:
                 s.append(str(ch))
             return "(%s: %s)" % (self.node.name, ", ".join(s))
         else:
             return str(self.node)
 
+    def _child(self, item):
+        """Wrap a container node, or return the value."""
+        if item.value is NULL:
+            return Container(self.session, item,
+                    user=self._user, testcase=self._testcase, testsuite=self._testsuite,
+                    snapshot=self._snapshot)
+        return item.value
+
     def __setitem__(self, name, value):
+        snap = self._snapshot
+        if snap is not None:
+            snap.set(self.node, name, value, self._get_user_id())
+            return
         try:
             item = self.session.query(Config).filter(and_(Config.parent_id==self.node.id,
                 Config.name==name)).one()
         except NoResultFound:
             me = self.node
-            item = models.create(Config, name=name, value=value, container=me, user=self._user)
+            item = models.create(Config, name=name, value=value, container=me,
+                    user=self._get_user())
             self.session.add(item)
-            self.session.commit()
         else:
             item.value = value
             self.session.add(item)
-            self.session.commit()
+        _advance_version(self.session)
+        self.session.commit()
 
     def __getitem__(self, name):
+        snap = self._snapshot
+        if snap is not None:
+            snap.check()
+            item = self.node.children.get(name)
+            if item is None or not self._visible(item):
+                raise KeyError(name)
+            return self._child(item)
         try:
             item = self.session.query(Config).filter(self._get_item_filter(name)).one()
         except NoResultFound:
             raise KeyError(name)
-        if item.value is NULL:
-            return Container(self.session, item,
-                    user=self._user, testcase=self._testcase, testsuite=self._testsuite)
-        return item.value
+        return self._child(item)
 
     def __delitem__(self, name):
+        snap = self._snapshot
+        if snap is not None:
+            item = self.node.children.get(name)
+            if item is None or not self._visible(item):
+                raise KeyError(name)
+            snap.delete(self.node, name)
+            return
         try:
             item = self.session.query(Config).filter(self._get_item_filter(name)).one()
         except NoResultFound:
             raise KeyError(name)
         self.session.delete(item)
+        _advance_version(self.session)
         self.session.commit()
 
     value = property(lambda s: s.node.value)
@@ -130,7 +368,17 @@ class Container(object):
             self.__setitem__(key, default)
             return default
 
+    def _snap_children(self):
+        snap = self._snapshot
+        snap.check()
+        me = self.node
+        return [item for item in me.children.values() if item.matches(me)]
+
     def iterkeys(self):
+        if self._snapshot is not None:
+            for item in self._snap_children():
+                yield item.name
+            return
         for name, in self.session.query(Config.name).filter(and_(
             Config.parent_id==self.node.id,
             Config.user==self.node.user,
@@ -142,6 +390,10 @@ class Container(object):
         return list(self.iterkeys())
 
     def iteritems(self):
+        if self._snapshot is not None:
+            for item in self._snap_children():
+                yield item.name, item.value
+            return
         for name, value in self.session.query(Config.name, Config.value).filter(and_(
             Config.parent_id==self.node.id,
             Config.user==self.node.user,
@@ -153,6 +405,10 @@ class Container(object):
         return list(self.iteritems())
 
     def itervalues(self):
+        if self._snapshot is not None:
+            for item in self._snap_children():
+                yield item.value
+            return
         for value, in self.session.query(Config.value).filter(and_(
             Config.parent_id==self.node.id,
             Config.user==self.node.user,
@@ -168,6 +424,52 @@ class Container(object):
     def copy(self):
         return self.__class__(self.session, self.node)
 
+    # snapshot mode
+    def snapshot(self, check_interval=5.0):
+        """Return a copy of this container that has its whole subtree loaded
+        in memory. Reads are served from the copy, and writes are kept
+        until commit() is called, or the with block it is used in exits.
+        """
+        snap = Snapshot(self.session, self.node, check_interval)
+        new = self.copy()
+        new.__dict__[b"node"] = snap.root
+        new.__dict__[b"_user"] = self._user
+        new.__dict__[b"_testcase"] = self._testcase
+        new.__dict__[b"_testsuite"] = self._testsuite
+        new.__dict__[b"_snapshot"] = snap
+        return new
+
+    def commit(self):
+        if self._snapshot is not None:
+            self._snapshot.commit()
+        else:
+            self.session.commit()
+
+    def rollback(self):
+        if self._snapshot is not None:
+            self._snapshot.rollback()
+        else:
+            self.session.rollback()
+
+    def refresh(self):
+        """Reload the snapshot, if the config tree has changed since it was
+        loaded, or always if the database keeps no version. Changes must be
+        committed or rolled back first."""
+        snap = self._snapshot
+        if snap is not None and (snap.version is None or snap.is_stale()):
+            snap.load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self._snapshot is not None:
+            if exc_type is None:
+                self._snapshot.commit()
+            else:
+                self._snapshot.rollback()
+        return False
+
     # There might be some fancy SQL for all of this...
     def _get_user(self):
         if self._user:
@@ -178,6 +480,20 @@ class Container(object):
         else: #inherit
             return self.node.user
 
+    def _get_user_id(self):
+        if self._user:
+            if self._user.is_superuser:
+                return None
+            else:
+                return self._user.id
+        else: #inherit
+            return self.node.user_id
+
+    def _visible(self, item):
+        """The same test as _get_item_filter, for a snapshot node."""
+        user_id = self._get_user_id()
+        return user_id is None or item.user_id == user_id
+
     def _get_item_filter(self, name):
         user = self._get_user()
         if user is not None:
@@ -188,12 +504,19 @@ class Container(object):
     def add_container(self, name):
         me = self.node
         if me.value is NULL:
+            snap = self._snapshot
+            if snap is not None:
+                new = snap.add_container(me, name, self._get_user_id(),
+                        self._testcase.id if self._testcase else me.testcase_id,
+                        self._testsuite.id if self._testsuite else me.testsuite_id)
+                return self._child(new)
             new = models.create(Config, name=name, value=NULL, container=me,
                     user=self._get_user(),
                     testcase=self._testcase or me.testcase,
                     testsuite=self._testsuite or me.testsuite)
             try:
                 self.session.add(new)
+                _advance_version(self.session)
                 self.session.commit()
             except IntegrityError as err:
                 self.session.rollback()
@@ -204,10 +527,15 @@ class Container(object):
             raise ConfigError("Cannot add container to value pair.")
 
     def get_container(self, name):
-        c = self.session.query(Config).filter(self._get_item_filter(name)).one()
+        if self._snapshot is not None:
+            self._snapshot.check()
+            c = self.node.children.get(name)
+            if c is None or not self._visible(c):
+                raise NoResultFound("No row was found for one()")
+        else:
+            c = self.session.query(Config).filter(self._get_item_filter(name)).one()
         if c.value is NULL:
-            return Container(self.session, c,
-                    user=self._user, testcase=self._testcase, testsuite=self._testsuite)
+            return self._child(c)
         else:
             raise ConfigError("Container %r not found." % (name,))
 
@@ -216,6 +544,9 @@ class Container(object):
 
     def __iter__(self):
         me = self.node
+        if self._snapshot is not None:
+            self.__dict__[b"_set"] = iter(self._snap_children())
+            return self
         self.__dict__[b"_set"] = iter(self.session.query(Config).filter(and_(
             Config.parent_id==me.id,
             Config.user==me.user,
@@ -238,9 +569,15 @@ class Container(object):
         except AttributeError:
             node = self.__dict__[b"node"]
             session = self.__dict__[b"session"]
+            snap = self.__dict__[b"_snapshot"]
+            if snap is not None:
+                snap.check()
+                item = node.children.get(key)
+                if item is None or not self._visible(item):
+                    raise AttributeError("Container: No attribute or key '%s' found." % (key,))
+                return self._child(item)
             try:
-                item = session.query(Config).filter(and_(
-                        Config.container==node, Config.name==key)).one()
+                item = session.query(Config).filter(self._get_item_filter(key)).one()
                 if item.value is NULL:
                     return Container(session, item,
                         user=self._user, testcase=self._testcase, testsuite=self._testsuite)
@@ -265,6 +602,10 @@ class Container(object):
 
     def has_key(self, key):
         me = self.node
+        if self._snapshot is not None:
+            self._snapshot.check()
+            item = me.children.get(key)
+            return item is not None and item.matches(me)
         q = self.session.query(Config).filter(and_(
                 Config.name==key,
                 Config.parent_id==me.id,
@@ -304,8 +645,16 @@ class Container(object):
 
     def set_owner(self, user):
         if self._user is not None and self._user.is_superuser:
-            if self.node.container is not None:
-                self.node.set_owner(self.session, user)
+            if self._snapshot is not None:
+                if self.node.id is None:
+                    raise ConfigError("Commit the snapshot before changing ownership.")
+                row = self.session.query(Config).get(self.node.id)
+            else:
+                row = self.node
+            if row.container is not None:
+                row.set_owner(self.session, user)
+                if self._snapshot is not None:
+                    self.node.user_id = row.user_id
             else:
                 raise ConfigError("Root container can't be owned.")
         else:
@@ -40,6 +40,7 @@ from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.ext.associationproxy import association_proxy
 
 from pycopia.aid import hexdigest, unhexdigest, Enums, removedups, NULL
+from pycopia.ipv4 import NetworkTable
 
 from pycopia.db import tables
 from pycopia.db.types import validate_value_type, OBJ_TESTRUNNER, OBJ_TESTSUITE
@@ -63,16 +64,33 @@ def create_sessionmaker(url=None):
     tables.metadata.bind = db
     return sessionmaker(bind=db, autoflush=False)
 
-SessionMaker = create_sessionmaker()
+# The engine, and the session factory bound to it, are created when a session
+# is first wanted, not at import time. The mappers are configured then too, by
+# sqlalchemy, when the first query is made.
+class _SessionMaker_builder(object):
+
+    def __call__(self, **kwargs):
+        return _get_sessionmaker()(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(_get_sessionmaker(), name)
+
+def _get_sessionmaker():
+    global SessionMaker
+    if isinstance(SessionMaker, _SessionMaker_builder):
+        SessionMaker = create_sessionmaker()
+    return SessionMaker
+
+SessionMaker = _SessionMaker_builder()
 
 def get_session():
-    return SessionMaker()
+    return _get_sessionmaker()()
 
 
 class DatabaseContext(object):
 
     def __init__(self):
-        self._dbsessionclass = SessionMaker
+        self._dbsessionclass = _get_sessionmaker()
 
     def __enter__(self):
         self.dbsession = self._dbsessionclass()
@@ -441,6 +459,184 @@ mapper(Location, tables.location,
 
 ### general attributes
 
+class AttributeTypeCache(object):
+    """Map of attribute type names to ids, for each attribute type class.
+
+    Attribute types are rarely changed, so one map is shared by all sessions.
+    An unknown name reloads the map of that class, so new types are found.
+    """
+
+    def __init__(self):
+        self._ids = {}
+
+    def _load(self, session, typeclass):
+        ids = dict(session.query(typeclass.name, typeclass.id))
+        self._ids[typeclass] = ids
+        return ids
+
+    def clear(self, typeclass=None):
+        if typeclass is None:
+            self._ids.clear()
+        else:
+            self._ids.pop(typeclass, None)
+
+    def get_id(self, session, typeclass, name):
+        name = str(name)
+        try:
+            return self._ids[typeclass][name]
+        except KeyError:
+            pass
+        try:
+            return self._load(session, typeclass)[name]
+        except KeyError:
+            raise ModelAttributeError("No attribute type %r defined." % (name,))
+
+    def get_by_name(self, session, typeclass, name):
+        attrtype = session.query(typeclass).get(self.get_id(session, typeclass, name))
+        if attrtype is None: # removed since it was cached
+            self.clear(typeclass)
+            attrtype = session.query(typeclass).get(self.get_id(session, typeclass, name))
+        return attrtype
+
+    def get_by_names(self, session, typeclass, names):
+        """Return a dictionary of attribute type objects, keyed by name, fetched
+        with one query."""
+        ids = [self.get_id(session, typeclass, name) for name in names]
+        rv = {}
+        if ids:
+            for attrtype in session.query(typeclass).filter(typeclass.id.in_(ids)):
+                rv[attrtype.name] = attrtype
+        for name in names:
+            if str(name) not in rv:
+                rv[str(name)] = self.get_by_name(session, typeclass, name)
+        return rv
+
+attribute_types = AttributeTypeCache()
+
+
+class AttributeOwner(object):
+    """Attribute access for models that have an attribute table.
+
+    Subclasses set, after the attribute class is mapped:
+        _attribute_class       the mapped attribute class.
+        _attribute_type_class  the mapped attribute type class.
+        _attribute_owner       name of the attribute's relation to the owner.
+    """
+    _attribute_class = None
+    _attribute_type_class = None
+    _attribute_owner = None
+
+    @classmethod
+    def _attribute_owner_id(cls):
+        return getattr(cls._attribute_class, cls._attribute_owner + "_id")
+
+    def _attribute_query(self, session, attrname):
+        AC = self._attribute_class
+        typeid = attribute_types.get_id(session, self._attribute_type_class, attrname)
+        return session.query(AC).filter(and_(self._attribute_owner_id()==self.id,
+                            AC.type_id==typeid))
+
+    def _add_attribute(self, session, attrtype, value):
+        attrib = self._attribute_class()
+        attrib.type = attrtype # type first, value is validated with it.
+        attrib.value = value
+        # Owner before adding, or an autoflush would insert it without one.
+        setattr(attrib, self._attribute_owner, self)
+        session.add(attrib)
+
+    def update_attribute(self, session, attrname, value):
+        existing = self._attribute_query(session, attrname).first()
+        if existing is None:
+            attrtype = attribute_types.get_by_name(session, self._attribute_type_class, attrname)
+            self._add_attribute(session, attrtype, value)
+        else:
+            existing.value = value
+        session.commit()
+
+    def set_attribute(self, session, attrname, value):
+        attrtype = attribute_types.get_by_name(session, self._attribute_type_class, attrname)
+        self._add_attribute(session, attrtype, value)
+        session.commit()
+
+    def set_attributes(self, session, attrdict):
+        """Set or update the attributes in the attrdict mapping, with one
+        commit. Nothing is changed if any value is not valid."""
+        AC = self._attribute_class
+        types = attribute_types.get_by_names(session, self._attribute_type_class,
+                list(attrdict.keys()))
+        existing = {}
+        if types:
+            for attrib in session.query(AC).filter(and_(self._attribute_owner_id()==self.id,
+                        AC.type_id.in_([t.id for t in types.values()]))):
+                existing[attrib.type_id] = attrib
+        try:
+            for attrname, value in attrdict.items():
+                attrtype = types[str(attrname)]
+                attrib = existing.get(attrtype.id)
+                if attrib is None:
+                    self._add_attribute(session, attrtype, value)
+                else:
+                    attrib.value = value
+        except Exception:
+            session.rollback()
+            raise
+        session.commit()
+
+    def get_attribute(self, session, attrname):
+        AC = self._attribute_class
+        TC = self._attribute_type_class
+        row = session.query(AC.value).join(AC.type).filter(and_(
+                self._attribute_owner_id()==self.id, TC.name==str(attrname))).first()
+        if row is None:
+            attribute_types.get_id(session, TC, attrname) # raises if no such type
+            raise ModelAttributeError("No attribute %r set." % (attrname,))
+        return row[0]
+
+    def get_attributes(self, session, names=None):
+        """Return a dictionary of the attributes in names, or all attributes,
+        that are set. Uses one query."""
+        return self.get_attributes_for(session, [self], names)[self]
+
+    def get_all_attributes(self, session):
+        return self.get_attributes_for(session, [self])[self]
+
+    @classmethod
+    def get_attributes_for(cls, session, objects, names=None):
+        """Return a dictionary, keyed by object, of attribute dictionaries of
+        all the objects. Uses one query."""
+        AC = cls._attribute_class
+        TC = cls._attribute_type_class
+        ownerid = cls._attribute_owner_id()
+        rv = dict((obj, {}) for obj in objects)
+        byid = dict((obj.id, obj) for obj in objects)
+        if not byid:
+            return rv
+        q = session.query(ownerid, TC.name, AC.value).select_from(AC).join(AC.type).filter(
+                ownerid.in_(list(byid.keys())))
+        if names is not None:
+            names = [str(name) for name in names]
+            if not names:
+                return rv
+            q = q.filter(TC.name.in_(names))
+        for oid, name, value in q:
+            rv[byid[oid]][name] = value
+        return rv
+
+    def del_attribute(self, session, attrname):
+        attrib = self._attribute_query(session, attrname).first()
+        if attrib:
+            self.attributes.remove(attrib)
+            session.commit()
+
+    @classmethod
+    def get_attribute_list(cls, session):
+        return cls._attribute_type_class.get_attribute_list(session)
+
+    @classmethod
+    def get_attribute_class(cls):
+        return cls._attribute_type_class
+
+
 class AttributeType(object):
     ROW_DISPLAY = ("name", "value_type", "description")
 
@@ -449,11 +645,7 @@ class AttributeType(object):
 
     @classmethod
     def get_by_name(cls, session, name):
-        try:
-            attrtype = session.query(cls).filter(cls.name==str(name)).one()
-        except NoResultFound:
-            raise ModelAttributeError("No attribute type %r defined." % (name,))
-        return attrtype
+        return attribute_types.get_by_name(session, cls, name)
 
     @classmethod
     def get_attribute_list(cls, session):
@@ -533,11 +725,7 @@ class CorporateAttributeType(object):
 
     @classmethod
     def get_by_name(cls, session, name):
-        try:
-            attrtype = session.query(cls).filter(cls.name==str(name)).one()
-        except NoResultFound:
-            raise ModelAttributeError("No attribute type %r defined." % (name,))
-        return attrtype
+        return attribute_types.get_by_name(session, cls, name)
 
     @classmethod
     def get_attribute_list(cls, session):
@@ -550,56 +738,12 @@ mapper(CorporateAttributeType, tables.corp_attribute_type)
 
 
 
-class Corporation(object):
+class Corporation(AttributeOwner):
     ROW_DISPLAY = ("name",)
 
     def __str__(self):
         return str(self.name)
 
-    def update_attribute(self, session, attrname, value):
-        attrtype = CorporateAttributeType.get_by_name(session, str(attrname))
-        existing = session.query(CorporateAttribute).filter(and_(CorporateAttribute.corporation==self,
-                            CorporateAttribute.type==attrtype)).first()
-        if existing is None:
-            attrib = create(CorporateAttribute, corporation=self, type=attrtype, value=value)
-            session.add(attrib)
-            self.attributes.append(attrib)
-        else:
-            existing.value = value
-        session.commit()
-
-    def set_attribute(self, session, attrname, value):
-        attrtype = CorporateAttributeType.get_by_name(session, str(attrname))
-        attrib = create(CorporateAttribute, corporation=self, type=attrtype, value=value)
-        session.add(attrib)
-        self.attributes.append(attrib)
-        session.commit()
-
-    def get_attribute(self, session, attrname):
-        attrtype = CorporateAttributeType.get_by_name(session, str(attrname))
-        try:
-            ea = session.query(CorporateAttribute).filter(and_(CorporateAttribute.corporation==self,
-                            CorporateAttribute.type==attrtype)).one()
-        except NoResultFound:
-            raise ModelAttributeError("No attribute %r set." % (attrname,))
-        return ea.value
-
-    def del_attribute(self, session, attrtype):
-        attrtype = CorporateAttributeType.get_by_name(session, str(attrtype))
-        attrib = session.query(CorporateAttribute).filter(and_(
-                CorporateAttribute.corporation==self, CorporateAttribute.type==attrtype)).first()
-        if attrib:
-            self.attributes.remove(attrib)
-        session.commit()
-
-    @staticmethod
-    def get_attribute_list(session):
-        return CorporateAttributeType.get_attribute_list(session)
-
-    @staticmethod
-    def get_attribute_class():
-        return CorporateAttributeType
-
     def add_service(self, session, service):
         svc = session.query(FunctionalArea).filter(FunctionArea.name == service).one()
         self.services.append(svc)
@@ -638,6 +782,10 @@ mapper(CorporateAttribute, tables.corp_attributes,
     }
 )
 
+Corporation._attribute_class = CorporateAttribute
+Corporation._attribute_type_class = CorporateAttributeType
+Corporation._attribute_owner = "corporation"
+
 
 #######################################
 # Software model
@@ -676,56 +824,12 @@ mapper(SoftwareVariant, tables.software_variant,
 )
 
 
-class Software(object):
+class Software(AttributeOwner):
     ROW_DISPLAY = ("name", "category", "manufacturer", "vendor")
 
     def __repr__(self):
         return self.name
 
-    def update_attribute(self, session, attrname, value):
-        attrtype = AttributeType.get_by_name(session, str(attrname))
-        existing = session.query(SoftwareAttribute).filter(and_(SoftwareAttribute.software==self,
-                            SoftwareAttribute.type==attrtype)).first()
-        if existing is None:
-            attrib = create(SoftwareAttribute, software=self, type=attrtype, value=value)
-            session.add(attrib)
-            self.attributes.append(attrib)
-        else:
-            existing.value = value
-        session.commit()
-
-    def set_attribute(self, session, attrname, value):
-        attrtype = AttributeType.get_by_name(session, str(attrname))
-        attrib = create(SoftwareAttribute, software=self, type=attrtype, value=value)
-        session.add(attrib)
-        self.attributes.append(attrib)
-        session.commit()
-
-    def get_attribute(self, session, attrname):
-        attrtype = AttributeType.get_by_name(session, str(attrname))
-        try:
-            ea = session.query(SoftwareAttribute).filter(and_(SoftwareAttribute.software==self,
-                            SoftwareAttribute.type==attrtype)).one()
-        except NoResultFound:
-            raise ModelAttributeError("No attribute %r set." % (attrname,))
-        return ea.value
-
-    def del_attribute(self, session, attrtype):
-        attrtype = AttributeType.get_by_name(session, str(attrtype))
-        attrib = session.query(SoftwareAttribute).filter(and_(
-                SoftwareAttribute.software==self, SoftwareAttribute.type==attrtype)).first()
-        if attrib:
-            self.attributes.remove(attrib)
-            session.commit()
-
-    @staticmethod
-    def get_attribute_list(session):
-        return AttributeType.get_attribute_list(session)
-
-    @staticmethod
-    def get_attribute_class():
-        return AttributeType
-
 
 mapper (Software, tables.software,
     properties={
@@ -756,6 +860,10 @@ mapper(SoftwareAttribute, tables.software_attributes,
     },
 )
 
+Software._attribute_class = SoftwareAttribute
+Software._attribute_type_class = AttributeType
+Software._attribute_owner = "software"
+
 
 
 #######################################
@@ -792,6 +900,13 @@ class Network(object):
     def __repr__(self):
         return "Network(%r, %r, %r, %r)" % (self.name, self.layer, self.vlanid, self.ipnetwork)
 
+    @classmethod
+    def get_network_table(cls, session):
+        """Return an ipv4.NetworkTable of all the IP networks, with the
+        Network rows as values."""
+        q = session.query(cls).filter(cls.ipnetwork != None)
+        return NetworkTable.from_objects(q)
+
 mapper(Network, tables.networks,
     properties={
         "upperlayers": relationship(Network, backref=backref("lower",
@@ -800,56 +915,12 @@ mapper(Network, tables.networks,
 )
 
 
-class EquipmentModel(object):
+class EquipmentModel(AttributeOwner):
     ROW_DISPLAY = ("manufacturer", "name", "category")
 
     def __str__(self):
         return str(self.name)
 
-    def update_attribute(self, session, attrname, value):
-        attrtype = AttributeType.get_by_name(session, str(attrname))
-        existing = session.query(EquipmentModelAttribute).filter(and_(EquipmentModelAttribute.equipmentmodel==self,
-                            EquipmentModelAttribute.type==attrtype)).first()
-        if existing is None:
-            attrib = create(EquipmentModelAttribute, equipmentmodel=self, type=attrtype, value=value)
-            session.add(attrib)
-            self.attributes.append(attrib)
-        else:
-            existing.value = value
-        session.commit()
-
-    def set_attribute(self, session, attrname, value):
-        attrtype = AttributeType.get_by_name(session, str(attrname))
-        attrib = create(EquipmentModelAttribute, equipmentmodel=self, type=attrtype, value=value)
-        session.add(attrib)
-        self.attributes.append(attrib)
-        session.commit()
-
-    def get_attribute(self, session, attrname):
-        attrtype = AttributeType.get_by_name(session, str(attrname))
-        try:
-            ea = session.query(EquipmentModelAttribute).filter(and_(EquipmentModelAttribute.equipmentmodel==self,
-                            EquipmentModelAttribute.type==attrtype)).one()
-        except NoResultFound:
-            raise ModelAttributeError("No attribute %r set." % (attrname,))
-        return ea.value
-
-    def del_attribute(self, session, attrtype):
-        attrtype = AttributeType.get_by_name(session, str(attrtype))
-        attrib = session.query(EquipmentModelAttribute).filter(and_(
-                EquipmentModelAttribute.equipmentmodel==self, EquipmentModelAttribute.type==attrtype)).first()
-        if attrib:
-            self.attributes.remove(attrib)
-            session.commit()
-
-    @staticmethod
-    def get_attribute_list(session):
-        return AttributeType.get_attribute_list(session)
-
-    @staticmethod
-    def get_attribute_class():
-        return AttributeType
-
 
 mapper(EquipmentModel, tables.equipment_model,
     properties={
@@ -878,8 +949,12 @@ mapper(EquipmentModelAttribute, tables.equipment_model_attributes,
     },
 )
 
+EquipmentModel._attribute_class = EquipmentModelAttribute
+EquipmentModel._attribute_type_class = AttributeType
+EquipmentModel._attribute_owner = "equipmentmodel"
+
 
-class Equipment(object):
+class Equipment(AttributeOwner):
     ROW_DISPLAY = ("name", "model", "serno")
 
     def __str__(self):
@@ -888,50 +963,6 @@ class Equipment(object):
     def __unicode__(self):
         return self.name
 
-    def update_attribute(self, session, attrname, value):
-        attrtype = AttributeType.get_by_name(session, str(attrname))
-        existing = session.query(EquipmentAttribute).filter(and_(EquipmentAttribute.equipment==self,
-                            EquipmentAttribute.type==attrtype)).first()
-        if existing is None:
-            attrib = create(EquipmentAttribute, equipment=self, type=attrtype, value=value)
-            session.add(attrib)
-            self.attributes.append(attrib)
-        else:
-            existing.value = value
-        session.commit()
-
-    def set_attribute(self, session, attrname, value):
-        attrtype = AttributeType.get_by_name(session, str(attrname))
-        attrib = create(EquipmentAttribute, equipment=self, type=attrtype, value=value)
-        session.add(attrib)
-        self.attributes.append(attrib)
-        session.commit()
-
-    def get_attribute(self, session, attrname):
-        attrtype = AttributeType.get_by_name(session, str(attrname))
-        try:
-            ea = session.query(EquipmentAttribute).filter(and_(EquipmentAttribute.equipment==self,
-                            EquipmentAttribute.type==attrtype)).one()
-        except NoResultFound:
-            raise ModelAttributeError("No attribute %r set." % (attrname,))
-        return ea.value
-
-    def del_attribute(self, session, attrname):
-        attrtype = AttributeType.get_by_name(session, str(attrname))
-        attrib = session.query(EquipmentAttribute).filter(and_(
-                EquipmentAttribute.equipment==self, EquipmentAttribute.type==attrtype)).first()
-        if attrib:
-            self.attributes.remove(attrib)
-            session.commit()
-
-    @staticmethod
-    def get_attribute_list(session):
-        return AttributeType.get_attribute_list(session)
-
-    @staticmethod
-    def get_attribute_class():
-        return AttributeType
-
     # interface management
     def add_interface(self, session, name,
                 ifindex=None, interface_type=None, macaddr=None, ipaddr=None, network=None):
@@ -1033,6 +1064,10 @@ mapper(EquipmentAttribute, tables.equipment_attributes,
     },
 )
 
+Equipment._attribute_class = EquipmentAttribute
+Equipment._attribute_type_class = AttributeType
+Equipment._attribute_owner = "equipment"
+
 
 class Interface(object):
     ROW_DISPLAY = ("name", "ifindex", "interface_type", "equipment", "macaddr", "ipaddr", "network")
@@ -1088,11 +1123,7 @@ class EnvironmentAttributeType(object):
 
     @classmethod
     def get_by_name(cls, session, name):
-        try:
-            attrtype = session.query(cls).filter(cls.name==str(name)).one()
-        except NoResultFound:
-            raise ModelAttributeError("No attribute type %r defined." % (name,))
-        return attrtype
+        return attribute_types.get_by_name(session, cls, name)
 
     @classmethod
     def get_attribute_list(cls, session):
@@ -1103,56 +1134,12 @@ mapper(EnvironmentAttributeType, tables.environmentattribute_type,
 )
 
 
-class Environment(object):
+class Environment(AttributeOwner):
     ROW_DISPLAY = ("name", "owner")
 
     def __repr__(self):
         return self.name
 
-    def update_attribute(self, session, attrname, value):
-        attrtype = EnvironmentAttributeType.get_by_name(session, str(attrname))
-        existing = session.query(EnvironmentAttribute).filter(and_(EnvironmentAttribute.environment==self,
-                            EnvironmentAttribute.type==attrtype)).first()
-        if existing is None:
-            attrib = create(EnvironmentAttribute, environment=self, type=attrtype, value=value)
-            session.add(attrib)
-            self.attributes.append(attrib)
-        else:
-            existing.value = value
-        session.commit()
-
-    def set_attribute(self, session, attrname, value):
-        attrtype = EnvironmentAttributeType.get_by_name(session, str(attrname))
-        attrib = create(EnvironmentAttribute, environment=self, type=attrtype, value=value)
-        session.add(attrib)
-        self.attributes.append(attrib)
-        session.commit()
-
-    def get_attribute(self, session, attrname):
-        attrtype = EnvironmentAttributeType.get_by_name(session, str(attrname))
-        try:
-            ea = session.query(EnvironmentAttribute).filter(and_(EnvironmentAttribute.environment==self,
-                            EnvironmentAttribute.type==attrtype)).one()
-        except NoResultFound:
-            raise ModelAttributeError("No attribute %r set." % (attrname,))
-        return ea.value
-
-    def del_attribute(self, session, attrtype):
-        attrtype = EnvironmentAttributeType.get_by_name(session, str(attrtype))
-        attrib = session.query(EnvironmentAttribute).filter(and_(
-                EnvironmentAttribute.environment==self, EnvironmentAttribute.type==attrtype)).first()
-        if attrib:
-            self.attributes.remove(attrib)
-            session.commit()
-
-    @staticmethod
-    def get_attribute_list(session):
-        return EnvironmentAttributeType.get_attribute_list(session)
-
-    @staticmethod
-    def get_attribute_class():
-        return EnvironmentAttributeType
-
     equipment = association_proxy('testequipment', 'equipment')
 
     def get_equipment_with_role(self, session, rolename):
@@ -1254,6 +1241,10 @@ mapper(EnvironmentAttribute, tables.environment_attributes,
     },
 )
 
+Environment._attribute_class = EnvironmentAttribute
+Environment._attribute_type_class = EnvironmentAttributeType
+Environment._attribute_owner = "environment"
+
 
 
 #######################################
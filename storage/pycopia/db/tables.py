@@ -89,6 +89,10 @@ Index('index_config_parent_id', config.c.parent_id, unique=False)
 Index('index_config_user_id', config.c.user_id, unique=False)
 Index('index_config_testsuite_id', config.c.testsuite_id, unique=False)
 
+# Advanced on each change to the config tree, so that cached copies of it can
+# tell that they are stale.
+config_version = Sequence('config_version_seq', metadata=metadata, schema='public')
+
 
 contacts =  Table('contacts', metadata,
     Column('id', INTEGER(), primary_key=True, nullable=False),
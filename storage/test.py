@@ -26,6 +26,9 @@ from __future__ import division
 
 import unittest
 
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
 
 from pycopia import db
 from pycopia.db import types
@@ -34,15 +37,213 @@ from pycopia.db import models
 from pycopia.db import cli
 from pycopia.db import config
 #from pycopia.db import webhelpers
+from pycopia.aid import NULL
+
+
+def _attach_public(dbapi_connection, connection_record):
+    dbapi_connection.execute("ATTACH DATABASE ':memory:' AS public")
 
 
 class StorageTests(unittest.TestCase):
 
     def setUp(self):
-        pass
+        # Only the config table, in SQLite, which has no sequences. So this
+        # is also a database without the config version.
+        self.engine = sqlalchemy.create_engine("sqlite://")
+        event.listen(self.engine, "connect", _attach_public)
+        tables.metadata.create_all(self.engine, tables=[tables.config, tables.auth_user,
+                tables.corporations, tables.corp_attribute_type, tables.corp_attributes])
+        models.attribute_types.clear()
+        self.session = sessionmaker(bind=self.engine)()
+        root = models.create(models.Config, name="root", value=NULL)
+        self.session.add(root)
+        self.session.commit()
+        self.cf = config.Container(self.session, config.get_root(self.session))
+        self.cf["name"] = "first"
+        self.cf.add_container("sub")
+        self.cf.sub["level"] = 1
 
     def tearDown(self):
-        pass
+        self.session.close()
+        self.engine.dispose()
+
+    def _make_corporations(self):
+        session = self.session
+        for name, value_type in (("ports", "integer"), ("motto", "string"),
+                ("unused", "string")):
+            session.add(models.create(models.CorporateAttributeType, name=name,
+                    value_type=types.ValueType.enumerations.findstring(value_type)))
+        corps = [models.create(models.Corporation, name=name)
+                for name in ("Acme", "Initech", "Globex")]
+        session.add_all(corps)
+        session.commit()
+        return corps
+
+    def test_attributes(self):
+        session = self.session
+        acme, initech, globex = self._make_corporations()
+        acme.set_attribute(session, "ports", "8")
+        acme.update_attribute(session, "motto", "Ship it")
+        initech.update_attribute(session, "ports", 2)
+        self.assertEqual(acme.get_attribute(session, "ports"), 8)
+        self.assertEqual(acme.get_all_attributes(session), {"ports": 8, "motto": "Ship it"})
+        self.assertEqual(acme.get_attributes(session, ["motto"]), {"motto": "Ship it"})
+        found = models.Corporation.get_attributes_for(session, [acme, initech, globex])
+        self.assertEqual(found, {acme: {"ports": 8, "motto": "Ship it"},
+                initech: {"ports": 2}, globex: {}})
+        self.assertEqual(models.Corporation.get_attributes_for(session, [acme, initech],
+                ["ports"]), {acme: {"ports": 8}, initech: {"ports": 2}})
+        # Update one attribute and add another, with one commit.
+        initech.set_attributes(session, {"ports": "4", "motto": "Yeah"})
+        self.assertEqual(initech.get_all_attributes(session), {"ports": 4, "motto": "Yeah"})
+        acme.del_attribute(session, "motto")
+        self.assertEqual(acme.get_all_attributes(session), {"ports": 8})
+
+    def test_attributes_invalid(self):
+        session = self.session
+        acme, initech, globex = self._make_corporations()
+        acme.set_attribute(session, "ports", 8)
+        self.assertRaises(types.ValidationError, acme.set_attributes, session,
+                {"motto": "Ship it", "ports": "many"})
+        # Nothing was changed.
+        self.assertEqual(acme.get_all_attributes(session), {"ports": 8})
+        self.assertEqual(session.query(models.CorporateAttribute).count(), 1)
+
+    def test_attributes_missing(self):
+        session = self.session
+        acme, initech, globex = self._make_corporations()
+        # An attribute type that is not defined, and one that is not set.
+        self.assertRaises(models.ModelAttributeError, acme.get_attribute, session, "nosuch")
+        self.assertRaises(models.ModelAttributeError, acme.set_attributes, session,
+                {"nosuch": 1})
+        try:
+            acme.get_attribute(session, "unused")
+        except models.ModelAttributeError as err:
+            self.assertEqual(str(err), "No attribute 'unused' set.")
+        else:
+            self.fail("get_attribute of an unset attribute did not fail.")
+        try:
+            acme.get_attribute(session, "nosuch")
+        except models.ModelAttributeError as err:
+            self.assertEqual(str(err), "No attribute type 'nosuch' defined.")
+
+    def test_config_unversioned(self):
+        self.assertFalse(config.has_versioning(self.session))
+        self.assertTrue(config.get_version(self.session) is None)
+        self.assertTrue(config._advance_version(self.session) is None)
+        self.assertEqual(self.cf["name"], "first")
+
+    def test_config_snapshot_reads(self):
+        snap = self.cf.snapshot(check_interval=None)
+        self.assertTrue(snap._snapshot.version is None)
+        self.assertFalse(snap._snapshot.is_stale())
+        self.assertEqual(snap["name"], "first")
+        self.assertEqual(snap.sub["level"], 1)
+        self.assertEqual(sorted(snap.keys()), ["name", "sub"])
+        self.assertRaises(KeyError, snap.__getitem__, "missing")
+        # Changes made elsewhere are seen only after a reload.
+        self.cf["name"] = "second"
+        self.assertEqual(snap["name"], "first")
+        snap.refresh()
+        self.assertEqual(snap["name"], "second")
+
+    def test_config_snapshot_commit(self):
+        with self.cf.snapshot(check_interval=None) as snap:
+            snap["name"] = "changed"
+            snap["new"] = [1, 2]
+            snap.sub["level"] = 2
+            newsub = snap.add_container("newsub")
+            newsub["deep"] = "yes"
+            del snap["sub"]["level"]
+            # Pending writes are seen in the snapshot, but not yet stored.
+            self.assertEqual(snap["name"], "changed")
+            self.assertEqual(self.cf["name"], "first")
+        self.assertEqual(self.cf["name"], "changed")
+        self.assertEqual(self.cf["new"], [1, 2])
+        self.assertEqual(self.cf.newsub["deep"], "yes")
+        self.assertRaises(KeyError, self.cf.sub.__getitem__, "level")
+        self.assertEqual(snap.newsub["deep"], "yes")
+
+    def test_config_snapshot_rollback(self):
+        snap = self.cf.snapshot(check_interval=None)
+        snap["name"] = "changed"
+        snap.add_container("newsub")
+        snap.rollback()
+        self.assertEqual(snap["name"], "first")
+        self.assertFalse("newsub" in snap)
+        self.assertEqual(self.cf["name"], "first")
+        try:
+            with snap:
+                snap["name"] = "changed"
+                raise ValueError("abandon")
+        except ValueError:
+            pass
+        self.assertEqual(snap["name"], "first")
+        self.assertEqual(self.cf["name"], "first")
+
+    def test_config_owner(self):
+        session = self.session
+        users = {}
+        for name in ("alice", "bob"):
+            users[name] = models.create(models.User, username=name, first_name=name,
+                    last_name="Tester", authservice="local")
+        session.add_all(users.values())
+        session.commit()
+        alice = config.Container(session, config.get_root(session), user=users["alice"])
+        alice.add_container("private")
+        # Values take the owner of the container, with or without a snapshot.
+        anon = config.Container(session, config.get_root(session))
+        anon.private["plain"] = 1
+        with anon.snapshot(check_interval=None) as snap:
+            snap.private["snapped"] = 2
+        owners = dict(session.query(models.Config.name, models.Config.user_id).filter(
+                models.Config.name.in_(["private", "plain", "snapped"])))
+        self.assertEqual(owners, dict.fromkeys(["private", "plain", "snapped"],
+                users["alice"].id))
+        self.assertEqual(anon.private["plain"], 1)
+        self.assertEqual(sorted(alice.snapshot(check_interval=None).private.items()),
+                [("plain", 1), ("snapped", 2)])
+        # Other users do not see it, by item or by attribute.
+        bob = config.Container(session, config.get_root(session), user=users["bob"])
+        snap = bob.snapshot(check_interval=None)
+        for cf in (bob, snap):
+            self.assertRaises(KeyError, cf.__getitem__, "private")
+            self.assertRaises(AttributeError, getattr, cf, "private")
+
+    def test_config_snapshot_pending_reload(self):
+        snap = self.cf.snapshot(check_interval=None)
+        snap["new"] = "value"
+        self.assertRaises(config.ConfigError, snap.refresh)
+        self.assertEqual(snap["new"], "value")
+        snap.commit()
+        snap.refresh()
+        self.assertEqual(snap["new"], "value")
+
+    def test_config_version_query(self):
+        from sqlalchemy.dialects import postgresql
+        self.assertEqual(str(config._version_query(postgresql.dialect())),
+                "SELECT last_value FROM public.config_version_seq")
+
+    def test_config_snapshot_stale(self):
+        versions = [7]
+        saved = config.get_version
+        config.get_version = lambda session: versions[-1]
+        try:
+            snap = self.cf.snapshot(check_interval=0.0)
+            self.assertEqual(snap._snapshot.version, 7)
+            self.cf["name"] = "second"
+            # Same version, so the old value is still served.
+            self.assertEqual(snap["name"], "first")
+            versions.append(8)
+            self.assertTrue(snap._snapshot.is_stale())
+            self.assertEqual(snap["name"], "second")
+            self.assertEqual(snap._snapshot.version, 8)
+            # Not reloaded while there are writes waiting.
+            snap["name"] = "third"
+            versions.append(9)
+            self.assertEqual(snap["name"], "third")
+        finally:
+            config.get_version = saved
 
 
 